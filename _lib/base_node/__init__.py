@@ -31,6 +31,10 @@ CMD_ANALOG_WRITE            = 0x97
 # http://microfluidics.utoronto.ca/git/firmware___hv_switching_board.git)
 
 CMD_SET_PROGRAMMING_MODE    = 0xA0
+CMD_PERSISTENT_READ_BLOCK   = 0xA1
+CMD_PERSISTENT_WRITE_BLOCK  = 0xA2
+CMD_DIGITAL_WRITE_PORT      = 0xA3
+CMD_DIGITAL_READ_PORT       = 0xA4
 
 # reserved return codes
 RETURN_OK                   = 0x00
@@ -45,6 +49,12 @@ RETURN_BAD_VALUE            = 0x08
 RETURN_MAX_PAYLOAD_EXCEEDED = 0x09
 
 
+class CommandError(RuntimeError):
+    def __init__(self, return_code, error):
+        super().__init__('Error executing command. `%s`' % error)
+        self.return_code = return_code
+
+
 def replace(self, **kwargs):
     dict_ = OrderedDict((k, getattr(self, k)) for k in dir(self)[1:])
     dict_.update(**kwargs)
@@ -52,20 +62,82 @@ def replace(self, **kwargs):
 
 
 class Driver:
-    def __init__(self, i2c, addr):
+    '''
+    Parameters
+    ----------
+    i2c : machine.I2C
+        I2C driver handle.
+    addr : int
+        I2C address.
+    buffered : bool, optional
+        If ``True``, build commands in a preallocated transmit buffer and read
+        responses into a preallocated receive buffer.  Responses are then
+        returned as a ``memoryview`` that is only valid until the next
+        command.
+    gc_interval : int, optional
+        Run ``gc.collect()`` after every ``gc_interval`` commands.  If ``0``,
+        never collect.
+    settle_ms : int, optional
+        Time to wait after sending a command before reading the response.
+    poll_ms : int, optional
+        Interval between response polls in :meth:`_arun_command`.
+    poll_retries : int, optional
+        Number of times :meth:`_arun_command` polls a device that is not
+        ready before raising a ``RETURN_TIMEOUT`` :class:`CommandError`.
+    priority : int, optional
+        Bus lock priority used by :meth:`_arun_command` if ``i2c`` is an
+        ``i2c_bus.Bus``.
+
+    Attributes
+    ----------
+    command_count : int
+        Number of commands sent.
+    error_count : int
+        Number of commands that raised an exception.
+    last_latency_us : int
+        Duration of the most recent command, including the response.
+    '''
+    # Size of the preallocated buffers used in buffered mode.  Matches the
+    # 32-byte I2C buffer of the firmware.
+    BUFFER_SIZE = 32
+
+    def __init__(self, i2c, addr, buffered=False, gc_interval=1, settle_ms=1,
+                 poll_ms=1, poll_retries=10, priority=1):
         self.i2c = i2c
         self.addr = addr
+        # Commands sent from tasks hold the bus lock, if the bus has one.
+        self._lock = getattr(i2c, 'lock', None)
+        self.priority = priority
+        self.gc_interval = gc_interval
+        self.settle_ms = settle_ms
+        self.poll_ms = poll_ms
+        self.poll_retries = poll_retries
+        self.command_count = 0
+        self.error_count = 0
+        self.last_latency_us = 0
+        self._gc_count = 0
+        if buffered:
+            self._tx = bytearray(self.BUFFER_SIZE)
+            self._rx = bytearray(self.BUFFER_SIZE)
+            self._header = bytearray(2)
+            # Slicing a `memoryview` allocates, so create a view for every
+            # length up front.
+            tx = memoryview(self._tx)
+            rx = memoryview(self._rx)
+            self._tx_views = [tx[:i] for i in range(self.BUFFER_SIZE + 1)]
+            self._rx_views = [rx[:i] for i in range(self.BUFFER_SIZE + 1)]
+        else:
+            self._tx = None
 
-    def _run_command(self, cmd, *args, ignore_response=False):
-        self.i2c.writeto(self.addr, bytes((cmd, ) + args))
-        gc.collect()
-
-        if ignore_response:
-            return None
-
-        time.sleep(.001)
-        response = self.i2c.readfrom(self.addr, 2)
+    def _collect(self):
+        if self.gc_interval:
+            self._gc_count += 1
+            if self._gc_count >= self.gc_interval:
+                self._gc_count = 0
+                gc.collect()
 
+    def _check_response(self, response):
+        '''Return payload length from response header or raise error.'''
         payload_length, return_code = response
         if return_code == RETURN_OK:
             error = None
@@ -91,9 +163,133 @@ class Driver:
             error = 'RETURN_UNKNOWN_ERROR'
 
         if error:
-            raise RuntimeError('Error executing command. `%s`' % error)
+            raise CommandError(return_code, error)
+        return payload_length
+
+    def _write_command(self, cmd, args):
+        if self._tx is None:
+            self.i2c.writeto(self.addr, bytes((cmd, ) + args))
         else:
+            tx = self._tx
+            tx[0] = cmd
+            for i in range(len(args)):
+                tx[i + 1] = args[i]
+            self.i2c.writeto(self.addr, self._tx_views[len(args) + 1])
+        self._collect()
+
+    def _read_header(self):
+        if self._tx is None:
+            return self.i2c.readfrom(self.addr, 2)
+        self.i2c.readfrom_into(self.addr, self._header)
+        return self._header
+
+    def _read_payload(self, payload_length):
+        if self._tx is None:
             return self.i2c.readfrom(self.addr, payload_length)[:-1]
+        elif payload_length > self.BUFFER_SIZE:
+            raise CommandError(RETURN_MAX_PAYLOAD_EXCEEDED,
+                               'RETURN_MAX_PAYLOAD_EXCEEDED')
+        elif not payload_length:
+            return self._rx_views[0]
+        self.i2c.readfrom_into(self.addr, self._rx_views[payload_length])
+        return self._rx_views[payload_length - 1]
+
+    def _record(self, start):
+        self.command_count += 1
+        self.last_latency_us = time.ticks_diff(time.ticks_us(), start)
+
+    def _run_command(self, cmd, *args, ignore_response=False):
+        start = time.ticks_us()
+        try:
+            self._write_command(cmd, args)
+
+            if ignore_response:
+                return None
+
+            time.sleep_ms(self.settle_ms)
+            return self._read_payload(
+                self._check_response(self._read_header()))
+        except Exception:
+            self.error_count += 1
+            raise
+        finally:
+            self._record(start)
+
+    def _execute(self, n, ignore_response):
+        '''
+        Send the first ``n`` bytes of the transmit buffer as a command.
+
+        Only available in buffered mode.
+
+        Returns
+        -------
+        memoryview
+            Response payload, valid until the next command.
+        '''
+        start = time.ticks_us()
+        try:
+            self.i2c.writeto(self.addr, self._tx_views[n])
+            self._collect()
+
+            if ignore_response:
+                return None
+
+            time.sleep_ms(self.settle_ms)
+            return self._read_payload(
+                self._check_response(self._read_header()))
+        except Exception:
+            self.error_count += 1
+            raise
+        finally:
+            self._record(start)
+
+    async def _arun_command(self, cmd, *args, ignore_response=False):
+        '''
+        Variant of :meth:`_run_command` that yields to the event loop while
+        waiting for the response.
+
+        The response header is first read after ``settle_ms``.  While the
+        device is not ready (i.e., does not acknowledge or has not prepared a
+        response yet), it is polled again every ``poll_ms``, up to
+        ``poll_retries`` times.
+
+        If the bus has a lock, it is held from the command until the response
+        has been read, so other tasks cannot interleave their transfers.
+        '''
+        import uasyncio as asyncio
+
+        lock = self._lock
+        if lock is not None:
+            await lock.acquire(self.priority)
+        start = time.ticks_us()
+        try:
+            self._write_command(cmd, args)
+
+            if ignore_response:
+                return None
+
+            await asyncio.sleep_ms(self.settle_ms)
+            for i in range(self.poll_retries + 1):
+                if i:
+                    await asyncio.sleep_ms(self.poll_ms)
+                try:
+                    response = self._read_header()
+                except OSError:
+                    continue
+                # An idle bus reads back as `0xFF`, which is never a valid
+                # payload length.
+                if response[0] != 0xFF:
+                    return self._read_payload(self._check_response(response))
+            raise CommandError(RETURN_TIMEOUT, 'RETURN_TIMEOUT')
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.error_count += 1
+            raise
+        finally:
+            self._record(start)
+            if lock is not None:
+                lock.release()
 
 
 class BaseDriver(Driver):
@@ -103,23 +299,33 @@ class BaseDriver(Driver):
     CONFIG_STRUCT_SIZE = struct.calcsize(CONFIG_STRUCT_STR)
     Config = namedtuple('Config', 'version_major version_minor version_patch i2c_address programming_mode uuid pin_mode_bytes pin_state_bytes')
 
+    # Maximum number of bytes transferred by a single block command.  Keeps
+    # each packet within the 32-byte I2C buffer of the firmware.
+    PERSISTENT_BLOCK_SIZE = 16
+
+    def __init__(self, i2c, addr, **kwargs):
+        super().__init__(i2c, addr, **kwargs)
+        # `None` until the firmware has been probed for block command support.
+        self._block_io = None
+        # `None` until the firmware has been probed for port command support.
+        self._port_io = None
+
     @property
     def config(self):
-        data = b''.join([self.persistent_read(i)
-                         for i in range(self.CONFIG_STRUCT_SIZE)])
+        data = self.persistent_read_block(0, self.CONFIG_STRUCT_SIZE)
         return self.Config(*struct.unpack(self.CONFIG_STRUCT_STR, data))
 
     @config.setter
     def config(self, value):
-        for i, byte in enumerate(struct.pack(self.CONFIG_STRUCT_STR, *value)):
-            self.persistent_write(i, byte)
+        self.persistent_write_block(0, struct.pack(self.CONFIG_STRUCT_STR,
+                                                   *value))
 
     def load_config(self, use_defaults=False):
         self._run_command(CMD_LOAD_CONFIG, 1 if use_defaults else 0,
                           ignore_response=True)
 
     def _get_string(self, cmd):
-        return self._run_command(cmd).decode('utf-8')
+        return bytes(self._run_command(cmd)).decode('utf-8')
 
     def protocol_name(self):
         return self._get_string(CMD_GET_PROTOCOL_NAME)
@@ -147,7 +353,117 @@ class BaseDriver(Driver):
         return (response[0] != 0)
 
     def digital_write(self, pin, value):
-        self._run_command(CMD_DIGITAL_WRITE, pin, value, ignore_response=True)
+        if self._tx is None:
+            self._run_command(CMD_DIGITAL_WRITE, pin, value,
+                              ignore_response=True)
+        else:
+            # Fill the transmit buffer directly to skip the `*args` tuple.
+            tx = self._tx
+            tx[0] = CMD_DIGITAL_WRITE
+            tx[1] = pin
+            tx[2] = value
+            self._execute(3, True)
+
+    def _supports_port_io(self):
+        if self._port_io is None:
+            try:
+                self._run_command(CMD_DIGITAL_READ_PORT, 0)
+                self._port_io = True
+            except CommandError as exception:
+                if exception.return_code != RETURN_UNKNOWN_COMMAND:
+                    raise
+                self._port_io = False
+        return self._port_io
+
+    async def _asupports_port_io(self):
+        if self._port_io is None:
+            try:
+                await self._arun_command(CMD_DIGITAL_READ_PORT, 0)
+                self._port_io = True
+            except CommandError as exception:
+                if exception.return_code != RETURN_UNKNOWN_COMMAND:
+                    raise
+                self._port_io = False
+        return self._port_io
+
+    def digital_read_port(self, port):
+        '''
+        Read the state of all 8 pins of a port.
+
+        Falls back to one :meth:`digital_read` per pin if the firmware does
+        not support port commands.
+
+        Parameters
+        ----------
+        port : int
+            Port index, i.e., ``pin // 8``.
+
+        Returns
+        -------
+        int
+            Pin states, bit ``i`` for pin ``8 * port + i``.
+        '''
+        if not self._supports_port_io():
+            value = 0
+            for i in range(8):
+                if self.digital_read(8 * port + i):
+                    value |= 1 << i
+            return value
+        return self._run_command(CMD_DIGITAL_READ_PORT, port)[0]
+
+    def digital_write_port(self, port, mask, value):
+        '''
+        Set the state of several pins of a port in one command.
+
+        Falls back to one :meth:`digital_write` per masked pin if the
+        firmware does not support port commands.
+
+        Parameters
+        ----------
+        port : int
+            Port index, i.e., ``pin // 8``.
+        mask : int
+            Pins to set, bit ``i`` for pin ``8 * port + i``.  Other pins keep
+            their state.
+        value : int
+            New pin states, same bit order as ``mask``.
+        '''
+        if not self._supports_port_io():
+            for i in range(8):
+                if mask & (1 << i):
+                    self.digital_write(8 * port + i, (value >> i) & 1)
+        elif self._tx is None:
+            self._run_command(CMD_DIGITAL_WRITE_PORT, port, mask,
+                              value & mask, ignore_response=True)
+        else:
+            tx = self._tx
+            tx[0] = CMD_DIGITAL_WRITE_PORT
+            tx[1] = port
+            tx[2] = mask
+            tx[3] = value & mask
+            self._execute(4, True)
+
+    async def adigital_write_port(self, port, mask, value):
+        '''
+        Variant of :meth:`digital_write_port` based on :meth:`_arun_command`.
+        '''
+        if not await self._asupports_port_io():
+            for i in range(8):
+                if mask & (1 << i):
+                    await self._arun_command(CMD_DIGITAL_WRITE, 8 * port + i,
+                                             (value >> i) & 1,
+                                             ignore_response=True)
+        else:
+            await self._arun_command(CMD_DIGITAL_WRITE_PORT, port, mask,
+                                     value & mask, ignore_response=True)
+
+    async def adigital_read(self, pin):
+        response = await self._arun_command(CMD_DIGITAL_READ, pin)
+        return (response[0] != 0)
+
+    async def adigital_write(self, pin, value):
+        await self._arun_command(CMD_DIGITAL_WRITE, pin, value,
+                                 ignore_response=True)
 
     def analog_read(self, pin):
         response = self._run_command(CMD_ANALOG_READ, pin)
@@ -156,15 +472,94 @@ class BaseDriver(Driver):
     def analog_write(self, pin, value):
         self._run_command(CMD_ANALOG_WRITE, pin, value, ignore_response=True)
 
+    async def aanalog_read(self, pin):
+        response = await self._arun_command(CMD_ANALOG_READ, pin)
+        return struct.unpack('<h', response)
+
+    async def aanalog_write(self, pin, value):
+        await self._arun_command(CMD_ANALOG_WRITE, pin, value,
+                                 ignore_response=True)
+
     def pin_mode(self, pin, mode):
         self._run_command(CMD_SET_PIN_MODE, pin, mode, ignore_response=True)
 
     def persistent_read(self, address):
-        return self._run_command(CMD_PERSISTENT_READ,
-                                 *tuple(struct.pack('<h', address)))
+        return bytes(self._run_command(CMD_PERSISTENT_READ,
+                                       *tuple(struct.pack('<h', address))))
 
     def persistent_write(self, address, value):
         self._run_command(CMD_PERSISTENT_WRITE, *tuple(struct.pack('<hB',
                                                                    address,
                                                                    value)),
                           ignore_response=True)
+
+    def _persistent_read_block(self, address, length):
+        return bytes(self._run_command(CMD_PERSISTENT_READ_BLOCK,
+                                       *tuple(struct.pack('<hB', address,
+                                                          length))))
+
+    def _supports_block_io(self):
+        if self._block_io is None:
+            # Probe the firmware with a single byte read; older firmware only
+            # implements the per-byte persistent memory commands.
+            try:
+                self._persistent_read_block(0, 1)
+                self._block_io = True
+            except CommandError as exception:
+                if exception.return_code != RETURN_UNKNOWN_COMMAND:
+                    raise
+                self._block_io = False
+        return self._block_io
+
+    def persistent_read_block(self, address, length):
+        '''
+        Read a contiguous range of persistent memory.
+
+        Falls back to one :meth:`persistent_read` per byte if the firmware
+        does not support block commands.
+
+        Parameters
+        ----------
+        address : int
+            Address of first byte.
+        length : int
+            Number of bytes to read.
+
+        Returns
+        -------
+        bytes
+        '''
+        if not self._supports_block_io():
+            return b''.join([self.persistent_read(address + i)
+                             for i in range(length)])
+        chunks = []
+        for offset in range(0, length, self.PERSISTENT_BLOCK_SIZE):
+            n = min(self.PERSISTENT_BLOCK_SIZE, length - offset)
+            chunks.append(self._persistent_read_block(address + offset, n))
+        return b''.join(chunks)
+
+    def persistent_write_block(self, address, data):
+        '''
+        Write a contiguous range of persistent memory.
+
+        Falls back to one :meth:`persistent_write` per byte if the firmware
+        does not support block commands.
+
+        Parameters
+        ----------
+        address : int
+            Address of first byte.
+        data : bytes-like
+            Bytes to write.
+        '''
+        if not self._supports_block_io():
+            for i, byte in enumerate(data):
+                self.persistent_write(address + i, byte)
+            return
+        for offset in range(0, len(data), self.PERSISTENT_BLOCK_SIZE):
+            chunk = data[offset:offset + self.PERSISTENT_BLOCK_SIZE]
+            self._run_command(CMD_PERSISTENT_WRITE_BLOCK,
+                              *(tuple(struct.pack('<hB', address + offset,
+                                                  len(chunk))) +
+                                tuple(chunk)),
+                              ignore_response=True)
@@ -0,0 +1,180 @@
+import time
+
+import uasyncio as asyncio
+
+
+# Lock priorities.  Lower values are served first.
+PRIORITY_HIGH = 0  # Encoder/UI traffic.
+PRIORITY_NORMAL = 1  # Pumps, valves, configuration.
+
+
+class _Parked:
+    # Awaitable suspending the current task: the event loop does not
+    # reschedule a task yielding `False` (as for a pending I/O wait).
+    def __iter__(self):
+        yield False
+
+    # CPython awaits `__await__()` (see `sim.uasyncio_host`).
+    __await__ = __iter__
+
+
+_PARKED = _Parked()
+
+
+def park(task):
+    '''
+    Suspend the current task until :func:`wake` schedules it again.
+
+    The task is resumed early, with the exception, if it is cancelled (or
+    times out) in the meantime.
+
+    Parameters
+    ----------
+    task : generator
+        Current task, i.e., ``asyncio.get_event_loop().cur_task``.
+
+    Returns
+    -------
+    awaitable
+        Awaitable suspending the task, e.g., ``await park(task)``.
+    '''
+    task.pend_throw(False)
+    return _PARKED
+
+
+def wake(task):
+    '''
+    Schedule a task suspended by :func:`park`.
+
+    Parameters
+    ----------
+    task : generator
+        Suspended task.
+
+    Returns
+    -------
+    bool
+        ``False`` if the task had already been scheduled again, i.e., it was
+        cancelled (or timed out) while suspended.
+    '''
+    pending = task.pend_throw(None)
+    if pending is not False:
+        # Leave the exception to be thrown into the task.
+        task.pend_throw(pending)
+        return False
+    asyncio.get_event_loop().call_soon(task)
+    return True
+
+
+class BusLock:
+    '''
+    Lock serializing I2C transactions between tasks.
+
+    The lock is handed over in FIFO order, all ``PRIORITY_HIGH`` waiters
+    before any ``PRIORITY_NORMAL`` waiter.  Waiting tasks are suspended
+    (see :func:`park`) until :meth:`release` hands them the lock, so they
+    take no turns of the event loop while they wait.
+
+    Attributes
+    ----------
+    acquisitions : int
+        Number of times the lock was acquired.
+    contentions : int
+        Number of acquisitions that had to wait.
+    wait_us : int
+        Total time spent waiting for the lock, in microseconds.
+    max_wait_us : int
+        Longest single wait, in microseconds.
+    '''
+    def __init__(self):
+        self._locked = False
+        self._waiting = ([], [])
+        self._granted = None
+        self.acquisitions = 0
+        self.contentions = 0
+        self.wait_us = 0
+        self.max_wait_us = 0
+
+    def locked(self):
+        return self._locked
+
+    async def acquire(self, priority=PRIORITY_NORMAL):
+        self.acquisitions += 1
+        if not self._locked:
+            self._locked = True
+            return
+
+        start = time.ticks_us()
+        task = asyncio.get_event_loop().cur_task
+        queue = self._waiting[priority]
+        queue.append(task)
+        self.contentions += 1
+        try:
+            while self._granted is not task:
+                await park(task)
+        except BaseException:
+            # Cancelled while waiting.
+            if self._granted is task:
+                self._granted = None
+                self.release()
+            else:
+                queue.remove(task)
+            raise
+        self._granted = None
+        wait_us = time.ticks_diff(time.ticks_us(), start)
+        self.wait_us += wait_us
+        if wait_us > self.max_wait_us:
+            self.max_wait_us = wait_us
+
+    def release(self):
+        for queue in self._waiting:
+            for task in queue:
+                # Hand the lock directly to the next waiter.  Waiters
+                # cancelled meanwhile leave the queue when they resume.
+                if wake(task):
+                    queue.remove(task)
+                    self._granted = task
+                    return
+        self._locked = False
+
+
+class Bus:
+    '''
+    ``machine.I2C`` wrapper shared by all drivers on one bus.
+
+    Synchronous transfers are passed straight through.  Tasks that need
+    several transfers to complete one transaction (e.g., a command and its
+    response) must hold :attr:`lock` for the duration.
+
+    Parameters
+    ----------
+    i2c : machine.I2C
+        I2C driver handle.
+    '''
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self.lock = BusLock()
+
+    def scan(self):
+        return self.i2c.scan()
+
+    def writeto(self, addr, buf, stop=True):
+        return self.i2c.writeto(addr, buf, stop)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        return self.i2c.readfrom(addr, nbytes, stop)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        return self.i2c.readfrom_into(addr, buf, stop)
+
+    def stats(self):
+        '''
+        Returns
+        -------
+        dict
+            Lock statistics (see :class:`BusLock`).
+        '''
+        lock = self.lock
+        return {'acquisitions': lock.acquisitions,
+                'contentions': lock.contentions, 'wait_us': lock.wait_us,
+                'max_wait_us': lock.max_wait_us}
@@ -0,0 +1,88 @@
+'''
+Elapsed run time based on ``ticks_ms``.
+
+Unlike ``time.time()``, ticks are monotonic and have millisecond resolution,
+so they do not jump when the RTC is set.  They wrap around, however (every
+``2 ** 30`` ms, i.e., ~12.4 days, on the ESP32), and a single
+``ticks_diff()`` is only valid for half a period.  :class:`RunClock`
+accumulates the elapsed time every time it is read, so runs of any length
+are measured correctly as long as the clock is read at least once every
+``TICKS_MAX_READ_MS``.
+'''
+import time
+
+
+# Longest interval between two reads of a running `RunClock`.  Half of the
+# smallest ticks period of the supported ports.
+TICKS_MAX_READ_MS = (1 << 29) - 1
+
+
+class RunClock:
+    '''
+    Stopwatch with pause/resume, measuring elapsed time in milliseconds.
+
+    Parameters
+    ----------
+    clock : module, optional
+        Source of ``ticks_ms``/``ticks_diff``.
+
+    Attributes
+    ----------
+    running : bool
+        ``True`` between :meth:`start` and :meth:`stop`, including while
+        paused.
+    paused : bool
+    '''
+    def __init__(self, clock=time):
+        self.clock = clock
+        self.running = False
+        self.paused = False
+        self._elapsed = 0
+        self._last = 0
+
+    def _update(self):
+        if self.running and not self.paused:
+            now = self.clock.ticks_ms()
+            self._elapsed += self.clock.ticks_diff(now, self._last)
+            self._last = now
+
+    def start(self, elapsed_ms=0):
+        '''Start from zero, or from ``elapsed_ms`` to continue a run.'''
+        self.running = True
+        self.paused = False
+        self._elapsed = elapsed_ms
+        self._last = self.clock.ticks_ms()
+
+    def stop(self):
+        self._update()
+        self.running = False
+        self.paused = False
+
+    def pause(self):
+        self._update()
+        self.paused = True
+
+    def resume(self):
+        if self.paused:
+            self.paused = False
+            self._last = self.clock.ticks_ms()
+
+    def elapsed_ms(self):
+        '''
+        Returns
+        -------
+        int
+            Run time, excluding pauses.  Not bounded by the ticks period.
+        '''
+        self._update()
+        return self._elapsed
+
+    def hms(self):
+        '''
+        Returns
+        -------
+        tuple
+            Elapsed ``(hours, minutes, seconds)``.
+        '''
+        seconds = self.elapsed_ms() // 1000
+        return seconds // 3600, seconds // 60 % 60, seconds % 60
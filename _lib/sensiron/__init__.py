@@ -1,27 +1,195 @@
-import gc
+from array import array
 import struct
+import time
+
+import uasyncio as asyncio
+
+
+# Raw measurement counts per mL/min and per degree C.
+FLOW_SCALE = 500
+TEMPERATURE_SCALE = 200
+
+
+def _crc8_table():
+    table = bytearray(256)
+    for i in range(256):
+        crc = i
+        for bit in range(0, 8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x31) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+        table[i] = crc
+    return bytes(table)
+
+
+# CRC-8 (polynomial 0x31, initial value 0xFF) of each byte value, i.e.,
+# `CRC8_TABLE[crc ^ byte]` is the CRC after one more byte.
+CRC8_TABLE = _crc8_table()
 
 
 def crc8(buf):
     if len(buf) == 0:
         return 0
 
+    table = CRC8_TABLE
     crc = 0xFF
     for byte in buf:
-        for bit in range(0, 8):
-            if (byte ^ crc) & 0x80 :
-                crc = (crc << 1) ^ 0x31
-            else:
-                crc = ( crc << 1 )
-            byte = byte << 1
-        crc = crc & 0xFF
+        crc = table[crc ^ byte]
     return crc
 
 
+def crc8_word(buf, offset):
+    '''CRC of the 2 byte word at ``offset`` in ``buf``, without slicing.'''
+    table = CRC8_TABLE
+    return table[table[0xFF ^ buf[offset]] ^ buf[offset + 1]]
+
+
+def _check_words(buf, nbytes, table):
+    for i in range(0, nbytes, 3):
+        if table[table[0xFF ^ buf[i]] ^ buf[i + 1]] != buf[i + 2]:
+            return False
+    return True
+
+
+# Native code path, if the firmware has the viper code emitter (else
+# importing `_viper` raises `SyntaxError`) and it gives the CRC of the
+# datasheet example (0x92 for 0xBEEF).  Where `viper` is emulated (e.g., by
+# `sim.uasyncio_host`), `ptr8` is undefined.
+VIPER = False
+try:
+    from ._viper import check_words as _check_words_viper
+
+    if _check_words_viper(b'\xbe\xef\x92', 3, CRC8_TABLE):
+        _check_words = _check_words_viper
+        VIPER = True
+except (ImportError, SyntaxError, NameError):
+    pass
+
+
+def check_words(buf, nbytes=None):
+    '''
+    Check the CRC of each word of a Sensirion frame, without slicing.
+
+    Parameters
+    ----------
+    buf : bytes, bytearray or memoryview
+        Frame of 2 byte words, each followed by its CRC.
+    nbytes : int, optional
+        Length of the frame in ``buf``.  By default, all of ``buf``.
+
+    Returns
+    -------
+    bool
+        ``True`` if every CRC matches.
+    '''
+    if nbytes is None:
+        nbytes = len(buf)
+    return _check_words(buf, nbytes - nbytes % 3, CRC8_TABLE)
+
+
 class CrcError(Exception):
     pass            
 
 
+class FlowSamples:
+    '''
+    Fixed-size ring buffer of raw SLF3S measurements.
+
+    Samples are kept in preallocated arrays, so appending does not allocate.
+    Once full, the oldest sample is overwritten.
+
+    Parameters
+    ----------
+    size : int
+        Maximum number of samples kept.
+
+    Attributes
+    ----------
+    flow, temperature : array.array
+        Signed counts; divide by :data:`FLOW_SCALE` for mL/min and by
+        :data:`TEMPERATURE_SCALE` for degrees C.
+    flags : array.array
+        Signaling flags (see :meth:`SLF3S_1300F.get_measurement`).
+    ticks : array.array
+        ``time.ticks_ms()`` of each sample.
+    count : int
+        Number of samples appended since creation (or :meth:`clear`).
+    errors : int
+        Number of failed reads (bus or CRC errors) while streaming.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.flow = array('h', (0 for i in range(size)))
+        self.temperature = array('h', (0 for i in range(size)))
+        self.flags = array('H', (0 for i in range(size)))
+        self.ticks = array('I', (0 for i in range(size)))
+        self._views = (memoryview(self.flow), memoryview(self.temperature),
+                       memoryview(self.flags), memoryview(self.ticks))
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.errors = 0
+        self._index = 0
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def append(self, flow, temperature, flags, ticks):
+        i = self._index
+        self.flow[i] = flow
+        self.temperature[i] = temperature
+        self.flags[i] = flags
+        self.ticks[i] = ticks
+        self._index = 0 if i + 1 == self.size else i + 1
+        self.count += 1
+
+    def latest(self):
+        '''
+        Returns
+        -------
+        dict or None
+            Most recent sample, as returned by
+            :meth:`SLF3S_1300F.get_measurement` plus its ``ticks``, or
+            ``None`` if the buffer is empty.
+        '''
+        if not self.count:
+            return None
+        i = (self._index or self.size) - 1
+        flags = self.flags[i]
+        return {'flow': self.flow[i] / FLOW_SCALE,
+                'temperature': self.temperature[i] / TEMPERATURE_SCALE,
+                'air-in-line': flags & 1,
+                'high flow': flags >> 1 & 1,
+                'exp smoothing active': flags >> 5 & 1,
+                'ticks': self.ticks[i]}
+
+    def snapshot(self):
+        '''
+        Samples in the buffer, oldest first, without copying them.
+
+        The views are only valid until the next sample is appended, e.g.,
+        until the calling task yields to the streaming task.
+
+        Returns
+        -------
+        list[tuple]
+            Zero, one or two ``(flow, temperature, flags, ticks)`` tuples of
+            ``memoryview`` slices of the sample arrays.  The second tuple,
+            if any, follows the first in time.
+        '''
+        n = len(self)
+        start = (self._index - n) % self.size
+        if not n:
+            return []
+        elif start + n <= self.size:
+            return [tuple(view[start:start + n] for view in self._views)]
+        end = start + n - self.size
+        return [tuple(view[start:] for view in self._views),
+                tuple(view[:end] for view in self._views)]
+
+
 class SLF3S_1300F:
     # https://www.sensirion.com/fileadmin/user_upload/customers/sensirion/Dokumente/0_Datasheets/Liquid_Flow/Sensirion_Liquid_Flow_Sensor_SLF3S-1300F_Datasheet_EN_D1.pdf
     def __init__(self, i2c, addr=0x08):
@@ -29,17 +197,17 @@ class SLF3S_1300F:
         self.addr = addr
 
     def crc_check(self, result):
-        for i in range(0, len(result), 3):
-            if crc8(result[i:i+2]) != result[i+2]:
-                raise CrcError
+        if not check_words(result):
+            raise CrcError
 
     def get_device_info(self):
         self.i2c.writeto(self.addr, b'\x36\x7C')
         self.i2c.writeto(self.addr, b'\xE1\x02')
         result = self.i2c.readfrom(self.addr, 18)
         self.crc_check(result)
-        return {'product_number': struct.unpack('L', result[0:2] + result[3:5])[0],
-                'serial_number': struct.unpack('Q', result[6:8] + result[9:11] + result[12:14] + result[15:17])[0]}
+        # Words are sent most significant byte first.
+        return {'product_number': struct.unpack('>L', result[0:2] + result[3:5])[0],
+                'serial_number': struct.unpack('>Q', result[6:8] + result[9:11] + result[12:14] + result[15:17])[0]}
 
     @property
     def product_number(self):
@@ -63,12 +231,51 @@ class SLF3S_1300F:
     def soft_reset(self):
         self.i2c.write(b'\x00\x06')
 
+    async def stream(self, samples, period_ms=20, medium='water'):
+        '''
+        Start a continuous measurement and append a sample to ``samples``
+        every ``period_ms``, until cancelled.
+
+        Each sample is read into a preallocated buffer and decoded in place,
+        so streaming does not allocate.  Failed reads are counted in
+        ``samples.errors`` and skipped.
+
+        Parameters
+        ----------
+        samples : FlowSamples
+        period_ms : int, optional
+            Sampling period, in milliseconds.
+        medium : str, optional
+            See :meth:`start_continuous_measurement`.
+        '''
+        buf = bytearray(9)
+        self.start_continuous_measurement(medium)
+        try:
+            while True:
+                await asyncio.sleep_ms(period_ms)
+                try:
+                    self.i2c.readfrom_into(self.addr, buf)
+                except OSError:
+                    samples.errors += 1
+                    continue
+                if not check_words(buf, 9):
+                    samples.errors += 1
+                    continue
+                flow = buf[0] << 8 | buf[1]
+                temperature = buf[3] << 8 | buf[4]
+                samples.append(flow - 0x10000 if flow & 0x8000 else flow,
+                               temperature - 0x10000 if temperature & 0x8000
+                               else temperature, buf[6] << 8 | buf[7],
+                               time.ticks_ms())
+        finally:
+            self.stop_continuous_measurement()
+
     def get_measurement(self):
         result = self.i2c.readfrom(self.addr, 9)
         self.crc_check(result)
-        flags = struct.unpack('h', result[6:8])[0]
-        return {'flow': struct.unpack('h', result[0:2])[0] / 500.0, # mL/min
-                'temperature': struct.unpack('h', result[3:5])[0] / 200.0, # degrees C
+        flags = struct.unpack('>h', result[6:8])[0]
+        return {'flow': struct.unpack('>h', result[0:2])[0] / 500.0, # mL/min
+                'temperature': struct.unpack('>h', result[3:5])[0] / 200.0, # degrees C
                 'air-in-line': flags & 1,
                 'high flow': flags >> 1 & 1,
                 'exp smoothing active': flags >> 5 & 1}
\ No newline at end of file
@@ -0,0 +1,20 @@
+'''
+Native code paths of :mod:`sensiron`, compiled by the viper code emitter.
+
+Kept apart so that firmware without the emitter, on which the decorator is a
+``SyntaxError`` at compile time, fails to import this module only.
+'''
+import micropython
+
+
+@micropython.viper
+def check_words(buf, nbytes: int, crc8_table) -> bool:
+    '''See ``sensiron.check_words``.'''
+    data = ptr8(buf)
+    table = ptr8(crc8_table)
+    i = 0
+    while i < nbytes:
+        if table[table[0xFF ^ data[i]] ^ data[i + 1]] != data[i + 2]:
+            return False
+        i += 3
+    return True
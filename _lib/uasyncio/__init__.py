@@ -12,8 +12,8 @@ def set_debug(val):
   import logging
   log=logging.getLogger("uasyncio")
 class PollEventLoop(EventLoop):
- def __init__(self,runq_len=16,waitq_len=16,fast_io=0,lp_len=0):
-  EventLoop.__init__(self,runq_len,waitq_len,fast_io,lp_len)
+ def __init__(self,runq_len=16,waitq_len=16,fast_io=0,lp_len=0,overflow=OVERFLOW_ERROR,wheel=0):
+  EventLoop.__init__(self,runq_len,waitq_len,fast_io,lp_len,overflow,wheel)
   self.poller=select.poll()
   self.rdobjmap={}
   self.wrobjmap={}
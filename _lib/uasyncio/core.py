@@ -9,18 +9,88 @@ type_gen=type((lambda:(yield))())
 type_genf=type((lambda:(yield))) 
 DEBUG=0
 log=None
+STATS=0
+OVERFLOW_ERROR=0
+OVERFLOW_GROW=1
+MAX_QLEN=1024
+_QNAMES=('runq','waitq','ioq','lpq')
 def set_debug(val):
  global DEBUG,log
  DEBUG=val
  if val:
   import logging
   log=logging.getLogger("uasyncio.core")
+def set_stats(val):
+ global STATS
+ STATS=val
+def _name(coro):
+ s=repr(coro).split(' ')
+ return s[2].strip("'")if len(s)>2 else s[0]
 class CancelledError(Exception):
  pass
+class QueueFull(IndexError):
+ pass
 class TimeoutError(CancelledError):
  pass
+class TimerWheel:
+ def __init__(self,maxlen,slots=64):
+  assert slots&(slots-1)==0,'slots must be a power of 2.'
+  self.maxlen=maxlen
+  self._mask=slots-1
+  self._slots=[[]for i in range(slots)]
+  self._n=0
+  self._far=utimeq.utimeq(maxlen)
+  self._base=0
+  self._head=0
+ def __len__(self):
+  return self._n+len(self._far)
+ def __bool__(self):
+  return bool(self._n or self._far)
+ def push(self,t,callback,args):
+  if self._n+len(self._far)>=self.maxlen:
+   raise IndexError('queue overflow')
+  if not self._n:
+   self._base=time.ticks_ms()
+  d=time.ticks_diff(t,self._base)
+  if d>self._mask:
+   self._far.push(t,callback,args)
+   return
+  if d<0:
+   t=self._base
+  self._slots[t&self._mask].append((callback,args))
+  if not self._n or time.ticks_diff(t,self._head)<0:
+   self._head=t
+  self._n+=1
+ def _wheel_first(self):
+  return self._n and not(self._far and time.ticks_diff(self._far.peektime(),self._head)<=0)
+ def peektime(self):
+  if self._wheel_first():
+   return self._head
+  return self._far.peektime()
+ def pop(self,result):
+  if not self._wheel_first():
+   self._far.pop(result)
+   if time.ticks_diff(result[0],self._base)>0:
+    self._base=result[0]
+   return
+  t=self._head
+  slot=self._slots[t&self._mask]
+  result[0]=t
+  result[1],result[2]=slot.pop(0)
+  self._base=t
+  self._n-=1
+  if self._n and not slot:
+   while True:
+    t=time.ticks_add(t,1)
+    if self._slots[t&self._mask]:
+     break
+   self._head=t
 class EventLoop:
- def __init__(self,runq_len=16,waitq_len=16,ioq_len=0,lp_len=0):
+ def __init__(self,runq_len=16,waitq_len=16,ioq_len=0,lp_len=0,overflow=OVERFLOW_ERROR,wheel=0):
+  self.overflow=overflow
+  self.wheel=wheel
+  self.qlen=[runq_len,waitq_len,ioq_len,lp_len]
+  self.grows=0
   self.runq=ucollections.deque((),runq_len,True)
   self._max_od=0
   self.lpq=utimeq.utimeq(lp_len)if lp_len else None
@@ -31,8 +101,101 @@ class EventLoop:
    self._call_io=self._call_now
   else:
    self._call_io=self.call_soon
-  self.waitq=utimeq.utimeq(waitq_len)
+  self.waitq=self._timeq(1,waitq_len)
   self.cur_task=None
+  self.reset_stats()
+ def _timeq(self,i,n):
+  if i==1 and self.wheel:
+   return TimerWheel(n,self.wheel)
+  return utimeq.utimeq(n)
+ def compact(self):
+  c=self.canned
+  n=0
+  for i in(1,3):
+   old=getattr(self,_QNAMES[i])
+   if not(c and old):
+    continue
+   q=self._timeq(i,self.qlen[i])
+   e=[0,0,0]
+   while old:
+    old.pop(e)
+    tid=id(e[1])
+    if tid in c and isinstance(e[1],type_gen):
+     c.remove(tid)
+     n+=1
+    else:
+     q.push(e[0],e[1],e[2])
+   setattr(self,_QNAMES[i],q)
+  c.clear()
+  return n
+ def _cancelled(self,tid):
+  c=self.canned
+  c.add(tid)
+  if 4*len(c)>self.qlen[1]:
+   self.compact()
+ def _full(self,i):
+  if i&1 and self.canned:
+   self.compact()
+   if len(getattr(self,_QNAMES[i]))<self.qlen[i]:
+    return
+  n=self.qlen[i]
+  if self.overflow!=OVERFLOW_GROW or n>=MAX_QLEN:
+   raise QueueFull('%s full (%d entries): pass a larger %s_len to get_event_loop() or overflow=OVERFLOW_GROW'%(_QNAMES[i],n,('runq','waitq','ioq','lp')[i]))
+  n=min(2*n,MAX_QLEN)
+  old=getattr(self,_QNAMES[i])
+  if i&1:
+   q=self._timeq(i,n)
+   e=[0,0,0]
+   while old:
+    old.pop(e)
+    q.push(e[0],e[1],e[2])
+  else:
+   q=ucollections.deque((),n,True)
+   while old:
+    q.append(old.popleft())
+  setattr(self,_QNAMES[i],q)
+  self.qlen[i]=n
+  self.grows+=1
+ def reset_stats(self):
+  self._st_tasks={}
+  self._st_ids={}
+  self._st_due={}
+  self._st_hw=[0,0,0,0]
+  self._st_passes=0
+ def _st_queues(self):
+  hw=self._st_hw
+  n=len(self.runq)
+  if n>hw[0]:hw[0]=n
+  n=len(self.waitq)
+  if n>hw[1]:hw[1]=n
+  if self.ioq_len:
+   n=len(self.ioq)
+   if n>hw[2]:hw[2]=n
+  if self.lpq is not None:
+   n=len(self.lpq)
+   if n>hw[3]:hw[3]=n
+ def _st_run(self,cb,us):
+  st=self._st_ids.get(id(cb))
+  if st is None:
+   name=_name(cb)
+   st=self._st_tasks.get(name)
+   if st is None:
+    st=self._st_tasks[name]=[0,0,0,0,0]
+   self._st_ids[id(cb)]=st
+  st[0]+=1
+  st[1]+=us
+  if us>st[2]:st[2]=us
+  t=self._st_due.pop(id(cb),None)
+  if t is not None:
+   late=time.ticks_diff(self.time(),t)
+   st[3]+=late
+   if late>st[4]:st[4]=late
+ def stats(self):
+  tasks={}
+  for name,st in self._st_tasks.items():
+   tasks[name]={'runs':st[0],'run_us':st[1],'max_run_us':st[2],'late_ms':st[3],'max_late_ms':st[4]}
+  hw=self._st_hw
+  return{'tasks':tasks,'passes':self._st_passes,'grows':self.grows,'runq_max':hw[0],'waitq_max':hw[1],'ioq_max':hw[2],'lpq_max':hw[3]}
  def time(self):
   return time.ticks_ms()
  def create_task(self,coro):
@@ -41,9 +204,14 @@ class EventLoop:
  def _call_now(self,callback,*args): 
   if __debug__ and DEBUG:
    log.debug("Scheduling in ioq: %s",(callback,args))
+  gen=isinstance(callback,type_gen)
+  if len(self.ioq)+(1 if gen else 2)>self.qlen[2]:
+   self._full(2)
   self.ioq.append(callback)
-  if not isinstance(callback,type_gen):
+  if not gen:
    self.ioq.append(args)
+  if __debug__ and STATS:
+   self._st_queues()
  def max_overdue_ms(self,t=None):
   if t is not None:
    self._max_od=int(t)
@@ -54,17 +222,26 @@ class EventLoop:
   self.call_at_lp_(time.ticks_add(self.time(),int(delay*1000)),callback,*args)
  def call_at_lp_(self,time,callback,*args):
   if self.lpq is not None:
+   if len(self.lpq)>=self.qlen[3]:
+    self._full(3)
    self.lpq.push(time,callback,args)
    if isinstance(callback,type_gen):
     callback.pend_throw(id(callback))
+   if __debug__ and STATS:
+    self._st_queues()
   else:
    raise OSError('No low priority queue exists.')
  def call_soon(self,callback,*args):
   if __debug__ and DEBUG:
    log.debug("Scheduling in runq: %s",(callback,args))
+  gen=isinstance(callback,type_gen)
+  if len(self.runq)+(1 if gen else 2)>self.qlen[0]:
+   self._full(0)
   self.runq.append(callback)
-  if not isinstance(callback,type_gen):
+  if not gen:
    self.runq.append(args)
+  if __debug__ and STATS:
+   self._st_queues()
  def call_later(self,delay,callback,*args):
   self.call_at_(time.ticks_add(self.time(),int(delay*1000)),callback,args)
  def call_later_ms(self,delay,callback,*args):
@@ -74,9 +251,13 @@ class EventLoop:
  def call_at_(self,time,callback,args=()):
   if __debug__ and DEBUG:
    log.debug("Scheduling in waitq: %s",(time,callback,args))
+  if len(self.waitq)>=self.qlen[1]:
+   self._full(1)
   self.waitq.push(time,callback,args)
   if isinstance(callback,type_gen):
    callback.pend_throw(id(callback))
+  if __debug__ and STATS:
+   self._st_queues()
  def wait(self,delay):
   if __debug__ and DEBUG:
    log.debug("Sleeping for: %s",delay)
@@ -90,11 +271,15 @@ class EventLoop:
      self.canned.remove(tid)
     else:
      cur_task[1].pend_throw(None)
+     if __debug__ and STATS:
+      self._st_due[tid]=cur_task[0]
      self.call_soon(cur_task[1],*cur_task[2])
    else:
     self.call_soon(cur_task[1],*cur_task[2])
   while True:
    tnow=self.time()
+   if __debug__ and STATS:
+    self._st_passes+=1
    if self.lpq:
     to_run=False 
     t=self.lpq.peektime()
@@ -133,6 +318,8 @@ class EventLoop:
      else:
       cur_q=self.runq
       dl=1
+    elif cur_q is not self.runq:
+     cur_q=self.runq
     l-=dl
     cb=cur_q.popleft() 
     args=()
@@ -149,7 +336,16 @@ class EventLoop:
     delay=0
     low_priority=False 
     try:
-     if args is():
+     if __debug__ and STATS:
+      t0=time.ticks_us()
+      try:
+       if args is():
+        ret=next(cb) 
+       else:
+        ret=cb.send(*args)
+      finally:
+       self._st_run(cb,time.ticks_diff(time.ticks_us(),t0))
+     elif args is():
       ret=next(cb) 
      else:
       ret=cb.send(*args)
@@ -185,21 +381,25 @@ class EventLoop:
        assert False,"Unknown syscall yielded: %r (of type %r)"%(ret,type(ret))
      elif isinstance(ret,type_gen): 
       self.call_soon(ret) 
+     elif ret is False: 
+      continue
      elif isinstance(ret,int): 
       delay=ret
      elif ret is None:
       pass
-     elif ret is False:
-      continue
      else:
       assert False,"Unsupported coroutine yield value: %r (of type %r)"%(ret,type(ret))
     except StopIteration as e:
      if __debug__ and DEBUG:
       log.debug("Coroutine finished: %s",cb)
+     if __debug__ and STATS:
+      self._st_ids.pop(id(cb),None)
      continue
     except CancelledError as e:
      if __debug__ and DEBUG:
       log.debug("Coroutine cancelled: %s",cb)
+     if __debug__ and STATS:
+      self._st_ids.pop(id(cb),None)
      continue
     if low_priority:
      self.call_after_ms(delay,cb) 
@@ -255,10 +455,10 @@ class IOWriteDone(SysCall1):
  pass
 _event_loop=None
 _event_loop_class=EventLoop
-def get_event_loop(runq_len=16,waitq_len=16,ioq_len=0,lp_len=0):
+def get_event_loop(runq_len=16,waitq_len=16,ioq_len=0,lp_len=0,overflow=OVERFLOW_ERROR,wheel=0):
  global _event_loop
  if _event_loop is None:
-  _event_loop=_event_loop_class(runq_len,waitq_len,ioq_len,lp_len)
+  _event_loop=_event_loop_class(runq_len,waitq_len,ioq_len,lp_len,overflow,wheel)
  return _event_loop
 def get_running_loop():
  if _event_loop is None:
@@ -291,7 +491,7 @@ def cancel(coro):
  if prev is False: 
   _event_loop._call_io(coro)
  elif isinstance(prev,int): 
-  _event_loop.canned.add(prev) 
+  _event_loop._cancelled(prev) 
   _event_loop._call_io(coro) 
  else:
   assert prev is None
@@ -313,7 +513,7 @@ def wait_for_ms(coro,timeout):
    if prev is False: 
     _event_loop._call_io(timeout_obj.coro)
    elif isinstance(prev,int): 
-    _event_loop.canned.add(prev) 
+    _event_loop._cancelled(prev) 
     _event_loop._call_io(timeout_obj.coro) 
    else:
     assert prev is None
@@ -50,6 +50,34 @@ def is_file(path):
         return False
 
 
+def file_size(path):
+    '''Return size of file in bytes, or 0 if it does not exist.'''
+    try:
+        return os.stat(path)[6]
+    except OSError:
+        return 0
+
+
+def append_file(path, data):
+    '''Append bytes to end of file, creating the file if necessary.'''
+    with open(path, 'ab') as output:
+        output.write(data)
+
+
+def replace_file(src_path, dst_path):
+    '''Rename file, replacing the destination if it exists.
+
+    Unlike ``os.rename()`` on FAT file systems, works if ``dst_path``
+    exists.  If the device resets between removing ``dst_path`` and the
+    rename, only ``src_path`` is left.
+    '''
+    try:
+        os.rename(src_path, dst_path)
+    except OSError:
+        os.remove(dst_path)
+        os.rename(src_path, dst_path)
+
+
 def rmtree(directory):
     for entry in os.ilistdir(directory):
         is_dir = entry[1] == 0x4000
@@ -0,0 +1,120 @@
+'''
+Event loop overhead of the ``boot.py`` workload, replayed on the simulated
+bus.
+
+Runs the encoder poll (every 10 ms), the LED flash (every 25 ms) and
+``STEPS`` four-pump steps back to back through ``executor.StepExecutor``,
+with event loop statistics on (see ``uasyncio.core.set_stats()``).  Every
+pump must deliver its pulses and the encoder must be polled at least once
+per ``2 * POLL_MS`` on average.
+
+Reports the share of time the bus was busy, the loop passes and task runs,
+and the wall time they took, per pass, per task run and relative to the
+simulated run time.  Under CPython
+the ``uasyncio`` fork runs on ``sim.uasyncio_host`` and virtual time, so
+the wall time is the cost of the loop and the tasks on the workstation.
+
+Usage: ``micropython benchmarks/boot_workload.py``
+'''
+import harness
+
+import gc
+import time
+
+import uasyncio as asyncio
+import uasyncio.core
+
+from config import address_map
+from executor import StepExecutor
+from i2c_bus import PRIORITY_HIGH
+from pulse import PulseEngine
+from sim.i2c import FacesEncoderDevice
+from step_index import StepIndex
+
+
+STEPS = 4
+PULSES = 10
+ON_MS = 50
+OFF_MS = 150
+POLL_MS = 10
+LED_MS = 25
+LEDS = 12
+ENCODER_ADDR = 0x5E
+
+STEP_CONFIG = [{'name': 'Load',
+                'steps': [{'label': 'Load %d' % i,
+                           'pump': ['a', 'd', 'h', 'j'],
+                           'valves': [{'valve': 'k', 'path': i % 2}]}
+                          for i in range(STEPS)]}]
+
+
+async def encoder_poll(i2c, state):
+    while not state.get('done'):
+        await i2c.lock.acquire(PRIORITY_HIGH)
+        try:
+            i2c.readfrom(ENCODER_ADDR, 3)
+        finally:
+            i2c.lock.release()
+        await asyncio.sleep_ms(POLL_MS)
+
+
+async def flash_leds(i2c, state):
+    i = 0
+    while not state.get('done'):
+        await i2c.lock.acquire(PRIORITY_HIGH)
+        try:
+            i2c.writeto(ENCODER_ADDR, bytes((i % LEDS, 255, 0, 0)))
+        finally:
+            i2c.lock.release()
+        gc.collect()
+        i += 1
+        await asyncio.sleep_ms(LED_MS)
+
+
+async def main(i2c, executor, step_index, state):
+    loop = asyncio.get_event_loop()
+    loop.create_task(encoder_poll(i2c, state))
+    loop.create_task(flash_leds(i2c, state))
+    handles = []
+    for step in step_index:
+        channels = [(addr, pin, PULSES, ON_MS, OFF_MS)
+                    for addr, pin in step.pumps]
+        handles.append(await executor.apply(step, channels).wait())
+    state['done'] = True
+    await asyncio.sleep_ms(LED_MS)
+    return handles
+
+
+def run():
+    recorder, i2c = harness.rack()
+    encoder = recorder.attach(ENCODER_ADDR, FacesEncoderDevice())
+    uasyncio.core.set_stats(True)
+    loop = asyncio.get_event_loop()
+    engine = PulseEngine(i2c, max_channels=len(address_map))
+    executor = StepExecutor(i2c, engine)
+    step_index = StepIndex(STEP_CONFIG, address_map)
+
+    start_ms = time.ticks_ms()
+    start_us = harness.wall_us()
+    handles = loop.run_until_complete(main(i2c, executor, step_index, {}))
+    wall_us = time.ticks_diff(harness.wall_us(), start_us)
+    run_ms = time.ticks_diff(time.ticks_ms(), start_ms)
+    stats = loop.stats()
+    uasyncio.core.set_stats(False)
+
+    assert all(handle.ok for handle in handles)
+    assert all(result.channel.count == PULSES for handle in handles
+               for result in handle.results if result.kind == 'pump')
+    assert encoder.reports * 2 * POLL_MS >= run_ms
+    runs = sum(task['runs'] for task in stats['tasks'].values())
+    harness.report('boot_workload', steps=STEPS, run_ms=run_ms,
+                   encoder_polls=encoder.reports,
+                   bus_busy=recorder.busy_us() / (1000. * run_ms),
+                   passes=stats['passes'], task_runs=runs, wall_us=wall_us,
+                   us_per_pass=wall_us / stats['passes'],
+                   us_per_run=wall_us / runs,
+                   load=wall_us / (1000. * run_ms))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,146 @@
+'''
+Sixteen concurrent ``pump()`` tasks, one per output in
+``config.address_map``, sharing one simulated bus with tasks that read back
+board state (command plus response) and a high priority encoder poller.
+
+A read is counted as *interleaved* when another task wrote to the same
+device between the reader's command and its response; the reader then gets
+the wrong response or fails.  The run with the ``i2c_bus.Bus`` lock must
+have none; the run on the bare bus shows what the lock prevents.
+
+Reports the event loop passes and task runs (see
+``uasyncio.core.set_stats()``): tasks waiting for the lock are suspended, so
+they must not take a turn of the event loop on every pass.
+
+Usage: ``micropython benchmarks/bus_arbitration.py``
+'''
+import harness
+
+import time
+
+import uasyncio as asyncio
+import uasyncio.core
+
+from config import address_map
+import drivers
+import grove_i2c_motor as gm
+from i2c_bus import PRIORITY_HIGH
+from pump import pump
+from sim.i2c import I2C
+
+
+PULSES = 10
+ENCODER_ADDR = 0x5E
+OUTPUT_PINS = (gm.IN1, gm.IN2, gm.IN3, gm.IN4)
+
+
+class Encoder:
+    def write(self, data):
+        pass
+
+    def read(self, n):
+        return bytes(n)
+
+
+class RecordingI2C(I2C):
+    '''Track which task last wrote to each device.'''
+    def __init__(self):
+        super().__init__()
+        self.last_writer = {}
+        self.interleaved = 0
+
+    def writeto(self, addr, buf, stop=True):
+        self.last_writer[addr] = asyncio.get_event_loop().cur_task
+        return super().writeto(addr, buf, stop)
+
+    def _check(self, addr):
+        if self.last_writer.get(addr) is not \
+                asyncio.get_event_loop().cur_task:
+            self.interleaved += 1
+
+    def readfrom(self, addr, nbytes, stop=True):
+        self._check(addr)
+        return super().readfrom(addr, nbytes, stop)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        self._check(addr)
+        return super().readfrom_into(addr, buf, stop)
+
+
+async def monitor(i2c, addr, state):
+    driver = drivers.get_driver(i2c, addr)
+    while state['running']:
+        for pin in OUTPUT_PINS:
+            try:
+                await driver.adigital_read(pin)
+            except Exception:
+                state['failed_reads'] += 1
+        await asyncio.sleep_ms(5)
+
+
+async def encoder_poll(i2c, state):
+    lock = getattr(i2c, 'lock', None)
+    buffer = bytearray(3)
+    while state['running']:
+        if lock is not None:
+            await lock.acquire(PRIORITY_HIGH)
+        try:
+            i2c.writeto(ENCODER_ADDR, buffer)
+            i2c.readfrom_into(ENCODER_ADDR, buffer)
+        finally:
+            if lock is not None:
+                lock.release()
+        await asyncio.sleep_ms(10)
+
+
+async def run_pump(i2c, output, state):
+    await pump(i2c, output['addr'], OUTPUT_PINS[output['index']], PULSES)
+    state['pumps'] -= 1
+
+
+async def main(i2c, state):
+    loop = asyncio.get_event_loop()
+    for output in address_map.values():
+        loop.create_task(run_pump(i2c, output, state))
+    for addr in sorted(set(output['addr']
+                           for output in address_map.values())):
+        loop.create_task(monitor(i2c, addr, state))
+    loop.create_task(encoder_poll(i2c, state))
+    while state['pumps']:
+        await asyncio.sleep_ms(50)
+    state['running'] = False
+    await asyncio.sleep_ms(50)
+
+
+def run(locked):
+    recorder, i2c = harness.rack(recorder=RecordingI2C(), locked=locked,
+                                 init=False, not_ready_reads=1)
+    recorder.attach(ENCODER_ADDR, Encoder())
+
+    state = {'pumps': len(address_map), 'running': True, 'failed_reads': 0}
+    uasyncio.core.set_stats(True)
+    loop = asyncio.get_event_loop(runq_len=32, waitq_len=32)
+    start = time.ticks_ms()
+    loop.run_until_complete(main(i2c, state))
+    stats = loop.stats()
+    uasyncio.core.set_stats(False)
+    results = {'locked': locked, 'pumps': len(address_map),
+               'pulses': PULSES, 'transactions': recorder.transactions,
+               'interleaved_reads': recorder.interleaved,
+               'failed_reads': state['failed_reads'],
+               'duration_ms': time.ticks_diff(time.ticks_ms(), start),
+               'passes': stats['passes'],
+               'task_runs': sum(task['runs']
+                                for task in stats['tasks'].values())}
+    if locked:
+        results.update(i2c.stats())
+        assert recorder.interleaved == 0 and not state['failed_reads']
+        # Polling waiters would run on every pass, i.e., hundreds of times
+        # per transaction.
+        assert results['task_runs'] <= 2 * recorder.transactions
+    harness.report('bus_arbitration', **results)
+
+
+if __name__ == '__main__':
+    run(locked=True)
+    run(locked=False)
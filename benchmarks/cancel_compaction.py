@@ -0,0 +1,95 @@
+'''
+Cancelled tasks and the event loop queues.
+
+Each of ``ROUNDS`` rounds starts ``BATCH`` tasks that sleep for
+``SLEEP_HOURS`` hours, half with ``sleep()`` (wait queue) and half with
+``after()`` (low priority queue), and cancels them all.  The queues keep
+their default length and ``overflow=OVERFLOW_ERROR``.
+
+Cancelled entries must be compacted out of the queues, so every round must
+fit and the queues must never hold more than a bounded number of entries of
+cancelled tasks.  For comparison, the same run without compaction (entries
+kept until their deadline) must run out of queue space.
+
+Usage: ``micropython benchmarks/cancel_compaction.py``
+'''
+import harness
+
+import time
+
+import uasyncio as asyncio
+import uasyncio.core
+
+
+ROUNDS = 50
+BATCH = 8
+SLEEP_HOURS = 16
+QUEUE_LEN = 16
+
+
+class NoCompactEventLoop(uasyncio.core._event_loop_class):
+    # Previous behaviour: cancelled entries wait for their deadline.
+    def compact(self):
+        self.canned.clear()
+        return 0
+
+    def _cancelled(self, tid):
+        self.canned.add(tid)
+
+
+async def sleeper(low_priority):
+    if low_priority:
+        await asyncio.after(SLEEP_HOURS * 3600)
+    else:
+        await asyncio.sleep(SLEEP_HOURS * 3600)
+
+
+async def main(state):
+    loop = asyncio.get_event_loop()
+    for i in range(ROUNDS):
+        tasks = [sleeper(j & 1) for j in range(BATCH)]
+        for task in tasks:
+            loop.create_task(task)
+        # Let the tasks run up to their sleep.
+        await asyncio.sleep_ms(0)
+        for task in tasks:
+            asyncio.cancel(task)
+        await asyncio.sleep_ms(0)
+        state['queued'] = max(state['queued'],
+                              len(loop.waitq) + len(loop.lpq))
+        state['rounds'] += 1
+
+
+def run(mode):
+    event_loop_class = uasyncio.core._event_loop_class
+    if mode == 'no compaction':
+        uasyncio.core._event_loop_class = NoCompactEventLoop
+    uasyncio.core._event_loop = None
+    try:
+        loop = asyncio.get_event_loop(runq_len=4 * BATCH,
+                                      waitq_len=QUEUE_LEN,
+                                      lp_len=QUEUE_LEN)
+    finally:
+        uasyncio.core._event_loop_class = event_loop_class
+    state = {'rounds': 0, 'queued': 0}
+    start = time.ticks_ms()
+    error = None
+    try:
+        loop.run_until_complete(main(state))
+    except asyncio.QueueFull as exception:
+        error = str(exception)
+    run_ms = time.ticks_diff(time.ticks_ms(), start)
+    if mode == 'compaction':
+        assert error is None and state['rounds'] == ROUNDS
+        # Compacted once cancelled tasks fill a quarter of the wait queue.
+        assert state['queued'] <= QUEUE_LEN // 4
+    else:
+        assert error is not None and state['rounds'] < ROUNDS
+    harness.report('cancel_compaction', mode=mode, cancelled=state['rounds']
+                   * BATCH, max_queued=state['queued'], error=error,
+                   run_ms=run_ms)
+
+
+if __name__ == '__main__':
+    run('compaction')
+    run('no compaction')
@@ -0,0 +1,81 @@
+'''
+Heap allocations and ``gc.collect()`` calls per 1,000
+``BaseDriver.digital_write()`` calls, for the default and buffered command
+paths.
+
+Under MicroPython, allocations are measured as heap bytes (``gc.mem_alloc()``
+with the collector disabled).  CPython has no equivalent, so the number of
+distinct buffer objects handed to the bus is reported instead.
+
+Usage: ``python benchmarks/command_path.py``
+'''
+import harness
+
+import gc
+import sys
+import time
+
+import base_node
+from grove_i2c_motor import IN1
+from sim.i2c import BaseNodeDevice, I2C
+
+
+N = 1000
+
+
+class CountingGC:
+    def __init__(self):
+        self.collections = 0
+
+    def collect(self):
+        self.collections += 1
+
+
+class BufferCountingI2C(I2C):
+    def __init__(self):
+        super().__init__()
+        # Keep every buffer alive so that `id()` values are not recycled.
+        self.buffers = {}
+
+    def writeto(self, addr, buf, stop=True):
+        self.buffers[id(buf)] = buf
+        return super().writeto(addr, buf, stop)
+
+
+def run(buffered, gc_interval):
+    i2c = BufferCountingI2C()
+    i2c.attach(17, BaseNodeDevice(17))
+    driver = base_node.BaseDriver(i2c, 17, buffered=buffered,
+                                  gc_interval=gc_interval)
+    counting_gc = CountingGC()
+    base_node.gc = counting_gc
+    micropython = sys.implementation.name == 'micropython'
+    try:
+        if micropython:
+            gc.collect()
+            gc.disable()
+            heap_before = gc.mem_alloc()
+        start = harness.wall_us()
+        for i in range(N):
+            driver.digital_write(IN1, i & 1)
+        duration_us = time.ticks_diff(harness.wall_us(), start)
+        if micropython:
+            heap_bytes = gc.mem_alloc() - heap_before
+            gc.enable()
+    finally:
+        base_node.gc = gc
+
+    results = {'buffered': buffered, 'gc_interval': gc_interval,
+               'digital_writes': N, 'gc_collect_calls':
+               counting_gc.collections, 'buffers_allocated': len(i2c.buffers),
+               'duration_us': duration_us}
+    if micropython:
+        results['heap_bytes'] = heap_bytes
+    harness.report('command_path', **results)
+
+
+if __name__ == '__main__':
+    run(buffered=False, gc_interval=1)
+    run(buffered=True, gc_interval=1)
+    run(buffered=True, gc_interval=100)
+    run(buffered=True, gc_interval=0)
@@ -0,0 +1,46 @@
+'''
+Bus transactions needed to read and rewrite the configuration of a four
+board rack, with and without the block persistent memory commands.
+
+Usage: ``python benchmarks/config_io.py``
+'''
+import harness
+
+import time
+
+from base_node import BaseDriver
+from sim.i2c import BaseNodeDevice, I2C
+
+
+ADDRESSES = (15, 16, 17, 18)
+
+
+def run(block_io):
+    i2c = I2C()
+    drivers = []
+    for addr in ADDRESSES:
+        i2c.attach(addr, BaseNodeDevice(addr, block_io=block_io))
+        drivers.append(BaseDriver(i2c, addr))
+
+    start = harness.wall_us()
+    configs = [driver.config for driver in drivers]
+    read_us = time.ticks_diff(harness.wall_us(), start)
+    read_transactions = i2c.transactions
+
+    i2c.transactions = 0
+    start = harness.wall_us()
+    for driver, config in zip(drivers, configs):
+        driver.config = config
+    write_us = time.ticks_diff(harness.wall_us(), start)
+    write_transactions = i2c.transactions
+
+    for driver, config in zip(drivers, configs):
+        assert driver.config == config
+    harness.report('config_io', block_io=block_io, boards=len(drivers),
+                   read_transactions=read_transactions, read_us=read_us,
+                   write_transactions=write_transactions, write_us=write_us)
+
+
+if __name__ == '__main__':
+    run(block_io=False)
+    run(block_io=True)
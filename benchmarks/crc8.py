@@ -0,0 +1,81 @@
+'''
+CRC-8 of Sensirion frames: the bitwise loop (``sim.i2c.crc8``, as
+``sensiron.crc8`` used to be), the lookup table of ``sensiron.crc8`` and the
+slice-free frame check of ``sensiron.check_words``, natively compiled if the
+firmware has the viper code emitter.
+
+The table must match the bitwise loop for every byte value and for the test
+vector of the SLF3S datasheet (CRC of 0xBEEF is 0x92), and the frame check
+must accept intact ``sim.i2c.SLF3SDevice`` frames and reject each corrupt
+byte.  Reports the time to check one 9 byte measurement frame each way.
+
+Usage: ``micropython benchmarks/crc8.py``
+'''
+import harness
+
+import time
+
+import sensiron
+from sim.i2c import SLF3SDevice, crc8 as bitwise_crc8
+
+
+FRAMES = 2000
+# Test vectors, (data, CRC): the example of the SLF3S datasheet and the CRC
+# of a zero word.
+VECTORS = ((b'\xbe\xef', 0x92), (b'\x00\x00', 0x81))
+
+
+def frame():
+    device = SLF3SDevice()
+    device.write(b'\x36\x08')
+    device.flow = 12.5
+    device.temperature = 21.3
+    return bytes(device.read(9))
+
+
+def check():
+    for data, crc in VECTORS:
+        assert bitwise_crc8(data) == crc
+        assert sensiron.crc8(data) == crc
+        assert sensiron.crc8_word(data, 0) == crc
+        assert sensiron.check_words(data + bytes((crc, )))
+    for byte in range(256):
+        assert sensiron.crc8(bytes((byte, ))) == bitwise_crc8(bytes((byte, )))
+    buf = bytearray(frame())
+    assert sensiron.check_words(buf)
+    assert sensiron.check_words(memoryview(buf))
+    for i in range(len(buf)):
+        buf[i] ^= 0x10
+        assert not sensiron.check_words(buf)
+        buf[i] ^= 0x10
+    return buf
+
+
+def bitwise(buf):
+    for i in range(0, 9, 3):
+        if bitwise_crc8(buf[i:i + 2]) != buf[i + 2]:
+            return False
+    return True
+
+
+def table(buf):
+    crc8 = sensiron.crc8
+    for i in range(0, 9, 3):
+        if crc8(buf[i:i + 2]) != buf[i + 2]:
+            return False
+    return True
+
+
+def time_us(check, buf):
+    start = harness.wall_us()
+    for i in range(FRAMES):
+        assert check(buf)
+    return time.ticks_diff(harness.wall_us(), start) / FRAMES
+
+
+if __name__ == '__main__':
+    buf = check()
+    harness.report('crc8', frames=FRAMES, viper=sensiron.VIPER,
+                   bitwise_us=time_us(bitwise, buf),
+                   table_us=time_us(table, buf),
+                   check_words_us=time_us(sensiron.check_words, buf))
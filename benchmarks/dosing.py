@@ -0,0 +1,60 @@
+'''
+Pulse trains for the steps in ``config.steps`` that specify a ``volume``:
+the UI defaults used before volume dosing (50 pulses, 1 s period), the
+``DEFAULT_SETTINGS`` calibration, and an example per-pump calibration whose
+fastest rate delivers less per pulse.
+
+Reports the dosed volume and the duration of each transfer, and the cost of
+a calibration lookup.
+
+Usage: ``python benchmarks/dosing.py``
+'''
+import harness
+
+import time
+
+from config import DEFAULT_SETTINGS, steps
+import dosing
+
+
+EXAMPLE_POINTS = ((60, 21e-6), (150, 20e-6), (300, 17.5e-6))
+LOOKUPS = 1000
+
+
+def main():
+    calibrations = {
+        'default': dosing.default_calibration(),
+        'example': dosing.Calibration(EXAMPLE_POINTS),
+    }
+    for super_step in steps:
+        for step in super_step['steps']:
+            if 'volume' not in step or 'pulses' in step:
+                continue
+            volume = step['volume']
+            # UI defaults, without volume dosing.
+            harness.report('dosing', step=step['label'], calibration=None,
+                           volume=volume, pulses=50, period_ms=1000,
+                           dosed_volume=50 * DEFAULT_SETTINGS['L/pulse'],
+                           duration_s=50.)
+            for name, calibration in sorted(calibrations.items()):
+                (pulses, period_ms), = dosing.step_doses(
+                    step, {step['pump']: calibration})
+                dosed = pulses * calibration.volume_per_pulse(60e3 /
+                                                              period_ms)
+                harness.report('dosing', step=step['label'],
+                               calibration=name, volume=volume,
+                               pulses=pulses, period_ms=period_ms,
+                               dosed_volume=dosed,
+                               duration_s=pulses * period_ms / 1e3)
+
+    calibration = calibrations['example']
+    start = harness.wall_us()
+    for i in range(LOOKUPS):
+        calibration.volume_per_pulse(60 + i % 240)
+    harness.report('dosing_lookup', points=len(EXAMPLE_POINTS),
+                   lookup_us=time.ticks_diff(harness.wall_us(), start) /
+                   LOOKUPS)
+
+
+if __name__ == '__main__':
+    main()
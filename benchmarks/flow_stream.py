@@ -0,0 +1,154 @@
+'''
+Flow sensor sampling with ``sensiron.SLF3S_1300F.stream()`` into a
+``sensiron.FlowSamples`` ring buffer, against ``sim.i2c.SLF3SDevice``.
+
+Streams ``SAMPLES`` samples every ``PERIOD_MS`` into a buffer of ``SIZE``
+samples, while the simulated flow ramps.  The buffer must hold the latest
+``SIZE`` samples, oldest first across the two snapshot segments, and every
+sample must match the flow and temperature set when it was read.  Corrupt
+frames must be counted and skipped.
+
+Reports, for streaming and for polling ``get_measurement()`` from a task,
+the wall time and (under MicroPython) the heap allocated per sample.
+CPython has no equivalent of ``gc.mem_alloc()``, so no heap figure is
+reported there.
+
+Usage: ``micropython benchmarks/flow_stream.py``
+'''
+import harness
+
+import gc
+import sys
+import time
+
+import uasyncio as asyncio
+import uasyncio.core
+
+from sensiron import FLOW_SCALE, TEMPERATURE_SCALE, FlowSamples, SLF3S_1300F
+from sim.i2c import EdgeI2C, SLF3SDevice
+
+
+SAMPLES = 200
+SIZE = 64
+PERIOD_MS = 20
+CORRUPT = 5
+SENSOR_ADDR = 0x08
+MICROPYTHON = sys.implementation.name == 'micropython'
+
+
+def flow_at(i):
+    return -5 + .25 * i
+
+
+class RampI2C(EdgeI2C):
+    # Sets the simulated flow from the number of reads, and corrupts some.
+    def __init__(self):
+        super().__init__()
+        self.device = self.attach(SENSOR_ADDR, SLF3SDevice())
+        self.reads = 0
+        # Flow and temperature of each frame read intact.
+        self.read = []
+
+    def _ramp(self):
+        flow = flow_at(self.reads)
+        temperature = 20 + self.reads / 100
+        self.device.flow = flow
+        self.device.temperature = temperature
+        self.device.corrupt = SAMPLES <= self.reads < SAMPLES + CORRUPT
+        if not self.device.corrupt:
+            self.read.append((flow, temperature))
+        self.reads += 1
+
+    def readfrom(self, addr, nbytes, stop=True):
+        self._ramp()
+        return super().readfrom(addr, nbytes, stop)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        self._ramp()
+        return super().readfrom_into(addr, buf, stop)
+
+
+async def stream(sensor, samples):
+    task = sensor.stream(samples, PERIOD_MS)
+    asyncio.get_event_loop().create_task(task)
+    while samples.count < SAMPLES or samples.errors < CORRUPT:
+        await asyncio.sleep_ms(PERIOD_MS)
+    asyncio.cancel(task)
+    await asyncio.sleep_ms(0)
+
+
+async def poll(sensor, results):
+    sensor.start_continuous_measurement()
+    while len(results) < SAMPLES:
+        await asyncio.sleep_ms(PERIOD_MS)
+        results.append(sensor.get_measurement())
+    sensor.stop_continuous_measurement()
+
+
+def measure(main):
+    uasyncio.core._event_loop = None
+    loop = asyncio.get_event_loop()
+    if MICROPYTHON:
+        gc.collect()
+        gc.disable()
+        heap_before = gc.mem_alloc()
+    start = harness.wall_us()
+    loop.run_until_complete(main)
+    wall_us = time.ticks_diff(harness.wall_us(), start)
+    heap_bytes = None
+    if MICROPYTHON:
+        heap_bytes = gc.mem_alloc() - heap_before
+        gc.enable()
+    return wall_us, heap_bytes
+
+
+def check(i2c, samples):
+    assert i2c.device.medium is None
+    assert len(samples) == SIZE and samples.errors == CORRUPT
+    segments = samples.snapshot()
+    assert len(segments) == 2
+    flows = []
+    temperatures = []
+    ticks = []
+    for flow, temperature, flags, ticks_ in segments:
+        flows.extend(flow)
+        temperatures.extend(temperature)
+        ticks.extend(ticks_)
+    assert len(i2c.read) == samples.count
+    expected = i2c.read[-SIZE:]
+    assert [flow / FLOW_SCALE for flow in flows] == \
+        [flow for flow, temperature in expected]
+    assert all(abs(measured / TEMPERATURE_SCALE - temperature) <=
+               1 / TEMPERATURE_SCALE for measured, (flow, temperature)
+               in zip(temperatures, expected))
+    assert all(time.ticks_diff(b, a) > 0 for a, b in zip(ticks, ticks[1:]))
+    assert samples.latest()['flow'] == expected[-1][0]
+
+
+def run():
+    i2c = RampI2C()
+    samples = FlowSamples(SIZE)
+    wall_us, heap_bytes = measure(stream(SLF3S_1300F(i2c, SENSOR_ADDR),
+                                         samples))
+    check(i2c, samples)
+    harness.report('flow_stream', mode='stream', samples=samples.count,
+                   buffer=SIZE, errors=samples.errors,
+                   wall_us_per_sample=wall_us / samples.count,
+                   heap_bytes_per_sample=None if heap_bytes is None
+                   else heap_bytes / samples.count)
+
+    i2c = RampI2C()
+    results = []
+    wall_us, heap_bytes = measure(poll(SLF3S_1300F(i2c, SENSOR_ADDR),
+                                       results))
+    assert [result['flow'] for result in results] == \
+        [flow_at(i) for i in range(SAMPLES)]
+    harness.report('flow_stream', mode='get_measurement',
+                   samples=len(results),
+                   wall_us_per_sample=wall_us / len(results),
+                   heap_bytes_per_sample=None if heap_bytes is None
+                   else heap_bytes / len(results))
+
+
+if __name__ == '__main__':
+    run()
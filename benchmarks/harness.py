@@ -0,0 +1,88 @@
+'''
+Shared setup for the host-side benchmarks.
+
+Importing this module puts the repository root and ``_lib`` on
+``sys.path``.  Under CPython it also installs ``sim.uasyncio_host``, so the
+``uasyncio`` fork and the device code run unmodified on a virtual clock
+(``clock``); set ``SIM_REAL_TIME=1`` to follow the wall clock instead.  It
+must therefore be imported before ``uasyncio``.
+'''
+import json
+import sys
+import time
+
+ROOT = '/'.join(__file__.replace('\\', '/').split('/')[:-2]) or '.'
+for path in (ROOT, ROOT + '/_lib'):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+clock = None
+if sys.implementation.name != 'micropython':
+    import os
+
+    from sim.clock import Clock, TICKS_MAX
+    from sim import uasyncio_host
+
+    clock = uasyncio_host.install(Clock(real_time=bool(
+        os.environ.get('SIM_REAL_TIME'))))
+
+
+def wall_us():
+    '''``time.ticks_us()`` of the wall clock, even on the virtual clock.'''
+    if clock is None:
+        return time.ticks_us()
+    return int(time.perf_counter() * 1e6) & TICKS_MAX
+
+
+def rack(outputs=None, recorder=None, locked=True, init=True,
+         **device_kwargs):
+    '''
+    Simulated boards, bus and drivers, from scratch as after a reset of the
+    device, and no event loop.
+
+    Parameters
+    ----------
+    outputs : dict, optional
+        Outputs to attach a ``sim.i2c.BaseNodeDevice`` for, as
+        ``config.address_map`` (the default).
+    recorder : sim.i2c.I2C, optional
+        Simulated bus.  By default, a new ``sim.i2c.EdgeI2C``.
+    locked : bool, optional
+        If ``True``, drivers share the bus through ``i2c_bus.Bus``.
+    init : bool, optional
+        If ``True``, create the drivers with ``drivers.init_drivers()``.
+    **device_kwargs
+        Extra keyword arguments for ``sim.i2c.BaseNodeDevice``.
+
+    Returns
+    -------
+    tuple
+        ``(recorder, i2c)``: the simulated bus, and the bus handed to the
+        drivers.
+    '''
+    import uasyncio.core
+
+    import drivers
+    from i2c_bus import Bus
+    from sim.i2c import BaseNodeDevice, EdgeI2C
+
+    if outputs is None:
+        from config import address_map as outputs
+    if recorder is None:
+        recorder = EdgeI2C()
+    for output in outputs.values():
+        if output['addr'] not in recorder.devices:
+            recorder.attach(output['addr'],
+                            BaseNodeDevice(output['addr'], **device_kwargs))
+    i2c = Bus(recorder) if locked else recorder
+    drivers.reset()
+    if init:
+        drivers.init_drivers(i2c, outputs)
+    uasyncio.core._event_loop = None
+    return recorder, i2c
+
+
+def report(benchmark, **results):
+    '''Print one JSON record per result so runs can be diffed.'''
+    results['benchmark'] = benchmark
+    print(json.dumps(results, sort_keys=True))
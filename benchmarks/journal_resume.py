@@ -0,0 +1,159 @@
+'''
+Reset in the middle of a sequence, then resume it from the journal.
+
+A sequence alternates two pulse-train steps.  After a while the event
+loop, drivers and pulse engine are discarded, as on a reset of the device,
+and a new set is resumed from ``journal.Journal``, flushed every
+``config.JOURNAL_FLUSH_MS``.  The simulated boards must see every event of
+the sequence run once, and every pump must deliver its pulses:
+
+- reset in the middle of a step: with at most one flush interval worth of
+  pulses repeated;
+- reset just after a step completed, before the next flush: with no pulse
+  repeated, i.e., the completed step is not resumed.
+
+Also checks that a job recorded while the write buffer fills, and the
+journal is rewritten, is loaded with each of its channels once.
+
+Usage: ``micropython benchmarks/journal_resume.py``
+'''
+import harness
+
+import os
+
+import uasyncio as asyncio
+
+from config import JOURNAL_FLUSH_MS, address_map
+from journal import Journal, RECORD_SIZE
+from pulse import Channel, Job, PulseEngine
+from sequence import Sequence, SequenceRunner
+from sim.i2c import EdgeI2C
+from step_index import StepIndex
+
+
+JOURNAL_PATH = 'journal_resume.bin'
+# Reset times, in the middle of the `B -> A` step started at 25 s, and just
+# after it completed (its last pulse ends at 28.85 s).
+RESET_MID_STEP_MS = 27500
+RESET_STEP_DONE_MS = 28900
+PULSES = 20
+ON_MS = 50
+OFF_MS = 150
+
+STEPS = [{'name': 'Mix',
+          'steps': [{'label': 'A -> B', 'pump': 'a', 'pulses': PULSES},
+                    {'label': 'B -> A', 'pump': 'b', 'pulses': PULSES}]}]
+SEQUENCE = {'name': 'Mix A+B', 'duration_s': 60,
+            'events': [{'step': 'A -> B', 'offset_s': 0, 'repeat_s': 10},
+                       {'step': 'B -> A', 'offset_s': 5, 'repeat_s': 10}]}
+
+
+def boot(recorder, step_index, applied):
+    # Everything `boot.py` creates, from scratch.
+    recorder, i2c = harness.rack(recorder=recorder)
+    loop = asyncio.get_event_loop()
+    engine = PulseEngine(i2c, max_channels=len(address_map))
+    journal = Journal(JOURNAL_PATH, flush_ms=JOURNAL_FLUSH_MS)
+
+    def run_step(step, channels):
+        journal.job(step.index, engine.submit(channels))
+
+    def apply(step):
+        applied.append(step.label)
+        run_step(step, [(addr, pin, step.pulses, ON_MS, OFF_MS)
+                        for addr, pin in step.pumps])
+
+    runner = SequenceRunner(Sequence(SEQUENCE, step_index), apply)
+    journal.track(0, runner)
+    loop.create_task(journal.run())
+    return loop, journal, runner, engine, run_step
+
+
+async def wait(ms):
+    await asyncio.sleep_ms(ms)
+
+
+async def wait_done(runner, engine):
+    while runner.running or engine._active:
+        await asyncio.sleep_ms(100)
+
+
+def falling_edges(recorder, step_index):
+    counts = {}
+    for step in step_index:
+        for addr, pin in step.pumps:
+            edges = recorder.edges.get(addr, {}).get(pin, [])
+            counts[step.pump_names[0]] = sum(
+                1 for i in range(1, len(edges))
+                if edges[i - 1][1] and not edges[i][1])
+    return counts
+
+
+def buffer_overflow():
+    # Jobs longer than the buffer, the second one recorded when the journal
+    # is full.
+    if JOURNAL_PATH in os.listdir():
+        os.remove(JOURNAL_PATH)
+    journal = Journal(JOURNAL_PATH, buffer_records=2,
+                      max_size=6 * RECORD_SIZE)
+    jobs = [Job([Channel(None, 19, pin, PULSES, ON_MS, OFF_MS)
+                 for pin in range(4)], 0) for i in range(2)]
+    journal.job(0, jobs[0])
+    for channel in jobs[0].channels:
+        channel.count = PULSES
+        channel.done = True
+    jobs[0]._complete()
+    journal.job(1, jobs[1])
+    journal.flush()
+    recovered = journal.load()
+    os.remove(JOURNAL_PATH)
+    assert list(recovered.jobs) == [1], recovered.jobs
+    step_index, channels = recovered.jobs[1]
+    assert channels == [[19, pin, PULSES, ON_MS, OFF_MS, 0]
+                        for pin in range(4)], channels
+
+
+def run(reset_ms, max_repeated):
+    if JOURNAL_PATH in os.listdir():
+        os.remove(JOURNAL_PATH)
+    recorder = EdgeI2C()
+    step_index = StepIndex(STEPS, address_map)
+    applied = []
+
+    loop, journal, runner, engine, run_step = boot(recorder, step_index,
+                                                   applied)
+    runner.start()
+    loop.run_until_complete(wait(reset_ms))
+    applied_before = len(applied)
+    writes = journal.writes
+
+    loop, journal, runner, engine, run_step = boot(recorder, step_index,
+                                                   applied)
+    recovered = journal.load()
+    journal.resume(recovered,
+                   lambda i, channels: run_step(step_index[i], channels))
+    assert runner.running
+    loop.run_until_complete(wait_done(runner, engine))
+    size = os.stat(JOURNAL_PATH)[6]
+    os.remove(JOURNAL_PATH)
+
+    sequence = Sequence(SEQUENCE, step_index)
+    events = sum(len(range(offset, sequence.duration_ms, repeat_ms))
+                 for offset, repeat_ms, step in sequence.events)
+    per_pump = events // 2 * PULSES
+    pulses = falling_edges(recorder, step_index)
+    assert len(applied) == events, applied
+    for name, count in pulses.items():
+        assert per_pump <= count <= per_pump + max_repeated, (name, count)
+    harness.report('journal_resume', reset_ms=reset_ms, events=len(applied),
+                   events_before_reset=applied_before,
+                   resumed_jobs=len(recovered.jobs),
+                   pulses_expected=per_pump, pulses=pulses,
+                   max_repeated=max_repeated,
+                   writes_before_reset=writes, journal_bytes=size)
+
+
+if __name__ == '__main__':
+    buffer_overflow()
+    run(RESET_MID_STEP_MS, JOURNAL_FLUSH_MS // (ON_MS + OFF_MS))
+    run(RESET_STEP_DONE_MS, 0)
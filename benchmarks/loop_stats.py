@@ -0,0 +1,92 @@
+'''
+Event loop statistics (``uasyncio.core.set_stats()``) for a pulse engine
+job running next to a task that blocks the loop.
+
+Reports, per coroutine, the number of runs, the longest single run and the
+largest wakeup lateness, and the queue high-water marks.  The blocking task
+must show up as the longest run, and the lateness of the pulse engine must
+reflect it.
+
+Also reports the cost of an event loop pass with statistics off and on.
+
+Usage: ``micropython benchmarks/loop_stats.py``
+'''
+import harness
+
+import time
+
+import uasyncio as asyncio
+import uasyncio.core
+
+from config import address_map
+import grove_i2c_motor as gm
+from pulse import PulseEngine
+
+
+PULSES = 20
+ON_MS = 50
+OFF_MS = 150
+BLOCK_MS = 30
+BLOCK_INTERVAL_MS = 100
+PASSES = 2000
+OUTPUT_PINS = (gm.IN1, gm.IN2, gm.IN3, gm.IN4)
+
+
+async def hog(state):
+    while not state.get('done'):
+        time.sleep_ms(BLOCK_MS)
+        await asyncio.sleep_ms(BLOCK_INTERVAL_MS)
+
+
+async def pump_all(i2c, state):
+    engine = PulseEngine(i2c, max_channels=len(address_map))
+    asyncio.get_event_loop().create_task(hog(state))
+    job = engine.submit([(output['addr'], OUTPUT_PINS[output['index']],
+                          PULSES, ON_MS, OFF_MS)
+                         for output in address_map.values()])
+    await job.wait()
+    state['done'] = True
+    await asyncio.sleep_ms(BLOCK_INTERVAL_MS)
+
+
+async def spin():
+    for i in range(PASSES):
+        await asyncio.sleep_ms(0)
+
+
+def pass_us(stats):
+    uasyncio.core.set_stats(stats)
+    uasyncio.core._event_loop = None
+    loop = asyncio.get_event_loop()
+    start = harness.wall_us()
+    loop.run_until_complete(spin())
+    return time.ticks_diff(harness.wall_us(), start) / PASSES
+
+
+def run():
+    recorder, i2c = harness.rack()
+    uasyncio.core.set_stats(True)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(pump_all(i2c, {}))
+    stats = loop.stats()
+    uasyncio.core.set_stats(False)
+
+    tasks = stats.pop('tasks')
+    hog_ = [name for name in tasks if name.endswith('hog')][0]
+    engine = [name for name in tasks if name.endswith('_run')][0]
+    assert max(tasks, key=lambda name: tasks[name]['max_run_us']) == hog_
+    assert tasks[hog_]['max_run_us'] >= BLOCK_MS * 1000
+    assert tasks[engine]['max_late_ms'] > 0
+    for name in sorted(tasks):
+        harness.report('loop_stats', task=name, **tasks[name])
+    harness.report('loop_stats', **stats)
+
+    off_us = pass_us(False)
+    on_us = pass_us(True)
+    uasyncio.core.set_stats(False)
+    harness.report('loop_stats', passes=PASSES, pass_us_off=off_us,
+                   pass_us_on=on_us)
+
+
+if __name__ == '__main__':
+    run()
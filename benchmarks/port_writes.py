@@ -0,0 +1,153 @@
+'''
+Pulse edges of sixteen concurrent pumps, one per output in
+``config.address_map``, written pin by pin (``adigital_write``) or merged
+into port writes per board (``pump()`` through ``drivers.PortWriter``).
+
+Reports the number of bus transactions and the *edge skew*: the largest
+spread between the times at which the outputs of one board see the same
+pulse edge.  The merged runs are checked against firmware with and without
+the port commands.
+
+Also checks that tasks waiting on a merged write are not released as if it
+were sent: if the sending task is cancelled, a waiting task must send the
+pins; if the write fails, every waiting task must fail, even when the
+sending task starts another write right away.
+
+Usage: ``micropython benchmarks/port_writes.py``
+'''
+import harness
+
+import time
+
+import uasyncio as asyncio
+
+from config import address_map
+import drivers
+import grove_i2c_motor as gm
+from pump import pump
+
+
+PULSES = 10
+# Address without a board.
+MISSING_ADDR = 0x70
+OUTPUT_PINS = (gm.IN1, gm.IN2, gm.IN3, gm.IN4)
+
+
+async def pin_pump(i2c, i2c_address, pin, pulses, on_ms=50, off_ms=150):
+    # One command per edge, as `pump()` did before port writes.
+    driver = drivers.get_driver(i2c, i2c_address)
+    await asyncio.sleep_ms(0)
+    for i in range(pulses):
+        await driver.adigital_write(pin, 1)
+        await asyncio.sleep_ms(on_ms)
+        await driver.adigital_write(pin, 0)
+        await asyncio.sleep_ms(off_ms)
+
+
+async def main(i2c, pump_):
+    tasks = [pump_(i2c, output['addr'], OUTPUT_PINS[output['index']],
+                   PULSES) for output in address_map.values()]
+    loop = asyncio.get_event_loop()
+    state = {'pumps': len(tasks)}
+
+    async def run_pump(task):
+        await task
+        state['pumps'] -= 1
+
+    for task in tasks:
+        loop.create_task(run_pump(task))
+    while state['pumps']:
+        await asyncio.sleep_ms(20)
+
+
+def edge_skew_us(edges):
+    skew = 0
+    for pins in edges.values():
+        times = list(pins.values())
+        for i in range(2 * PULSES):
+            edge_times = [pin_edges[i][0] for pin_edges in times]
+            skew = max(skew, time.ticks_diff(max(edge_times),
+                                             min(edge_times)))
+    return skew
+
+
+def run(mode, port_io=True):
+    recorder, i2c = harness.rack(init=False, port_io=port_io)
+
+    pump_ = pin_pump if mode == 'pin' else pump
+    start = time.ticks_ms()
+    asyncio.get_event_loop(runq_len=32, waitq_len=32).run_until_complete(
+        main(i2c, pump_))
+    duration_ms = time.ticks_diff(time.ticks_ms(), start)
+
+    # Every output must see each pulse and end low.
+    for output in address_map.values():
+        pin_edges = recorder.edges[output['addr']][
+            OUTPUT_PINS[output['index']]]
+        assert [value for t, value in pin_edges] == [1, 0] * PULSES
+    harness.report('port_writes', mode=mode, port_io=port_io,
+                   pumps=len(address_map), pulses=PULSES,
+                   transactions=recorder.transactions,
+                   edge_skew_us=edge_skew_us(recorder.edges),
+                   duration_ms=duration_ms)
+
+
+def cancelled_flush():
+    recorder, i2c = harness.rack(init=False)
+    outputs = [output for output in address_map.values()
+               if output['addr'] == address_map['a']['addr']][:2]
+    addr = outputs[0]['addr']
+    pins = [OUTPUT_PINS[output['index']] for output in outputs]
+    writer = drivers.get_port_writer(i2c, addr)
+    written = []
+
+    async def write(pin):
+        await writer.write(pin, 1)
+        written.append(pin)
+
+    async def main():
+        loop = asyncio.get_event_loop()
+        sender = write(pins[0])
+        loop.create_task(sender)
+        loop.create_task(write(pins[1]))
+        await asyncio.sleep_ms(0)
+        # The sender is yielding before its write, the other task waiting.
+        asyncio.cancel(sender)
+        await asyncio.sleep_ms(20)
+
+    asyncio.get_event_loop().run_until_complete(main())
+    assert written == pins[1:], written
+    for pin in pins:
+        assert [value for t, value in recorder.edges[addr][pin]] == [1], pin
+
+
+def failed_flush():
+    recorder, i2c = harness.rack(init=False)
+    writer = drivers.get_port_writer(i2c, MISSING_ADDR)
+    errors = []
+
+    async def write(pin, retry):
+        try:
+            await writer.write(pin, 1)
+        except OSError:
+            errors.append(pin)
+            if retry:
+                # New write before the waiting task resumes.
+                await write(pin, False)
+
+    async def main():
+        loop = asyncio.get_event_loop()
+        loop.create_task(write(0, True))
+        loop.create_task(write(1, False))
+        await asyncio.sleep_ms(20)
+
+    asyncio.get_event_loop().run_until_complete(main())
+    assert sorted(errors) == [0, 0, 1], errors
+
+
+if __name__ == '__main__':
+    run('pin')
+    run('port')
+    run('port', port_io=False)
+    cancelled_flush()
+    failed_flush()
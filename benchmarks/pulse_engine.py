@@ -0,0 +1,83 @@
+'''
+Pulse trains on all sixteen outputs in ``config.address_map``, run as one
+``pump()`` task per output or as a single ``pulse.PulseEngine`` job, on an
+event loop with the default 16-slot queues used by ``boot.py``.
+
+Reports the number of pulses seen by the simulated boards and the largest
+error in pulse width.  The engine run must deliver every pulse.
+
+Usage: ``micropython benchmarks/pulse_engine.py``
+'''
+import harness
+
+import time
+
+import uasyncio as asyncio
+
+from config import address_map
+import grove_i2c_motor as gm
+from pulse import PulseEngine
+from pump import pump
+
+
+PULSES = 20
+ON_MS = 50
+OFF_MS = 150
+OUTPUT_PINS = (gm.IN1, gm.IN2, gm.IN3, gm.IN4)
+
+
+async def run_tasks(i2c, state):
+    loop = asyncio.get_event_loop()
+    for output in address_map.values():
+        loop.create_task(pump(i2c, output['addr'],
+                              OUTPUT_PINS[output['index']], PULSES,
+                              on_ms=ON_MS, off_ms=OFF_MS))
+    await asyncio.sleep_ms(PULSES * (ON_MS + OFF_MS) + 100)
+
+
+async def run_engine(i2c, state):
+    engine = PulseEngine(i2c, max_channels=len(address_map))
+    job = engine.submit([(output['addr'], OUTPUT_PINS[output['index']],
+                          PULSES, ON_MS, OFF_MS)
+                         for output in address_map.values()])
+    await job.wait()
+    state['counts'] = job.counts()
+    state['max_lag_ms'] = engine.max_lag_ms
+
+
+def run(mode):
+    recorder, i2c = harness.rack()
+    # Fresh loop with the default queue sizes.
+    loop = asyncio.get_event_loop()
+
+    state = {}
+    main = run_engine if mode == 'engine' else run_tasks
+    error = None
+    try:
+        loop.run_until_complete(main(i2c, state))
+    except Exception as exception:
+        error = repr(exception)
+
+    pulses = 0
+    width_error_ms = 0
+    for pins in recorder.edges.values():
+        for pin_edges in pins.values():
+            for i in range(0, len(pin_edges) - 1, 2):
+                pulses += 1
+                width_ms = time.ticks_diff(pin_edges[i + 1][0],
+                                           pin_edges[i][0]) / 1000
+                width_error_ms = max(width_error_ms, abs(width_ms - ON_MS))
+    results = {'mode': mode, 'channels': len(address_map),
+               'pulses_expected': PULSES * len(address_map),
+               'pulses': pulses, 'max_width_error_ms': width_error_ms,
+               'transactions': recorder.transactions, 'error': error}
+    if mode == 'engine':
+        assert error is None and pulses == results['pulses_expected']
+        assert state['counts'] == [PULSES] * len(address_map)
+        results['max_lag_ms'] = state['max_lag_ms']
+    harness.report('pulse_engine', **results)
+
+
+if __name__ == '__main__':
+    run('tasks')
+    run('engine')
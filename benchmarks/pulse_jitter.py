@@ -0,0 +1,193 @@
+'''
+Edge timing of a 4-pump step (``Purification I``) with the pulse trains
+driven by ``pulse.PulseEngine`` (event loop task) or
+``pulse.TimerPulseEngine`` (timer), with and without a task that blocks the
+event loop for 30 ms every 100 ms, like a display refresh or
+``Speaker.tone`` does.
+
+Everything runs against a virtual ``sim.clock.Clock``; the timer is a
+``sim.clock.Timer`` on the same clock, which fires during blocking sleeps
+like a hardware timer would.  Reports the mean, 99th percentile and maximum
+edge error, i.e., the delay of each output edge past its ideal time.
+
+Also reports the heap taken to submit ``LONG_PULSES`` pulses per pump to
+``pulse.TimerPulseEngine`` (its peak under CPython, traced by
+``tracemalloc``), which must not grow with the number of pulses.
+
+Finally, fails the write of the last falling edge of one pump: the timer
+engine must still count the pulse, complete the job and switch the output
+off.
+
+Usage: ``micropython benchmarks/pulse_jitter.py``
+'''
+import harness
+
+import gc
+import sys
+
+import uasyncio as asyncio
+import uasyncio.core
+
+from config import address_map
+import grove_i2c_motor as gm
+from pulse import PulseEngine, TimerPulseEngine
+from sim.clock import Clock, Timer
+from sim.i2c import EdgeI2C
+
+
+PUMPS = ('d', 'h', 'i', 'j')
+PULSES = 20
+ON_MS = 50
+OFF_MS = 150
+BLOCK_MS = 30
+BLOCK_INTERVAL_MS = 100
+LONG_PULSES = 750
+MAX_SUBMIT_BYTES = 16 * 1024
+OUTPUT_PINS = (gm.IN1, gm.IN2, gm.IN3, gm.IN4)
+
+
+def sim_event_loop_class(clock):
+    class SimEventLoop(uasyncio.core._event_loop_class):
+        def time(self):
+            return clock.ticks_ms()
+
+        def wait(self, delay):
+            clock.sleep_ms(delay)
+
+    return SimEventLoop
+
+
+async def blocking_load(clock, state):
+    while state['running']:
+        clock.sleep_ms(BLOCK_MS)
+        await asyncio.sleep_ms(BLOCK_INTERVAL_MS)
+
+
+async def main(engine, clock, load, state):
+    if load:
+        asyncio.get_event_loop().create_task(blocking_load(clock, state))
+    outputs = [address_map[key] for key in PUMPS]
+    job = engine.submit([(output['addr'], OUTPUT_PINS[output['index']],
+                          PULSES, ON_MS, OFF_MS) for output in outputs])
+    await job.wait(poll_ms=5)
+    state['running'] = False
+    state['job'] = job
+    await asyncio.sleep_ms(BLOCK_INTERVAL_MS)
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(fraction * len(sorted_values)))]
+
+
+def setup(clock):
+    return harness.rack(dict((key, address_map[key]) for key in PUMPS),
+                        recorder=EdgeI2C(clock=clock))
+
+
+class FailingI2C(EdgeI2C):
+    # Fails the `fail_at`-th write (counting from 1) to `addr`.
+    def __init__(self, addr, fail_at, clock):
+        super().__init__(clock=clock)
+        self.addr = addr
+        self.fail_at = fail_at
+        self.writes = 0
+
+    def writeto(self, addr, buf, stop=True):
+        if addr == self.addr:
+            self.writes += 1
+            if self.writes == self.fail_at:
+                raise OSError(5)
+        return super().writeto(addr, buf, stop)
+
+
+def failed_edge():
+    clock = Clock()
+    output = address_map[PUMPS[0]]
+    pin = OUTPUT_PINS[output['index']]
+    recorder, i2c = harness.rack({PUMPS[0]: output},
+                                 recorder=FailingI2C(output['addr'], 0,
+                                                     clock))
+    # One write per edge: the last one is the last falling edge.
+    recorder.fail_at = recorder.writes + 2 * PULSES
+    uasyncio.core._event_loop_class = sim_event_loop_class(clock)
+    engine = TimerPulseEngine(i2c, Timer(clock), clock=clock)
+    job = engine.submit([(output['addr'], pin, PULSES, ON_MS, OFF_MS)])
+    # Long enough for the job, without waiting on it in case it never ends.
+    asyncio.get_event_loop().run_until_complete(
+        asyncio.sleep_ms(PULSES * (ON_MS + OFF_MS) + BLOCK_INTERVAL_MS))
+    channel = job.channels[0]
+    assert job.done and job.counts() == [PULSES] and channel.errors == 1
+    assert not engine._active and not engine._schedules
+    pin_edges = recorder.edges[output['addr']][pin]
+    assert pin_edges[-1][1] == 0 and len(pin_edges) == 2 * PULSES
+    harness.report('pulse_jitter', mode='timer failed edge', done=job.done,
+                   counts=job.counts(), errors=channel.errors)
+
+
+def submit_heap(pulses):
+    clock = Clock()
+    recorder, i2c = setup(clock)
+    engine = TimerPulseEngine(i2c, Timer(clock), clock=clock)
+    channels = [(output['addr'], OUTPUT_PINS[output['index']], pulses,
+                 ON_MS, OFF_MS)
+                for output in (address_map[key] for key in PUMPS)]
+    if sys.implementation.name == 'micropython':
+        gc.collect()
+        before = gc.mem_alloc()
+        job = engine.submit(channels)
+        heap_bytes = gc.mem_alloc() - before
+    else:
+        import tracemalloc
+        gc.collect()
+        tracemalloc.start()
+        job = engine.submit(channels)
+        heap_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    job.cancel()
+    return heap_bytes
+
+
+def run(mode, load):
+    clock = Clock()
+    recorder, i2c = setup(clock)
+
+    uasyncio.core._event_loop_class = sim_event_loop_class(clock)
+    loop = asyncio.get_event_loop()
+    if mode == 'timer':
+        engine = TimerPulseEngine(i2c, Timer(clock), clock=clock)
+    else:
+        engine = PulseEngine(i2c, clock=clock)
+    state = {'running': True}
+    loop.run_until_complete(main(engine, clock, load, state))
+
+    job = state['job']
+    assert job.counts() == [PULSES] * len(PUMPS)
+    errors_ms = []
+    for key in PUMPS:
+        output = address_map[key]
+        pin_edges = recorder.edges[output['addr']][
+            OUTPUT_PINS[output['index']]]
+        assert len(pin_edges) == 2 * PULSES
+        for i, (ticks_us, value) in enumerate(pin_edges):
+            ideal_ms = (job.start + (i // 2) * (ON_MS + OFF_MS) +
+                        (i % 2) * ON_MS)
+            errors_ms.append(clock.ticks_diff(ticks_us,
+                                              ideal_ms * 1000) / 1000)
+    errors_ms.sort()
+    harness.report('pulse_jitter', mode=mode, load=load, edges=len(errors_ms),
+                   mean_error_ms=sum(errors_ms) / len(errors_ms),
+                   p99_error_ms=percentile(errors_ms, .99),
+                   max_error_ms=errors_ms[-1])
+
+
+if __name__ == '__main__':
+    for load in (False, True):
+        for mode in ('task', 'timer'):
+            run(mode, load)
+    short_bytes = submit_heap(PULSES)
+    long_bytes = submit_heap(LONG_PULSES)
+    assert long_bytes <= MAX_SUBMIT_BYTES, long_bytes
+    harness.report('pulse_jitter', mode='timer submit', pumps=len(PUMPS),
+                   heap_bytes={PULSES: short_bytes, LONG_PULSES: long_bytes})
+    failed_edge()
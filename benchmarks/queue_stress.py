@@ -0,0 +1,85 @@
+'''
+Event loop queues under load: ``TASKS`` tasks created at once on a loop
+with the default queue lengths.
+
+With ``overflow=OVERFLOW_GROW`` the queues must grow to fit the workload,
+every task must complete, and the tasks must keep running in the order they
+were created.  Reports the final queue lengths, the number of times they
+grew and the run time.
+
+With ``overflow=OVERFLOW_ERROR`` (the default), creating one task too many
+must raise ``QueueFull`` naming the full queue, from ``create_task()``.
+
+Usage: ``micropython benchmarks/queue_stress.py``
+'''
+import harness
+
+import time
+
+import uasyncio as asyncio
+import uasyncio.core
+
+
+TASKS = 400
+SLEEPS = 5
+SLEEP_MS = 10
+CALLBACKS = 100
+
+
+async def worker(i, order):
+    for j in range(SLEEPS):
+        order.append((j, i))
+        await asyncio.sleep_ms(SLEEP_MS)
+        await asyncio.sleep_ms(0)
+
+
+def callback(i, called):
+    called.append(i)
+
+
+async def main(order, called):
+    loop = asyncio.get_event_loop()
+    for i in range(TASKS):
+        loop.create_task(worker(i, order))
+    for i in range(CALLBACKS):
+        loop.call_later_ms(SLEEP_MS, callback, i, called)
+    while len(order) < TASKS * SLEEPS or len(called) < CALLBACKS:
+        await asyncio.sleep_ms(SLEEP_MS)
+
+
+def grow():
+    uasyncio.core._event_loop = None
+    loop = asyncio.get_event_loop(overflow=asyncio.OVERFLOW_GROW)
+    order = []
+    called = []
+    start = time.ticks_ms()
+    loop.run_until_complete(main(order, called))
+    run_ms = time.ticks_diff(time.ticks_ms(), start)
+    for j in range(SLEEPS):
+        assert [i for j_, i in order if j_ == j] == list(range(TASKS))
+    assert called == list(range(CALLBACKS))
+    assert loop.grows > 0
+    harness.report('queue_stress', overflow='grow', tasks=TASKS,
+                   callbacks=CALLBACKS, runq_len=loop.qlen[0],
+                   waitq_len=loop.qlen[1], grows=loop.grows, run_ms=run_ms)
+
+
+def error():
+    uasyncio.core._event_loop = None
+    loop = asyncio.get_event_loop()
+    created = 0
+    message = None
+    try:
+        for i in range(TASKS):
+            loop.create_task(worker(i, []))
+            created += 1
+    except asyncio.QueueFull as exception:
+        message = str(exception)
+    assert created == loop.qlen[0] and message.startswith('runq full')
+    harness.report('queue_stress', overflow='error', created=created,
+                   error=message)
+
+
+if __name__ == '__main__':
+    grow()
+    error()
@@ -0,0 +1,115 @@
+'''
+Multi-day runs of ``run_clock.RunClock`` and ``sequence.SequenceRunner`` on
+a virtual clock that starts just before a ticks wraparound.
+
+Both runs last ``DAYS`` days, i.e., more than two ticks periods (``2 ** 30``
+ms, ~12.4 days), and include a one-day pause.  Run time must match the
+unwrapped virtual time minus the pause, and every sequence event must run
+exactly once, at its offset.
+
+Usage: ``micropython benchmarks/run_clock.py``
+'''
+import harness
+
+import uasyncio as asyncio
+import uasyncio.core
+
+from run_clock import RunClock
+from sequence import Sequence, SequenceRunner
+from sim.clock import Clock, TICKS_PERIOD
+from step_index import StepIndex
+
+
+DAY_MS = 24 * 60 * 60 * 1000
+DAYS = 30
+PAUSE_AT_MS = 10 * DAY_MS
+PAUSE_MS = DAY_MS
+READ_INTERVAL_MS = 60 * 60 * 1000
+REPEAT_S = 6 * 60 * 60
+
+STEPS = [{'name': 'Transfer',
+          'steps': [{'label': 'A -> B'}, {'label': 'B -> A'}]}]
+SEQUENCE = {'name': 'Long mix', 'duration_s': DAYS * DAY_MS // 1000,
+            'events': [{'step': 'A -> B', 'offset_s': 0,
+                        'repeat_s': REPEAT_S},
+                       {'step': 'B -> A', 'offset_s': REPEAT_S // 2,
+                        'repeat_s': REPEAT_S}]}
+
+
+def sim_event_loop_class(clock):
+    class SimEventLoop(uasyncio.core._event_loop_class):
+        def time(self):
+            return clock.ticks_ms()
+
+        def wait(self, delay):
+            clock.sleep_ms(delay)
+
+    return SimEventLoop
+
+
+def run_clock():
+    clock = Clock(start_ms=TICKS_PERIOD - 1000)
+    run_clock = RunClock(clock)
+    start_ms = clock.now_us() // 1000
+    run_clock.start()
+    errors = 0
+    for hour in range(DAYS * 24):
+        clock.sleep_ms(READ_INTERVAL_MS)
+        if hour * READ_INTERVAL_MS == PAUSE_AT_MS:
+            run_clock.pause()
+            paused_at = run_clock.elapsed_ms()
+            clock.sleep_ms(PAUSE_MS)
+            assert run_clock.elapsed_ms() == paused_at
+            run_clock.resume()
+        paused_ms = PAUSE_MS if hour * READ_INTERVAL_MS >= PAUSE_AT_MS else 0
+        expected = clock.now_us() // 1000 - start_ms - paused_ms
+        errors += run_clock.elapsed_ms() != expected
+    assert not errors, errors
+    harness.report('run_clock', clock='RunClock', days=DAYS,
+                   wraps=(clock.now_us() // 1000) // TICKS_PERIOD,
+                   elapsed_ms=run_clock.elapsed_ms(), errors=errors)
+
+
+async def pause(runner):
+    await asyncio.sleep_ms(PAUSE_AT_MS)
+    runner.pause()
+    await asyncio.sleep_ms(PAUSE_MS)
+    runner.resume()
+
+
+async def main(runner):
+    runner.start()
+    asyncio.get_event_loop().create_task(pause(runner))
+    while runner.running:
+        await asyncio.sleep_ms(READ_INTERVAL_MS)
+
+
+def run_sequence():
+    clock = Clock(start_ms=TICKS_PERIOD - 1000)
+    uasyncio.core._event_loop = None
+    uasyncio.core._event_loop_class = sim_event_loop_class(clock)
+    loop = asyncio.get_event_loop()
+
+    sequence = Sequence(SEQUENCE, StepIndex(STEPS, {}))
+    fired = []
+    runner = SequenceRunner(
+        sequence, lambda step: fired.append((runner.elapsed_ms(),
+                                             step.label)), clock=clock)
+    start_ms = clock.now_us() // 1000
+    loop.run_until_complete(main(runner))
+    end_ms = clock.now_us() // 1000
+
+    expected = sorted((offset, step.label)
+                      for offset_, repeat_ms, step in sequence.events
+                      for offset in range(offset_, sequence.duration_ms,
+                                          repeat_ms))
+    assert fired == expected, (fired[:4], expected[:4])
+    assert end_ms - start_ms >= sequence.duration_ms + PAUSE_MS
+    harness.report('run_clock', clock='SequenceRunner', days=DAYS,
+                   wraps=end_ms // TICKS_PERIOD, events=len(fired),
+                   run_ms=end_ms - start_ms)
+
+
+if __name__ == '__main__':
+    run_clock()
+    run_sequence()
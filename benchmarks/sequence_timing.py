@@ -0,0 +1,105 @@
+'''
+Full 16-hour run of each sequence in ``config.sequences`` on a virtual
+clock, with a task that blocks the event loop for 1.5 s every 7 s.
+
+Reports how many times the sequence task woke up and the largest delay of
+an event past its scheduled offset.  Every scheduled event must run exactly
+once.
+
+Usage: ``micropython benchmarks/sequence_timing.py``
+'''
+import harness
+
+import uasyncio as asyncio
+import uasyncio.core
+
+from config import address_map, sequences, steps
+from sequence import Sequence, SequenceRunner
+from sim.clock import Clock
+from step_index import StepIndex
+
+
+BLOCK_MS = 1500
+BLOCK_INTERVAL_MS = 7000
+
+
+def sim_event_loop_class(clock):
+    class SimEventLoop(uasyncio.core._event_loop_class):
+        def time(self):
+            return clock.ticks_ms()
+
+        def wait(self, delay):
+            clock.sleep_ms(delay)
+
+    return SimEventLoop
+
+
+async def blocking_load(clock, runner):
+    while runner.running:
+        clock.sleep_ms(BLOCK_MS)
+        await asyncio.sleep_ms(BLOCK_INTERVAL_MS)
+
+
+async def main(runner, clock, state):
+    runner.start()
+    asyncio.get_event_loop().create_task(blocking_load(clock, runner))
+    while runner.running:
+        await asyncio.sleep(60)
+    state['done'] = True
+
+
+def expected_offsets(sequence):
+    offsets = []
+    for offset, repeat_ms, step in sequence.events:
+        while offset < sequence.duration_ms:
+            offsets.append((offset, step.label))
+            if not repeat_ms:
+                break
+            offset += repeat_ms
+    return sorted(offsets)
+
+
+def run(config, step_index):
+    clock = Clock()
+    uasyncio.core._event_loop = None
+    uasyncio.core._event_loop_class = sim_event_loop_class(clock)
+    loop = asyncio.get_event_loop()
+
+    sequence = Sequence(config, step_index)
+    fired = []
+    runner = SequenceRunner(
+        sequence, lambda step: fired.append((runner.elapsed_ms(),
+                                             step.label)), clock=clock)
+    # Count wakeups of the sequence task.
+    wakeups = [0]
+    run_ = runner._run
+
+    def counting_run():
+        gen = run_()
+        value = None
+        while True:
+            wakeups[0] += 1
+            try:
+                value = yield gen.send(value)
+            except StopIteration:
+                return
+
+    runner._run = counting_run
+    state = {}
+    loop.run_until_complete(main(runner, clock, state))
+
+    expected = expected_offsets(sequence)
+    assert [label for t, label in fired] == \
+        [label for t, label in expected]
+    harness.report('sequence_timing', sequence=sequence.name,
+                   duration_s=sequence.duration_ms // 1000,
+                   events=len(fired), wakeups=wakeups[0],
+                   polling_wakeups=sequence.duration_ms // 1000,
+                   max_delay_ms=max(t - offset for (t, label), (offset, _)
+                                    in zip(fired, expected)))
+
+
+if __name__ == '__main__':
+    step_index = StepIndex(steps, address_map)
+    for config in sequences:
+        run(config, step_index)
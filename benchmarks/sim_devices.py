@@ -0,0 +1,143 @@
+'''
+Drivers in ``_lib`` against the device models of ``sim.i2c``, on one
+simulated bus (``sim.i2c.EdgeI2C``).
+
+- ``base_node.BaseDriver``: ``PULSES`` pulses of ``PULSE_MS``; the recorded
+  edges must be ``PULSE_MS`` apart, give or take one transfer;
+- Faces encoder: turns and presses must show up in the 3 byte reports read
+  the way ``m5_lvgl.FacesEncoderInputEncoder`` reads them;
+- ``honeywell_ssc``: pressures must read back within one count, and a
+  diagnostic status must raise;
+- ``sensiron.SLF3S_1300F``: product information, flow and temperature must
+  read back, and a corrupt frame must raise ``CrcError``.
+
+Reports, from the transaction timeline, the transactions, bytes, the time
+the bus was busy and the throughput while busy.
+
+Usage: ``micropython benchmarks/sim_devices.py``
+'''
+import harness
+
+import struct
+import time
+
+import base_node
+from grove_i2c_motor import IN1
+import honeywell_ssc
+import sensiron
+from sim.i2c import (BaseNodeDevice, EdgeI2C, FacesEncoderDevice,
+                     HoneywellSSCDevice, SLF3SDevice)
+
+
+PULSES = 10
+PULSE_MS = 50
+BOARD_ADDR = 17
+ENCODER_ADDR = 0x5E
+SSC_ADDR = 0x28
+SLF3S_ADDR = 0x08
+PRESSURES = (0, 12.5, 30, 59.9)
+FLOWS = (-10, 0, 3.25, 40)
+
+
+def base_node_pulses(i2c):
+    driver = base_node.BaseDriver(i2c, BOARD_ADDR)
+    for i in range(2 * PULSES):
+        driver.digital_write(IN1, not i & 1)
+        time.sleep_ms(PULSE_MS)
+    edges = i2c.edges[BOARD_ADDR][IN1]
+    assert len(edges) == 2 * PULSES
+    transfer_us = max(end - start for start, end, addr, nbytes, read
+                      in i2c.timeline if addr == BOARD_ADDR)
+    for (t0, v0), (t1, v1) in zip(edges, edges[1:]):
+        assert v0 != v1
+        assert abs(time.ticks_diff(t1, t0) - 1000 * PULSE_MS) <= transfer_us
+
+
+def encoder(i2c, device):
+    buffer = bytearray(3)
+
+    def report():
+        i2c.readfrom_into(ENCODER_ADDR, buffer)
+        diff, not_pressed, _ = struct.unpack('bBB', bytes(buffer))
+        return diff, not not_pressed
+
+    device.turn(3)
+    device.turn(-5)
+    assert report() == (-2, False)
+    device.turn(200)
+    device.pressed = True
+    assert report() == (127, True)
+    assert report() == (73, True)
+    i2c.writeto(ENCODER_ADDR, bytes((4, 1, 2, 3)))
+    assert device.leds[4] == (1, 2, 3)
+
+
+def pressure(i2c, device):
+    resolution = (device.pressure_max - device.pressure_min) / (.8 * (1 << 14))
+    for value in PRESSURES:
+        device.pressure = value
+        assert abs(honeywell_ssc.read(i2c, SSC_ADDR) - value) <= resolution
+    device.status = 3
+    try:
+        honeywell_ssc.read(i2c, SSC_ADDR)
+    except IOError:
+        pass
+    else:
+        assert False, 'Diagnostic status not reported.'
+    device.status = 0
+
+
+def flow(i2c, device):
+    sensor = sensiron.SLF3S_1300F(i2c, SLF3S_ADDR)
+    info = sensor.get_device_info()
+    assert info == {'product_number': device.PRODUCT_NUMBER,
+                    'serial_number': device.serial_number}
+    sensor.start_continuous_measurement()
+    for value in FLOWS:
+        device.flow = value
+        device.temperature = value / 2
+        measurement = sensor.get_measurement()
+        assert abs(measurement['flow'] - value) <= 1 / 500
+        assert abs(measurement['temperature'] - value / 2) <= 1 / 200
+    device.flags = 1
+    assert sensor.get_measurement()['air-in-line'] == 1
+    device.corrupt = True
+    try:
+        sensor.get_measurement()
+    except sensiron.CrcError:
+        pass
+    else:
+        assert False, 'Corrupt frame not detected.'
+    device.corrupt = False
+    sensor.stop_continuous_measurement()
+    try:
+        sensor.get_measurement()
+    except OSError:
+        pass
+    else:
+        assert False, 'Read acknowledged with no measurement running.'
+
+
+def run():
+    i2c = EdgeI2C()
+    i2c.attach(BOARD_ADDR, BaseNodeDevice(BOARD_ADDR))
+    encoder_device = i2c.attach(ENCODER_ADDR, FacesEncoderDevice())
+    ssc_device = i2c.attach(SSC_ADDR, HoneywellSSCDevice())
+    slf3s_device = i2c.attach(SLF3S_ADDR, SLF3SDevice())
+    start = time.ticks_us()
+    base_node_pulses(i2c)
+    encoder(i2c, encoder_device)
+    pressure(i2c, ssc_device)
+    flow(i2c, slf3s_device)
+    duration_us = time.ticks_diff(time.ticks_us(), start)
+
+    busy_us = i2c.busy_us()
+    nbytes = sum(record[3] + 1 for record in i2c.timeline)
+    harness.report('sim_devices', transactions=len(i2c.timeline),
+                   bytes=nbytes, busy_us=busy_us,
+                   busy=busy_us / duration_us,
+                   busy_bytes_per_s=1e6 * nbytes / busy_us)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,106 @@
+'''
+Conflicting step requests, applied directly with ``executor.StepExecutor``
+or through ``scheduler.ResourceScheduler``.
+
+``REQUESTS`` are made at once, as if their buttons were pressed together:
+``Mix WB`` and ``WB -> Beads 1`` both use pump ``d`` and valve ``k``, and
+``Mix WB`` is requested twice.  Reports, per mode, how often two pulse
+trains overlapped on the same pump and the pulses seen by the simulated
+boards.  The scheduled run must never overlap pulse trains, must merge the
+repeated request and must deliver exactly the pulses of the requests it
+ran.
+
+Usage: ``micropython benchmarks/step_conflicts.py``
+'''
+import harness
+
+import time
+
+import uasyncio as asyncio
+
+from config import address_map, steps
+from executor import StepExecutor
+from pulse import PulseEngine
+from scheduler import ResourceScheduler
+from step_index import StepIndex
+
+
+PULSES = 10
+ON_MS = 50
+OFF_MS = 150
+REQUESTS = ['Mix WB', 'WB -> Beads 1', 'Mix EB', 'Mix WB', 'A -> B']
+
+
+def setup():
+    recorder, i2c = harness.rack()
+    engine = PulseEngine(i2c, max_channels=len(address_map))
+    return recorder, StepExecutor(i2c, engine)
+
+
+async def wait_all(handles):
+    for handle in handles:
+        await handle.wait()
+
+
+def overlaps(handles):
+    # Pairs of pulse trains on the same pump that ran at the same time.
+    trains = []
+    for handle in handles:
+        for result in handle.results:
+            if result.kind == 'pump' and result not in trains:
+                trains.append(result)
+    count = 0
+    for i, a in enumerate(trains):
+        for b in trains[i + 1:]:
+            if (a.addr, a.pin) == (b.addr, b.pin) and \
+                    time.ticks_diff(a.start, b.end) < 0 and \
+                    time.ticks_diff(b.start, a.end) < 0:
+                count += 1
+    return count
+
+
+def pulses_seen(recorder):
+    count = 0
+    for pins in recorder.edges.values():
+        for edges in pins.values():
+            count += sum(1 for i in range(1, len(edges))
+                         if edges[i - 1][1] and not edges[i][1])
+    return count
+
+
+def run(mode):
+    recorder, executor = setup()
+    step_index = StepIndex(steps, address_map)
+    scheduler = ResourceScheduler(executor)
+    start = time.ticks_ms()
+    handles = []
+    for label in REQUESTS:
+        step = step_index.find(label)
+        channels = [(addr, pin, PULSES, ON_MS, OFF_MS)
+                    for addr, pin in step.pumps]
+        if mode == 'scheduled':
+            handles.append(scheduler.request(step, channels))
+        else:
+            handles.append(executor.apply(step, channels))
+    asyncio.get_event_loop().run_until_complete(wait_all(handles))
+    total_ms = max(time.ticks_diff(handle.end, start) for handle in handles)
+
+    ran = []
+    for handle in handles:
+        if handle not in ran:
+            ran.append(handle)
+    expected = sum(len(handle.step.pumps) for handle in ran) * PULSES
+    results = {'mode': mode, 'requests': len(REQUESTS), 'runs': len(ran),
+               'overlaps': overlaps(ran), 'pulses_expected': expected,
+               'pulses': pulses_seen(recorder), 'total_ms': total_ms}
+    if mode == 'scheduled':
+        assert results['overlaps'] == 0 and scheduler.merged == 1
+        assert results['pulses'] == expected
+        results.update(started=scheduler.started, queued=scheduler.queued,
+                       merged=scheduler.merged)
+    harness.report('step_conflicts', **results)
+
+
+if __name__ == '__main__':
+    run('unscheduled')
+    run('scheduled')
@@ -0,0 +1,122 @@
+'''
+Steps run back to back with ``executor.StepExecutor``.
+
+Runs ``STEPS`` steps one after the other, either by awaiting each step's
+handle from a task (``wait``) or by starting the next step from the
+completion callback of the previous one (``chain``).  Reports the largest
+idle gap between the last edge of a step and the first edge of the next.
+
+Also applies a step whose valve board is missing, which must complete with
+the error recorded in the valve's result, without starting its pump.
+
+Usage: ``micropython benchmarks/step_dispatch.py``
+'''
+import harness
+
+import time
+
+import uasyncio as asyncio
+
+from config import address_map
+from executor import StepExecutor
+from pulse import PulseEngine
+from step_index import StepIndex
+
+
+STEPS = 8
+PULSES = 5
+ON_MS = 50
+OFF_MS = 150
+
+STEP_CONFIG = [{'name': 'Transfer',
+                'steps': [{'label': 'A -> B', 'pump': 'a',
+                           'valves': [{'valve': 'k', 'path': 1}]},
+                          {'label': 'B -> A', 'pump': 'b',
+                           'valves': [{'valve': 'k', 'path': 0}]}]}]
+MISSING_BOARD = {'a': address_map['a'], 'x': {'addr': 99, 'index': 0}}
+MISSING_CONFIG = [{'name': 'Broken',
+                   'steps': [{'label': 'Missing valve', 'pump': 'a',
+                              'valves': [{'valve': 'x', 'path': 1}]}]}]
+
+
+def setup():
+    recorder, i2c = harness.rack()
+    engine = PulseEngine(i2c, max_channels=len(address_map))
+    return recorder, StepExecutor(i2c, engine)
+
+
+def items(step_index):
+    return [(step_index[i % 2],
+             [(addr, pin, PULSES, ON_MS, OFF_MS)
+              for addr, pin in step_index[i % 2].pumps])
+            for i in range(STEPS)]
+
+
+async def run_wait(executor, items):
+    handles = []
+    for step, channels in items:
+        handles.append(await executor.apply(step, channels).wait())
+    return handles
+
+
+async def run_chain(executor, items):
+    state = {}
+    handles = executor.chain(items, on_done=lambda handles:
+                             state.setdefault('done', True))
+    while 'done' not in state:
+        await asyncio.sleep_ms(100)
+    return handles
+
+
+def max_gap_ms(recorder, step_index):
+    # Gap between the last falling edge of one step and the first rising
+    # edge of the next, which pulses the other pump.
+    edges = []
+    for step in step_index:
+        for addr, pin in step.pumps:
+            edges.extend((t, value, pin)
+                         for t, value in recorder.edges[addr][pin])
+    edges.sort()
+    gap = 0
+    for (t0, v0, pin0), (t1, v1, pin1) in zip(edges, edges[1:]):
+        if pin0 != pin1 and not v0 and v1:
+            gap = max(gap, time.ticks_diff(t1, t0) / 1000)
+    return gap
+
+
+def run(mode):
+    recorder, executor = setup()
+    step_index = StepIndex(STEP_CONFIG, address_map)
+    main = run_chain if mode == 'chain' else run_wait
+    handles = asyncio.get_event_loop().run_until_complete(
+        main(executor, items(step_index)))
+    assert len(handles) == STEPS and all(handle.ok for handle in handles)
+    assert all(result.channel.count == PULSES for handle in handles
+               for result in handle.results if result.kind == 'pump')
+    harness.report('step_dispatch', mode=mode, steps=STEPS,
+                   step_ms=max(handle.elapsed_ms() for handle in handles),
+                   max_gap_ms=max_gap_ms(recorder, step_index))
+
+
+async def run_missing(executor, step):
+    return await executor.apply(step, [(addr, pin, PULSES, ON_MS, OFF_MS)
+                                       for addr, pin in step.pumps]).wait()
+
+
+def missing():
+    recorder, executor = setup()
+    step = StepIndex(MISSING_CONFIG, MISSING_BOARD)[0]
+    handle = asyncio.get_event_loop().run_until_complete(
+        run_missing(executor, step))
+    valve, pump = handle.results
+    assert handle.done and not handle.ok
+    assert valve.error is not None and pump.channel is None
+    harness.report('step_dispatch', mode='missing board', ok=handle.ok,
+                   valve_error=repr(valve.error),
+                   pump_started=pump.channel is not None)
+
+
+if __name__ == '__main__':
+    run('wait')
+    run('chain')
+    missing()
@@ -0,0 +1,92 @@
+'''
+Cost of resolving ``config.steps`` at run time, as ``boot.py`` did before
+the step index, versus compiling a ``step_index.StepIndex`` once.
+
+Reports the compile time and the per-call cost of finding a step by label
+and of resolving a step's pumps and valves to board outputs.  The valves
+of every step must be grouped per board once, at compile time.
+
+Usage: ``python benchmarks/step_index.py``
+'''
+import harness
+
+import time
+
+from config import address_map, steps
+import dosing
+import grove_i2c_motor as gm
+from step_index import StepIndex
+
+
+CALLS = 1000
+OUTPUT_PINS = (gm.IN1, gm.IN2, gm.IN3, gm.IN4)
+
+
+def linear_find(step_names, name):
+    for i, name_i in zip(range(len(step_names)), step_names):
+        if name_i == name:
+            return i
+
+
+def resolve(step):
+    # `apply_step` before the step index.
+    pumps = (step['pump'] if isinstance(step['pump'], list)
+             else [step['pump']])
+    outputs = [(address_map[key]['addr'],
+                OUTPUT_PINS[address_map[key]['index']]) for key in pumps]
+    for valve_state in step.get('valves', ()):
+        config = address_map[valve_state['valve']]
+        outputs.append((config['addr'], OUTPUT_PINS[config['index']]))
+    return outputs
+
+
+def resolve_compiled(step):
+    return step.pumps, step.valves
+
+
+def per_call_us(function, *args):
+    start = harness.wall_us()
+    for i in range(CALLS):
+        function(*args)
+    return time.ticks_diff(harness.wall_us(), start) / CALLS
+
+
+def main():
+    calibrations = dosing.load_calibrations({})
+    start = harness.wall_us()
+    index = StepIndex(steps, address_map, calibrations)
+    compile_us = time.ticks_diff(harness.wall_us(), start)
+    for step in index:
+        grouped = sorted((i, addr, pin, path, settle_ms)
+                         for addr, valves in step.boards
+                         for i, pin, path, settle_ms in valves)
+        assert grouped == [(i, ) + valve
+                           for i, valve in enumerate(step.valves)], grouped
+        assert len(set(addr for addr, valves in step.boards)) == \
+            len(step.boards)
+
+    step_names = tuple(step['label'] for super_step in steps
+                       for step in super_step['steps'])
+    steps_list = [step for super_step in steps
+                  for step in super_step['steps']]
+    # Last step: worst case of the linear scan.
+    label = step_names[-1]
+    harness.report('step_index', steps=len(index), compile_us=compile_us,
+                   find_linear_us=per_call_us(linear_find, step_names, label),
+                   find_index_us=per_call_us(index.index, label),
+                   resolve_us=per_call_us(resolve, steps_list[-1]),
+                   resolve_compiled_us=per_call_us(resolve_compiled,
+                                                   index[-1]))
+
+    # Unknown outputs are reported at load time.
+    try:
+        StepIndex([{'name': 'Bad', 'steps': [{'pump': 'z', 'label': 'Z'}]}],
+                  address_map)
+    except ValueError as exception:
+        harness.report('step_index_validation', error=str(exception))
+    else:
+        raise AssertionError('Unknown pump accepted.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+'''
+End-to-end run of every step in ``config.steps``, the way ``boot.py``
+applies it when its button is pressed, next to the encoder poll and LED
+flash tasks of ``boot.py``.
+
+Each step runs ``PULSES`` pulses per pump, at the period of its volume (see
+``step_index.Step.doses``) or else ``PERIOD_MS``, through
+``scheduler.ResourceScheduler`` and ``executor.StepExecutor``.  Every pump
+must deliver its pulses.  Reports, per step and pulse engine:
+
+- the latency from the button press to the first bus write and to the first
+  pump edge (which follows the valve settle time, ``settle_ms``);
+- the error of the pulse widths and periods: mean, 99th percentile and
+  maximum of the absolute error, in ms;
+- the bus transactions of the step;
+- the heap allocated while the step runs: ``gc.mem_alloc()`` growth with
+  the collector disabled under MicroPython; under CPython, the memory
+  allocated by the device code (not ``sim`` or the benchmark) and still
+  held when the step is done, traced by ``tracemalloc``.
+
+Runs against ``sim.i2c.EdgeI2C`` and the virtual clock of ``harness``.
+Each result is one JSON record; compare the output of two commits.
+
+Usage: ``micropython benchmarks/step_latency.py``
+'''
+import harness
+
+import gc
+import sys
+import time
+
+import uasyncio as asyncio
+
+from config import (PULSE_TIMER_ID, VALVE_SETTLE_MS, address_map,
+                    calibrations, steps)
+import dosing
+from executor import StepExecutor
+from i2c_bus import PRIORITY_HIGH
+from pulse import PulseEngine, TimerPulseEngine
+from scheduler import ResourceScheduler
+from sim.i2c import FacesEncoderDevice
+from step_index import StepIndex
+
+
+PULSES = 100
+PERIOD_MS = 300
+POLL_MS = 10
+LED_MS = 25
+LEDS = 12
+ENCODER_ADDR = 0x5E
+MICROPYTHON = sys.implementation.name == 'micropython'
+
+
+def engines():
+    # Engine of `config.PULSE_TIMER_ID` first; timers need a simulated clock.
+    modes = ['task']
+    if harness.clock is not None:
+        modes.append('timer')
+        if PULSE_TIMER_ID is not None:
+            modes.reverse()
+    return modes
+
+
+async def encoder_poll(i2c, state):
+    buffer = bytearray(3)
+    while not state.get('done'):
+        await i2c.lock.acquire(PRIORITY_HIGH)
+        try:
+            i2c.readfrom_into(ENCODER_ADDR, buffer)
+        finally:
+            i2c.lock.release()
+        await asyncio.sleep_ms(POLL_MS)
+
+
+async def flash_leds(i2c, state):
+    i = 0
+    while not state.get('done'):
+        await i2c.lock.acquire(PRIORITY_HIGH)
+        try:
+            i2c.writeto(ENCODER_ADDR, bytes((i % LEDS, 255, 0, 0)))
+        finally:
+            i2c.lock.release()
+        i += 1
+        await asyncio.sleep_ms(LED_MS)
+
+
+def channels(step):
+    # As `boot.apply_step()`, with `PULSES` set in the step's widget.
+    period_ms = step.doses[0][1] if step.doses else PERIOD_MS
+    on_ms, off_ms = dosing.pulse_timing(period_ms)
+    return [(addr, pin, PULSES, on_ms, off_ms) for addr, pin in step.pumps]
+
+
+if MICROPYTHON:
+    _heap_before = [0]
+
+    def heap_start():
+        gc.collect()
+        gc.disable()
+        _heap_before[0] = gc.mem_alloc()
+
+    def heap_stop():
+        heap_bytes = gc.mem_alloc() - _heap_before[0]
+        gc.enable()
+        return heap_bytes
+else:
+    import tracemalloc
+
+    def heap_start():
+        gc.collect()
+        tracemalloc.start()
+
+    def heap_stop():
+        # Leave out the simulator and the benchmark.
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, '*/sim/*'),
+             tracemalloc.Filter(False, '*/benchmarks/*'),
+             tracemalloc.Filter(False, tracemalloc.__file__)])
+        tracemalloc.stop()
+        return sum(stat.size for stat in snapshot.statistics('filename'))
+
+
+async def main(i2c, scheduler, step, state):
+    loop = asyncio.get_event_loop()
+    loop.create_task(encoder_poll(i2c, state))
+    loop.create_task(flash_leds(i2c, state))
+    await asyncio.sleep_ms(3 * LED_MS)
+    heap_start()
+    state['press_us'] = time.ticks_us()
+    handle = scheduler.request(step, channels(step))
+    await handle.wait()
+    state['heap_bytes'] = heap_stop()
+    state['done'] = True
+    await asyncio.sleep_ms(LED_MS)
+    return handle
+
+
+def stats(errors_ms):
+    errors_ms = sorted(abs(error) for error in errors_ms)
+    return {'mean': sum(errors_ms) / len(errors_ms),
+            'p99': errors_ms[min(len(errors_ms) - 1,
+                                 int(.99 * len(errors_ms)))],
+            'max': errors_ms[-1]}
+
+
+def run(step, mode):
+    recorder, i2c = harness.rack()
+    recorder.attach(ENCODER_ADDR, FacesEncoderDevice())
+    loop = asyncio.get_event_loop()
+    if mode == 'timer':
+        from sim.clock import Timer
+        engine = TimerPulseEngine(i2c, Timer(harness.clock),
+                                  max_channels=len(address_map))
+    else:
+        engine = PulseEngine(i2c, max_channels=len(address_map))
+    scheduler = ResourceScheduler(StepExecutor(i2c, engine))
+
+    state = {}
+    handle = loop.run_until_complete(main(i2c, scheduler, step, state))
+    assert handle.ok
+    assert all(result.channel.count == PULSES for result in handle.results
+               if result.kind == 'pump')
+
+    press_us = state['press_us']
+    step_addrs = set(addr for addr, pin in step.pumps) | \
+        set(addr for addr, pin, path, settle_ms in step.valves)
+    transactions = [(start, read) for start, end, addr, nbytes, read
+                    in recorder.timeline if addr in step_addrs and
+                    time.ticks_diff(start, press_us) >= 0]
+    first_write_us = min(time.ticks_diff(start, press_us)
+                         for start, read in transactions if not read)
+    widths_ms = []
+    periods_ms = []
+    first_edge_us = None
+    for addr, pin, pulses, on_ms, off_ms in channels(step):
+        edges = [t for t, value in recorder.edges[addr][pin]
+                 if time.ticks_diff(t, press_us) >= 0]
+        assert len(edges) == 2 * PULSES
+        delay_us = time.ticks_diff(edges[0], press_us)
+        first_edge_us = (delay_us if first_edge_us is None
+                         else min(first_edge_us, delay_us))
+        for i in range(0, len(edges), 2):
+            widths_ms.append(time.ticks_diff(edges[i + 1], edges[i]) / 1000 -
+                             on_ms)
+            if i:
+                periods_ms.append(time.ticks_diff(edges[i], edges[i - 2]) /
+                                  1000 - on_ms - off_ms)
+    harness.report('step_latency', step=step.label, engine=mode,
+                   pumps=len(step.pumps), valves=len(step.valves),
+                   pulses=PULSES, settle_ms=max([0] + [
+                       settle_ms for addr, pin, path, settle_ms
+                       in step.valves]),
+                   first_write_ms=first_write_us / 1000,
+                   first_edge_ms=first_edge_us / 1000,
+                   width_error_ms=stats(widths_ms),
+                   period_error_ms=stats(periods_ms),
+                   transactions=len(transactions),
+                   heap_bytes=state['heap_bytes'])
+
+
+if __name__ == '__main__':
+    step_index = StepIndex(steps, address_map,
+                           dosing.load_calibrations(calibrations),
+                           valve_settle_ms=VALVE_SETTLE_MS)
+    for mode in engines():
+        for step in step_index:
+            run(step, mode)
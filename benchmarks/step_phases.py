@@ -0,0 +1,153 @@
+'''
+Valve-settle phases of ``executor.StepExecutor``, run one step at a time or
+overlapped with ``StepExecutor.chain()``.
+
+Each of ``STEPS`` steps switches its own valve, with a settle time of
+``SETTLE_MS``, and then pulses pump ``a`` or ``b``.  In both modes no pump
+may pulse before the valve of its step has settled, and the pumps of
+consecutive steps must not overlap.  Reports the total run time, which the
+overlapped run must keep below the sum of the step durations.
+
+Also checks that a step does not switch a valve while any earlier step
+still pumps through it, even after a later step through the valve is done.
+
+Usage: ``micropython benchmarks/step_phases.py``
+'''
+import harness
+
+import time
+
+import uasyncio as asyncio
+
+from config import address_map
+from executor import StepExecutor
+from pulse import PulseEngine
+from step_index import StepIndex
+
+
+PULSES = 5
+ON_MS = 50
+OFF_MS = 150
+SETTLE_MS = 200
+VALVES = 'klmnop'
+STEPS = len(VALVES)
+
+STEP_CONFIG = [{'name': 'Transfer',
+                'steps': [{'label': 'Step %d' % i, 'pump': 'ab'[i % 2],
+                           'valves': [{'valve': valve, 'path': 1}]}
+                          for i, valve in enumerate(VALVES)]}]
+
+
+def setup():
+    recorder, i2c = harness.rack()
+    engine = PulseEngine(i2c, max_channels=len(address_map))
+    return recorder, StepExecutor(i2c, engine)
+
+
+VALVE_CONFIG = [{'name': 'Valve users',
+                 'steps': [{'label': 'A', 'pump': 'a',
+                            'valves': [{'valve': 'k', 'path': 0}]},
+                           {'label': 'B', 'pump': 'b',
+                            'valves': [{'valve': 'k', 'path': 0}]},
+                           {'label': 'C', 'pump': 'c',
+                            'valves': [{'valve': 'k', 'path': 1}]}]}]
+
+
+async def run_valve_users(executor, step_index):
+    # `A` pumps long through valve `k`; `B` shares it and finishes first.
+    a = executor.apply(step_index[0], [
+        (addr, pin, 4 * PULSES, ON_MS, OFF_MS)
+        for addr, pin in step_index[0].pumps])
+    b = executor.apply(step_index[1], [(addr, pin, 1, ON_MS, OFF_MS)
+                                       for addr, pin in step_index[1].pumps])
+    await b.wait()
+    assert not a.done
+    c = executor.apply(step_index[2], [(addr, pin, 1, ON_MS, OFF_MS)
+                                       for addr, pin in step_index[2].pumps])
+    return [await a.wait(), b, await c.wait()]
+
+
+def valve_users():
+    recorder, executor = setup()
+    step_index = StepIndex(VALVE_CONFIG, address_map,
+                           valve_settle_ms=SETTLE_MS)
+    handles = asyncio.get_event_loop().run_until_complete(
+        run_valve_users(executor, step_index))
+    assert all(handle.ok for handle in handles)
+    valve_addr, valve_pin = step_index[2].valves[0][:2]
+    switched_us = recorder.edges[valve_addr][valve_pin][-1][0]
+    addr, pin = step_index[0].pumps[0]
+    assert time.ticks_diff(switched_us,
+                           recorder.edges[addr][pin][-1][0]) >= 0
+
+
+def items(step_index):
+    return [(step, [(addr, pin, PULSES, ON_MS, OFF_MS)
+                    for addr, pin in step.pumps])
+            for step in step_index]
+
+
+async def run_sequential(executor, items):
+    handles = []
+    for step, channels in items:
+        handles.append(await executor.apply(step, channels).wait())
+    return handles
+
+
+async def run_chain(executor, items):
+    state = {}
+    handles = executor.chain(items, on_done=lambda handles:
+                             state.setdefault('done', True))
+    while 'done' not in state:
+        await asyncio.sleep_ms(10)
+    return handles
+
+
+def check(recorder, step_index):
+    # Returns the smallest margin between a valve settling and the first
+    # pulse of its step, and between the pumps of consecutive steps.
+    settle_margin = None
+    pump_gap = None
+    last_falling = None
+    for step in step_index:
+        valve_addr, valve_pin = step.valves[0][:2]
+        valve_us = recorder.edges[valve_addr][valve_pin][0][0]
+        addr, pin = step.pumps[0]
+        occurrence = step.index // 2
+        edges = recorder.edges[addr][pin][2 * PULSES * occurrence:
+                                          2 * PULSES * (occurrence + 1)]
+        margin = time.ticks_diff(edges[0][0], valve_us) / 1000 - SETTLE_MS
+        settle_margin = (margin if settle_margin is None
+                         else min(settle_margin, margin))
+        if last_falling is not None:
+            gap = time.ticks_diff(edges[0][0], last_falling) / 1000
+            pump_gap = gap if pump_gap is None else min(pump_gap, gap)
+        last_falling = edges[-1][0]
+    return settle_margin, pump_gap
+
+
+def run(mode):
+    recorder, executor = setup()
+    step_index = StepIndex(STEP_CONFIG, address_map,
+                           valve_settle_ms=SETTLE_MS)
+    main = run_chain if mode == 'chain' else run_sequential
+    start = time.ticks_ms()
+    handles = asyncio.get_event_loop().run_until_complete(
+        main(executor, items(step_index)))
+    total_ms = time.ticks_diff(handles[-1].end, start)
+    step_sum_ms = sum(handle.elapsed_ms() for handle in handles)
+    assert all(handle.ok for handle in handles)
+    settle_margin, pump_gap = check(recorder, step_index)
+    assert settle_margin >= 0 and pump_gap >= 0
+    if mode == 'chain':
+        assert total_ms < step_sum_ms
+    harness.report('step_phases', mode=mode, steps=STEPS,
+                   total_ms=total_ms, step_sum_ms=step_sum_ms,
+                   min_settle_margin_ms=settle_margin,
+                   min_pump_gap_ms=pump_gap)
+
+
+if __name__ == '__main__':
+    valve_users()
+    run('sequential')
+    run('chain')
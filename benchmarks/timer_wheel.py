@@ -0,0 +1,64 @@
+'''
+Wait queue of the event loop: ``utimeq`` or a hashed timing wheel
+(``get_event_loop(wheel=...)``), with many short periodic tasks.
+
+For each of ``TIMERS`` task counts, runs tasks that sleep for one of
+``PERIODS_MS`` in turn (the encoder, buttons and pump edges) for
+``DURATION_MS``, with each wait queue.  Both queues must wake the tasks in
+the same order at the same times.  Reports the wall time per wakeup, which
+is the scheduling overhead of the event loop.
+
+``utimeq`` is implemented in C on the device but emulated in Python on a
+workstation, so only figures taken on the device compare the two fairly.
+
+Usage: ``micropython benchmarks/timer_wheel.py``
+'''
+import harness
+
+import time
+
+import uasyncio as asyncio
+import uasyncio.core
+
+
+TIMERS = (10, 100, 1000)
+PERIODS_MS = (10, 50, 50, 150, 100)
+DURATION_MS = 1000
+WHEEL_SLOTS = 256
+
+
+async def periodic(i, start, wakeups):
+    period_ms = PERIODS_MS[i % len(PERIODS_MS)]
+    while time.ticks_diff(time.ticks_ms(), start) < DURATION_MS:
+        await asyncio.sleep_ms(period_ms)
+        wakeups.append((i, time.ticks_diff(time.ticks_ms(), start)))
+
+
+async def main(timers, wakeups):
+    loop = asyncio.get_event_loop()
+    start = time.ticks_ms()
+    for i in range(timers):
+        loop.create_task(periodic(i, start, wakeups))
+    await asyncio.sleep_ms(DURATION_MS + max(PERIODS_MS) + 10)
+
+
+def run(timers, wheel):
+    uasyncio.core._event_loop = None
+    loop = asyncio.get_event_loop(runq_len=2 * timers + 16,
+                                  waitq_len=timers + 16, wheel=wheel)
+    wakeups = []
+    start = harness.wall_us()
+    loop.run_until_complete(main(timers, wakeups))
+    run_us = time.ticks_diff(harness.wall_us(), start)
+    return wakeups, run_us
+
+
+if __name__ == '__main__':
+    for timers in TIMERS:
+        heap_wakeups, heap_us = run(timers, 0)
+        wheel_wakeups, wheel_us = run(timers, WHEEL_SLOTS)
+        assert wheel_wakeups == heap_wakeups
+        harness.report('timer_wheel', timers=timers,
+                       wakeups=len(heap_wakeups),
+                       utimeq_us=heap_us / len(heap_wakeups),
+                       wheel_us=wheel_us / len(wheel_wakeups))
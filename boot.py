@@ -4,17 +4,26 @@ import sys
 sys.path.insert(0, '/_lib')  # pragma: no cover
 import time
 import uasyncio as asyncio
-import math
 
 from base_node import BaseDriver, replace
-from config import DEFAULT_SETTINGS, address_map, steps
-from machine import I2C, Pin
+from config import (DEFAULT_SETTINGS, FLOW_SAMPLE_MS, FLOW_SAMPLES,
+                    FLOW_SENSOR_ADDR, JOURNAL_FLUSH_MS, JOURNAL_PATH,
+                    PULSE_TIMER_ID, VALVE_SETTLE_MS, address_map,
+                    calibrations, sequences, steps)
+from drivers import init_drivers
+from executor import StepExecutor
+from i2c_bus import Bus, PRIORITY_HIGH
+from journal import Journal
+from machine import I2C, Pin, Timer
 from lvgl_helpers import InputsTabView
 from m5_lvgl import M5ili9341
-from pump import pump
-from valve import set_valve
+from pulse import PulseEngine, TimerPulseEngine
+from scheduler import ResourceScheduler
+from sensiron import FlowSamples, SLF3S_1300F
+from sequence import Sequence, SequenceRunner
+from step_index import StepIndex
+import dosing
 import functools as ft
-import grove_i2c_motor as gm
 import lvgl as lv
 
 import ui
@@ -33,14 +42,28 @@ def initialize(driver, **kwargs):
 
 
 disp = M5ili9341()
-i2c = I2C(scl=Pin(22), sda=Pin(21), freq=10000)
+# All drivers share the bus through `Bus`, whose lock serializes the
+# transactions of concurrent tasks.
+i2c = Bus(I2C(scl=Pin(22), sda=Pin(21), freq=10000))
 ui_context = ui.ui_context(disp, i2c)
+# Create one long-lived driver per pump/valve board up front.
+init_drivers(i2c, address_map)
+# Drives the pulse trains of all pumps, from a single task or from a timer.
+if PULSE_TIMER_ID is None:
+    pulse_engine = PulseEngine(i2c, max_channels=len(address_map))
+else:
+    pulse_engine = TimerPulseEngine(i2c, Timer(PULSE_TIMER_ID),
+                                    max_channels=len(address_map))
 gc.collect()
 
 
 async def faces_encoder_update(encoder):
     while True:
-        encoder.update()
+        await i2c.lock.acquire(PRIORITY_HIGH)
+        try:
+            encoder.update()
+        finally:
+            i2c.lock.release()
         await asyncio.sleep_ms(10)
         
 
@@ -48,156 +71,209 @@ async def flash_leds(encoder, pulse_duration_ms=25, wait_duration_ms=1000):
     while True:
         for i in range(3):
             for index in range(10):
-                encoder.set_led(index, (255 if i == 0 else 0,
-                                        255 if i == 1 else 0,
-                                        255 if i == 2 else 0))
+                await i2c.lock.acquire(PRIORITY_HIGH)
+                try:
+                    encoder.set_led(index, (255 if i == 0 else 0,
+                                            255 if i == 1 else 0,
+                                            255 if i == 2 else 0))
+                finally:
+                    i2c.lock.release()
                 gc.collect()
                 await asyncio.sleep_ms(pulse_duration_ms)
 
         for index in range(12):
-            encoder.set_led(index, (0, 0, 0))
+            await i2c.lock.acquire(PRIORITY_HIGH)
+            try:
+                encoder.set_led(index, (0, 0, 0))
+            finally:
+                i2c.lock.release()
             gc.collect()
             await asyncio.sleep_ms(pulse_duration_ms)
         await asyncio.sleep_ms(wait_duration_ms)
 
 encoder = ui_context['faces_driver'].encoder
 
-loop = asyncio.get_event_loop()
+# Size the event loop queues for the workload: the long-lived tasks (encoder,
+# displays, journal, pulse engine and flow sensor), one task per sequence and
+# one per output for the steps driving it.  Queues that still fill up grow,
+# instead of raising from inside the event loop.
+loop_tasks = 6 + len(sequences) + len(address_map)
+loop = asyncio.get_event_loop(runq_len=2 * loop_tasks, waitq_len=loop_tasks,
+                              overflow=asyncio.OVERFLOW_GROW)
 loop.create_task(faces_encoder_update(encoder))
+# Flow samples (if a flow sensor is fitted), e.g., to select those taken
+# between the `start` and `end` of a step handle.
+flow_samples = None
+if FLOW_SENSOR_ADDR is not None:
+    flow_samples = FlowSamples(FLOW_SAMPLES)
+    loop.create_task(SLF3S_1300F(i2c, FLOW_SENSOR_ADDR)
+                     .stream(flow_samples, FLOW_SAMPLE_MS))
 
 tabview = InputsTabView(lv.scr_act(), (ui_context['button_driver'],
                                        ui_context['faces_driver']))
 
-pumps = sorted(set(pump for super_step in steps for step in super_step['steps']
-                   for pump in (step.get('pump', [])
-                   if isinstance(step.get('pump', []), list)
-                   else [step.get('pump', [])])))
-valves = sorted(set(valve['valve'] for super_step in steps
-                    for step in super_step['steps']
-                    for valve in step.get('valves', tuple())))
-switches = sorted(set(switches['pin'] for super_step in steps
-                    for step in super_step['steps']
-                    for switches in step.get('switches', tuple())))
-step_names = tuple(step['label'] for super_step in steps
-                   for step in super_step['steps'])
-steps_tab = tabview.add_widget('Steps', ui.PumpList, step_names,
+# Resolve (and validate) every step once, up front.
+step_index = StepIndex(steps, address_map,
+                       dosing.load_calibrations(calibrations),
+                       valve_settle_ms=VALVE_SETTLE_MS)
+steps_tab = tabview.add_widget('Steps', ui.PumpList, step_index.names,
                                ui_context['style'])
-steps_list = [step for super_step in steps for step in super_step['steps']]
 
-sequences_tab = tabview.add_widget('Sequences', ui.SequenceList, ['Mix A+B'],
+sequence_list = [Sequence(config, step_index) for config in sequences]
+sequences_tab = tabview.add_widget('Sequences', ui.SequenceList,
+                                   [sequence.name
+                                    for sequence in sequence_list],
                                    ui_context['style'])
 
+# Progress of the run interrupted by the last reset, if any.
+journal = Journal(JOURNAL_PATH, flush_ms=JOURNAL_FLUSH_MS)
+recovered = journal.load()
 gc.collect()
 
-mix_ab_running = False
-mix_ab_start_time = 0
 
-async def mix_ab():
-    global mix_ab_running
-    global mix_ab_start_time
+def sequence_done(widget, runner):
+    widget.switch.off(0)
+    widget.time.set_text('')
 
-    sequence = sequences_tab.sequences[0]
-    liquid_in_a = True
-
-    while True:
-        if mix_ab_running:
-            run_time = time.time() - mix_ab_start_time
-            
-            seconds = run_time % 60
-            minutes = math.floor(run_time % 3600 / 60)
-            hours = math.floor(run_time / 3600)
-
-            sequence.time.set_text('%02d:%02d:%02d' % (hours, minutes, seconds))
-
-            if minutes == 0 and liquid_in_a:
-                i = find_step('A -> B')
-                apply_step(steps_list[i], steps_tab.pumps[i])
-                liquid_in_a = False
-            elif minutes == 30 and not liquid_in_a:
-                i = find_step('B -> A')
-                apply_step(steps_list[i], steps_tab.pumps[i])
-                liquid_in_a = True
-
-            if hours >= 16:
-                sequence.switch.off(0)
-                mix_ab_callback(sequence.switch, lv.EVENT.VALUE_CHANGED)
-
-        await asyncio.sleep(1)
-
-
-def find_step(name):
-    for i, name_i in zip(range(len(step_names)), step_names):
-        if name_i == name:
-            return i
-
-
-def mix_ab_callback(obj, event, *args, **kwargs):
-    global mix_ab_running
-    global mix_ab_start_time
 
+def sequence_callback(runner, widget, obj, event, *args, **kwargs):
     if event == lv.EVENT.VALUE_CHANGED:
         if obj.get_state():
-            mix_ab_running = True
-            mix_ab_start_time = time.time()
+            runner.start()
         else:
-            mix_ab_running = False
-            sequences_tab.sequences[0].time.set_text('')
-
-
-sequences_tab.sequences[0].switch.set_event_cb(mix_ab_callback)
+            runner.stop()
+            widget.time.set_text('')
+
+
+# Each sequence schedules its own events; starting one does not affect the
+# others.
+sequence_runners = []
+for i, (sequence_i, widget_i) in enumerate(zip(sequence_list,
+                                               sequences_tab.sequences)):
+    runner_i = SequenceRunner(
+        sequence_i, lambda step: apply_step(step, steps_tab.pumps[step.index]),
+        on_done=ft.partial(sequence_done, widget_i))
+    widget_i.switch.set_event_cb(ft.partial(sequence_callback, runner_i,
+                                            widget_i))
+    journal.track(i, runner_i)
+    sequence_runners.append((runner_i, widget_i))
+
+
+async def sequence_display():
+    # Display only; sequence events are scheduled by the runners.
+    while True:
+        for runner, widget in sequence_runners:
+            if runner.running:
+                widget.time.set_text('%02d:%02d:%02d' %
+                                     runner.run_clock.hms())
+        await asyncio.sleep(1)
 
-loop.create_task(mix_ab())
+loop.create_task(sequence_display())
 
 gc.collect()
 
-output_pins = (gm.IN1, gm.IN2, gm.IN3, gm.IN4)
 
-async def set_switch(pin, value):
+def set_switch(pin, value):
     Pin(pin, Pin.OUT).value(value)
-    gc.collect()
+
+executor = StepExecutor(i2c, pulse_engine, switch=set_switch, journal=journal)
+# Steps sharing a pump or valve wait for each other; pressing the button of
+# a running step again does not start it twice.
+scheduler = ResourceScheduler(executor)
+# Handle of the latest run of each step, by step index.
+step_handles = {}
+
+def run_step(step, channels):
+    '''
+    Parameters
+    ----------
+    step : step_index.Step
+    channels : list[tuple]
+        Pulse trains of the step's pumps (see ``PulseEngine.submit``).
+
+    Returns
+    -------
+    executor.StepHandle
+    '''
+    handle = scheduler.request(step, channels)
+    step_handles[step.index] = handle
+    return handle
 
 def apply_step(step, widget):
-    loop = asyncio.get_event_loop()
-    if 'valves' in step:
-        for valve_state in step['valves']:
-            config = address_map[valve_state['valve']]
-            loop.create_task(set_valve(i2c, config['addr'],
-                                       output_pins[config['index']],
-                                       valve_state['path']))
-
-    if 'pump' in step:
-        pumps = (step['pump'] if isinstance(step['pump'], list)
-                 else [step['pump']])
-        for key in pumps:
-            p = address_map[key]
-            period_ms = int(1e3 * widget.period)
-            off_ms = max(max(period_ms, 50) - 50, 150)
-            loop.create_task(pump(i2c, p['addr'], output_pins[p['index']],
-                                  widget.pulses, off_ms=off_ms))
-
-    if 'switches' in step:
-        for switch_state in step['switches']:
-            loop.create_task(set_switch(switch_state['pin'],
-                                        switch_state['value']))
+    '''
+    Parameters
+    ----------
+    step : step_index.Step
+    widget : ui.Pump
+
+    Returns
+    -------
+    executor.StepHandle
+    '''
+    channels = []
+    if step.pumps:
+        period_ms = int(round(1e3 * widget.period))
+        doses = step.doses
+        if doses is None or doses[0] != (widget.pulses, period_ms):
+            # No volume, or pulses/period edited in the UI.
+            doses = [(widget.pulses, period_ms)] * len(step.pumps)
+        for (addr, pin), (pulses, period_ms) in zip(step.pumps, doses):
+            on_ms, off_ms = dosing.pulse_timing(period_ms)
+            channels.append((addr, pin, pulses, on_ms, off_ms))
+    return run_step(step, channels)
 
 def step_callback(step, widget, obj, event, *args, **kwargs):
     if event == lv.EVENT.PRESSED:
         apply_step(step, widget)
         gc.collect()
 
-for step_i, widget_i in zip((step for super_step in steps
-                             for step in super_step['steps']),
-                            steps_tab.pumps):
+for step_i, widget_i in zip(step_index.steps, steps_tab.pumps):
     widget_i.button.set_event_cb(ft.partial(step_callback, step_i, widget_i))
     gc.collect()
 
     # Update the number of 'pulses' for steps where it is specified.
-    if 'pulses' in step_i.keys():
-        widget_i.pulses_spinbox.set_value(step_i['pulses'])
+    if step_i.pulses is not None:
+        widget_i.pulses_spinbox.set_value(step_i.pulses)
         gc.collect()
+    else:
+        # Show the pulse train dosing the step 'volume' (first pump).
+        if step_i.doses is not None:
+            pulses, period_ms = step_i.doses[0]
+            widget_i.pulses_spinbox.set_value(pulses)
+            widget_i.period_spinbox.set_value(
+                period_ms // dosing.PERIOD_RESOLUTION_MS)
+            gc.collect()
 
 # Cycle the encoder through all of the widgets on the "Steps" tab to hide
 # the blinking cursors on the spinboxes.
 encoder._diff = len(steps_tab.pumps) * 3 + 1
 
+
+async def step_display():
+    # Show the progress of running steps on their buttons.
+    while True:
+        for index, handle in list(step_handles.items()):
+            widget = steps_tab.pumps[index]
+            if handle.done:
+                del step_handles[index]
+                widget.button.label.set_text(widget.label if handle.ok
+                                             else widget.label + ' !')
+            else:
+                widget.button.label.set_text('%s %d%%' %
+                                             (widget.label,
+                                              100 * handle.progress()))
+        await asyncio.sleep(1)
+
+loop.create_task(step_display())
+
+# Continue the sequences and pulse trains interrupted by a reset.
+journal.resume(recovered,
+               lambda i, channels: run_step(step_index[i], channels))
+for runner_i, widget_i in sequence_runners:
+    if runner_i.running:
+        widget_i.switch.on(0)
+del recovered
+loop.create_task(journal.run())
+gc.collect()
+
 _thread.start_new_thread(loop.run_forever, tuple())
\ No newline at end of file
@@ -3,6 +3,9 @@
 # For each pump and valve:
 #  - `addr`: I2C address of corresponding Grove motor control board
 #  - `index`: output index (0-3) within the Grove motor control board
+#  - `settle_ms` (optional, valves only): time the valve takes to switch,
+#    i.e., delay between setting the valve and starting the pumps of a step.
+#    Defaults to `VALVE_SETTLE_MS`.
 address_map = {
     'a': {'addr': 17, 'index':  0},
     'b': {'addr': 17, 'index':  1},
@@ -22,12 +25,40 @@ address_map = {
     'p': {'addr': 15, 'index':  3}
 }
 
+# ID of the `machine.Timer` used to fire pump pulse edges.  If `None`, edges
+# are written by an event loop task, and are delayed whenever the loop is
+# blocked (e.g., by a display refresh).
+PULSE_TIMER_ID = None
+
+# Default valve settle time, in milliseconds (see `address_map`).
+VALVE_SETTLE_MS = 100
+
+# I2C address of a Sensirion SLF3S flow sensor to sample continuously (`None`
+# if there is none), its sampling period in milliseconds and the number of
+# samples kept, e.g., to log the flow of each step.
+FLOW_SENSOR_ADDR = None
+FLOW_SAMPLE_MS = 20
+FLOW_SAMPLES = 512
+
+# Journal of sequence progress and pulse trains, used to resume them after a
+# reset, and the interval between writes of pulse counts, in milliseconds.
+# Pulses delivered since the last write are repeated on resume.
+JOURNAL_PATH = '/journal.bin'
+JOURNAL_FLUSH_MS = 1000
+
 DEFAULT_SETTINGS = {
     'L/pulse': 20e-6,
     'L/minute': 5e-3,
     'volume': 1e-3,  # Default pump volume (in liters)
 }
 
+# Per-pump calibration: `(pulses per minute, liters per pulse)` measurements.
+# Steps with a `volume` run each pump at the fastest calibrated rate; pumps
+# without a calibration use `DEFAULT_SETTINGS`.  For example:
+#
+#     calibrations = {'a': ((100, 22e-6), (200, 20e-6), (300, 18e-6))}
+calibrations = {}
+
 # Valve paths: A=0, B=1
 steps = [
     {'name': 'Rehydrate Lysate',
@@ -81,4 +112,16 @@ steps = [
                            {'valve': 'o', 'path': 1},
                            {'valve': 'n', 'path': 0},
                            {'valve': 'p', 'path': 1}]}]},
+]
+
+# Timed sequences of steps, started from the "Sequences" tab:
+#  - `duration_s`: total run time, in seconds
+#  - `events`: `step` label, `offset_s` from the start of the sequence and,
+#    optionally, `repeat_s` period of the step
+sequences = [
+    {'name': 'Mix A+B',
+     'duration_s': 16 * 60 * 60,
+     'events': [{'step': 'A -> B', 'offset_s': 0, 'repeat_s': 60 * 60},
+                {'step': 'B -> A', 'offset_s': 30 * 60,
+                 'repeat_s': 60 * 60}]},
 ]
\ No newline at end of file
@@ -0,0 +1,184 @@
+'''
+Convert liquid volumes to pump pulse trains.
+'''
+import array
+
+from config import DEFAULT_SETTINGS
+
+
+# Pulse timing of `pump()`: each pulse is on for `PULSE_ON_MS`, and off for at
+# least `MIN_OFF_MS` so the pump can refill.
+PULSE_ON_MS = 50
+MIN_OFF_MS = 150
+MIN_PERIOD_MS = PULSE_ON_MS + MIN_OFF_MS
+# Resolution of the pulse period in the UI (see `ui.Pump.period`).
+PERIOD_RESOLUTION_MS = 100
+
+
+def pulse_timing(period_ms):
+    '''
+    Parameters
+    ----------
+    period_ms : int
+        Requested pulse period, in milliseconds.
+
+    Returns
+    -------
+    tuple
+        ``(on_ms, off_ms)``.  Periods shorter than ``MIN_PERIOD_MS`` are
+        stretched to ``MIN_PERIOD_MS``.
+    '''
+    return PULSE_ON_MS, max(period_ms - PULSE_ON_MS, MIN_OFF_MS)
+
+
+class Calibration:
+    '''
+    Volume per pulse of one pump as a function of pulse rate.
+
+    Parameters
+    ----------
+    points : list[tuple]
+        ``(pulses_per_minute, liters_per_pulse)`` measurements, in any order.
+        Volumes between measured rates are interpolated linearly.
+    '''
+    def __init__(self, points):
+        points = sorted(points)
+        if not points:
+            raise ValueError('Calibration needs at least one point.')
+        self.rates = array.array('f', [rate for rate, volume in points])
+        self.volumes = array.array('f', [volume for rate, volume in points])
+
+    @property
+    def max_rate(self):
+        return self.rates[-1]
+
+    @property
+    def min_rate(self):
+        return self.rates[0]
+
+    def volume_per_pulse(self, rate):
+        '''
+        Parameters
+        ----------
+        rate : float
+            Pulse rate, in pulses per minute.
+
+        Returns
+        -------
+        float
+            Volume per pulse, in liters.
+
+        Raises
+        ------
+        ValueError
+            If ``rate`` is outside the calibrated range.
+        '''
+        rates = self.rates
+        volumes = self.volumes
+        if rate < rates[0] or rate > rates[-1]:
+            raise ValueError('Rate %.1f/min outside calibration (%.1f-%.1f).'
+                             % (rate, rates[0], rates[-1]))
+        # Binary search for the first point at or above `rate`.
+        lo, hi = 0, len(rates) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if rates[mid] < rate:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0 or rates[lo] == rate:
+            return volumes[lo]
+        fraction = (rate - rates[lo - 1]) / (rates[lo] - rates[lo - 1])
+        return volumes[lo - 1] + fraction * (volumes[lo] - volumes[lo - 1])
+
+
+def default_calibration(settings=DEFAULT_SETTINGS):
+    '''
+    Returns
+    -------
+    Calibration
+        Constant ``settings['L/pulse']``, from 1 pulse per minute up to the
+        rate at which the flow reaches ``settings['L/minute']``.
+    '''
+    volume = settings['L/pulse']
+    return Calibration([(1, volume), (settings['L/minute'] / volume, volume)])
+
+
+def load_calibrations(config_calibrations):
+    '''
+    Parameters
+    ----------
+    config_calibrations : dict
+        Mapping from pump name to calibration points (see
+        ``config.calibrations``).
+
+    Returns
+    -------
+    dict
+        Mapping from pump name to :class:`Calibration`.
+    '''
+    return dict((name, Calibration(points))
+                for name, points in config_calibrations.items())
+
+
+def step_doses(step, calibrations, default=None):
+    '''
+    Parameters
+    ----------
+    step : dict
+        Step from ``config.steps``.
+    calibrations : dict
+        Mapping from pump name to :class:`Calibration`.
+    default : Calibration, optional
+        Calibration of pumps missing from ``calibrations``.  Defaults to
+        :func:`default_calibration`.
+
+    Returns
+    -------
+    list[tuple]
+        ``(pulses, period_ms)`` for every pump of the step, or ``None`` if the
+        step does not specify a ``volume`` (or specifies ``pulses``).
+    '''
+    if 'volume' not in step or 'pulses' in step or 'pump' not in step:
+        return None
+    if default is None:
+        default = default_calibration()
+    pumps = (step['pump'] if isinstance(step['pump'], list)
+             else [step['pump']])
+    return [dose(step['volume'], calibrations.get(key, default))
+            for key in pumps]
+
+
+def dose(volume, calibration):
+    '''
+    Pulse train delivering ``volume`` at the fastest calibrated pulse rate.
+
+    The period is rounded up to a multiple of ``PERIOD_RESOLUTION_MS``, and
+    is at least ``MIN_PERIOD_MS``.
+
+    Parameters
+    ----------
+    volume : float
+        Volume to pump, in liters.
+    calibration : Calibration
+        Calibration of the pump.
+
+    Returns
+    -------
+    tuple
+        ``(pulses, period_ms)``.
+
+    Raises
+    ------
+    ValueError
+        If the pump cannot run within its calibrated range.
+    '''
+    period_ms = max(60e3 / calibration.max_rate, MIN_PERIOD_MS)
+    period_ms = int(-(-period_ms // PERIOD_RESOLUTION_MS) *
+                    PERIOD_RESOLUTION_MS)
+    rate = 60e3 / period_ms
+    if rate < calibration.min_rate:
+        raise ValueError('No %d ms multiple period within calibration.' %
+                         PERIOD_RESOLUTION_MS)
+    pulses = max(1, int(volume / calibration.volume_per_pulse(rate) + .5))
+    return pulses, period_ms
\ No newline at end of file
@@ -0,0 +1,281 @@
+import gc
+import uasyncio as asyncio
+
+import grove_i2c_motor as gm
+from i2c_bus import park, wake
+
+
+# Commands between `gc.collect()` calls of shared drivers (see
+# `base_node.BaseDriver`).  Buffered commands allocate little and MicroPython
+# collects whenever the heap runs out anyway, while a full collection after
+# every command delays the pulse edges that follow it, e.g., later edges of
+# the same `TimerPulseEngine` pass.
+GC_INTERVAL = 100
+
+# Shared drivers, keyed by I2C address.
+_drivers = {}
+# Shared port writers, keyed by I2C address.
+_port_writers = {}
+
+
+class PortWriter:
+    '''
+    Merge digital writes to one board into port writes.
+
+    Writes requested by different tasks during the same pass of the event
+    loop (e.g., pulse edges of concurrent ``pump()`` tasks sharing a deadline)
+    are sent as a single ``CMD_DIGITAL_WRITE_PORT`` per port.
+
+    The first task to request a write after a flush sends the merged
+    write after yielding once, so every task scheduled in the same pass can
+    add its pins.  The other tasks are suspended until that write has been
+    sent, and fail with the same exception if it failed.  If the sending
+    task is cancelled, the pins stay staged and a waiting task sends them.
+
+    Parameters
+    ----------
+    driver : base_node.BaseDriver
+        Driver of the board.
+
+    Attributes
+    ----------
+    requests : int
+        Number of pin writes requested.
+    writes : int
+        Number of port writes sent.
+    '''
+    # Number of ports, i.e., length of the `pin_state_bytes` configuration.
+    PORT_COUNT = 9
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.requests = 0
+        self.writes = 0
+        self._mask = bytearray(self.PORT_COUNT)
+        self._value = bytearray(self.PORT_COUNT)
+        self._flushing = False
+        self._waiting = []
+        # Outcome of the current flush, shared with its waiting tasks:
+        # `[sent, exception]`, where `sent` is `None` until the flush ends
+        # and `False` if the sending task was cancelled.
+        self._outcome = None
+
+    @property
+    def staged(self):
+        '''``True`` if pin states are waiting for :meth:`flush`.'''
+        return any(self._mask)
+
+    def stage(self, pin, value):
+        '''
+        Queue the state of an output pin for the next :meth:`flush`.
+
+        Parameters
+        ----------
+        pin : int
+            Output pin (e.g., ``grove_i2c_motor.IN1``).
+        value : bool
+            Output state.
+        '''
+        port = pin // 8
+        bit = 1 << (pin % 8)
+        self._mask[port] |= bit
+        if value:
+            self._value[port] |= bit
+        else:
+            self._value[port] &= ~bit
+        self.requests += 1
+
+    async def write(self, pin, value):
+        '''
+        Set the state of an output pin.
+
+        Parameters
+        ----------
+        pin : int
+            Output pin (e.g., ``grove_i2c_motor.IN1``).
+        value : bool
+            Output state.
+        '''
+        self.stage(pin, value)
+        await self.flush()
+
+    async def flush(self):
+        '''
+        Send the staged pin states, merged with the writes of other tasks in
+        the same pass of the event loop.
+        '''
+        while self._flushing:
+            # Another task sends the merged write.
+            outcome = self._outcome
+            task = asyncio.get_event_loop().cur_task
+            self._waiting.append(task)
+            try:
+                while outcome[0] is None:
+                    await park(task)
+            except BaseException:
+                # Cancelled while waiting.
+                if task in self._waiting:
+                    self._waiting.remove(task)
+                raise
+            if outcome[0]:
+                if outcome[1] is not None:
+                    raise outcome[1]
+                return
+            # The sending task was cancelled: send the write, unless another
+            # waiting task took over first.
+
+        self._flushing = True
+        outcome = self._outcome = [None, None]
+        try:
+            # Let other tasks scheduled in this pass add their writes.
+            await asyncio.sleep_ms(0)
+            await self._flush()
+        except asyncio.CancelledError:
+            # The pins are still staged.
+            outcome[0] = False
+            raise
+        except Exception as exception:
+            outcome[0] = True
+            outcome[1] = exception
+            raise
+        else:
+            outcome[0] = True
+        finally:
+            self._flushing = False
+            waiting = self._waiting
+            self._waiting = []
+            for task in waiting:
+                wake(task)
+
+    async def _flush(self):
+        mask = self._mask
+        value = self._value
+        pending = True
+        # Writes requested while a port write is in progress are sent before
+        # the waiting tasks are released.
+        while pending:
+            pending = False
+            for port in range(self.PORT_COUNT):
+                port_mask = mask[port]
+                if port_mask:
+                    port_value = value[port]
+                    mask[port] = 0
+                    pending = True
+                    self.writes += 1
+                    try:
+                        await self.driver.adigital_write_port(
+                            port, port_mask, port_value)
+                    except asyncio.CancelledError:
+                        # Stage the pins again, unless staged since.
+                        keep = port_mask & ~mask[port]
+                        mask[port] |= keep
+                        value[port] = value[port] & ~keep | port_value & keep
+                        raise
+
+
+def get_driver(i2c, i2c_address, **kwargs):
+    '''
+    Return the shared driver for the board at ``i2c_address``.
+
+    The driver is created on first use and reused by every pump and valve
+    task on the same board afterwards.
+
+    Parameters
+    ----------
+    i2c : machine.I2C
+        I2C driver handle.
+    i2c_address : int
+        I2C address.
+    **kwargs
+        Extra keyword arguments for ``base_node.BaseDriver``, used only when
+        the driver is first created.  By default, drivers are buffered and
+        collect garbage every :data:`GC_INTERVAL` commands.
+
+    Returns
+    -------
+    base_node.BaseDriver
+    '''
+    driver = _drivers.get(i2c_address)
+    if driver is None:
+        kwargs.setdefault('buffered', True)
+        kwargs.setdefault('gc_interval', GC_INTERVAL)
+        driver = gm.BaseDriver(i2c, i2c_address, **kwargs)
+        _drivers[i2c_address] = driver
+        gc.collect()
+    return driver
+
+
+def get_port_writer(i2c, i2c_address):
+    '''
+    Return the shared :class:`PortWriter` for the board at ``i2c_address``.
+
+    Parameters
+    ----------
+    i2c : machine.I2C
+        I2C driver handle.
+    i2c_address : int
+        I2C address.
+
+    Returns
+    -------
+    PortWriter
+    '''
+    writer = _port_writers.get(i2c_address)
+    if writer is None:
+        writer = PortWriter(get_driver(i2c, i2c_address))
+        _port_writers[i2c_address] = writer
+    return writer
+
+
+def init_drivers(i2c, address_map, **kwargs):
+    '''
+    Create the driver for every board referenced in ``address_map``.
+
+    Each board is also probed for port command support, so the first port
+    write from a task does not have to wait for the probe.
+
+    Parameters
+    ----------
+    i2c : machine.I2C
+        I2C driver handle.
+    address_map : dict
+        Mapping from pump/valve name to ``{'addr': ..., 'index': ...}`` (see
+        ``config.address_map``).
+    **kwargs
+        Extra keyword arguments for ``base_node.BaseDriver``.
+
+    Returns
+    -------
+    dict
+        Mapping from I2C address to driver.
+    '''
+    for addr in sorted(set(output['addr'] for output in address_map.values())):
+        driver = get_driver(i2c, addr, **kwargs)
+        try:
+            driver._supports_port_io()
+        except Exception as exception:
+            # Probed again on first use.
+            print('Error probing board 0x%02x:' % addr, exception)
+    return _drivers
+
+
+def reset():
+    '''
+    Forget the shared drivers and port writers, e.g., once the bus they
+    were created on is replaced.
+    '''
+    _drivers.clear()
+    _port_writers.clear()
+
+
+def stats():
+    '''
+    Returns
+    -------
+    dict
+        Mapping from I2C address to ``(command_count, error_count,
+        last_latency_us)``.
+    '''
+    return dict((addr, (driver.command_count, driver.error_count,
+                        driver.last_latency_us))
+                for addr, driver in _drivers.items())
@@ -0,0 +1,419 @@
+'''
+Apply steps and track their completion.
+'''
+import time
+import uasyncio as asyncio
+
+from drivers import get_port_writer
+
+
+class Result:
+    '''
+    Outcome of one actuator of a step.
+
+    Attributes
+    ----------
+    kind : str
+        ``'valve'``, ``'pump'`` or ``'switch'``.
+    addr : int
+        I2C address of the board, or ``None`` for a switch.
+    pin : int
+    start : int
+        Time the actuator was started, in ``ticks_ms``.
+    end : int
+        Time the actuator finished, in ``ticks_ms``, or ``None`` while it is
+        running.
+    error : Exception
+        Error that stopped the actuator, or ``None``.
+    channel : pulse.Channel
+        Pulse train of a pump, or ``None``.
+    '''
+    def __init__(self, kind, addr, pin, start):
+        self.kind = kind
+        self.addr = addr
+        self.pin = pin
+        self.start = start
+        self.end = None
+        self.error = None
+        self.channel = None
+
+    @property
+    def ok(self):
+        '''
+        ``True`` if the actuator finished without error, and a pump
+        delivered all its pulses.
+        '''
+        channel = self.channel
+        return self.end is not None and self.error is None and \
+            (channel is None or (not channel.errors and not channel.cancelled
+                                 and channel.count >= channel.pulses))
+
+
+class StepHandle:
+    '''
+    Completion of the valves, pumps and switches of one step.
+
+    Attributes
+    ----------
+    step : step_index.Step
+    results : list[Result]
+        One result per actuator: valves, then pumps, then switches.
+    job : pulse.Job
+        Pulse trains of the pumps, or ``None``.
+    start, end : int
+        Times the step started and finished, in ``ticks_ms``; ``end`` is
+        ``None`` until :attr:`done`.
+    done : bool
+        ``True`` once every actuator has finished.
+    '''
+    def __init__(self, step, clock):
+        self.step = step
+        self.clock = clock
+        self.results = []
+        self.job = None
+        self.start = clock.ticks_ms()
+        self.end = None
+        self.done = False
+        self.callbacks = []
+        self._pending = 0
+
+    @property
+    def ok(self):
+        return self.done and all(result.ok for result in self.results)
+
+    def elapsed_ms(self):
+        '''
+        Returns
+        -------
+        int
+            Duration of the step, or time since it started if not done.
+        '''
+        end = self.clock.ticks_ms() if self.end is None else self.end
+        return self.clock.ticks_diff(end, self.start)
+
+    def progress(self):
+        '''
+        Returns
+        -------
+        float
+            Fraction of the step's pulses delivered, or ``1.`` once done.
+        '''
+        if self.done:
+            return 1.
+        pulses = 0
+        count = 0
+        if self.job is not None:
+            for channel in self.job.channels:
+                pulses += channel.pulses
+                count += min(channel.count, channel.pulses)
+        return count / pulses if pulses else 0.
+
+    def cancel(self):
+        '''
+        Stop the pumps of the step at their next edge.
+        '''
+        if self.job is not None:
+            self.job.cancel()
+
+    def add_callback(self, callback):
+        '''
+        Call ``callback(handle)`` once the step is done, or right away if it
+        already is.  Callbacks run as soon as the last actuator finishes,
+        e.g., from the pulse engine.
+        '''
+        if self.done:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    async def wait(self, poll_ms=20):
+        '''
+        Wait until the step is done.
+
+        Returns
+        -------
+        StepHandle
+            This handle.
+        '''
+        while not self.done:
+            await asyncio.sleep_ms(poll_ms)
+        return self
+
+    def _add(self, kind, addr, pin):
+        result = Result(kind, addr, pin, self.clock.ticks_ms())
+        self.results.append(result)
+        self._pending += 1
+        return result
+
+    def _finish(self, result, error=None, end=None):
+        result.end = self.clock.ticks_ms() if end is None else end
+        result.error = error
+        self._release()
+
+    def _release(self):
+        self._pending -= 1
+        if not self._pending:
+            self._complete()
+
+    def _complete(self):
+        self.done = True
+        self.end = self.clock.ticks_ms()
+        callbacks = self.callbacks
+        self.callbacks = []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as exception:
+                print('Error in step callback:', exception)
+
+
+class StepExecutor:
+    '''
+    Apply steps without blocking, returning a :class:`StepHandle` per step.
+
+    Each step runs in phases.  First, switches are set and the valves are
+    written, in one batch per board.  Once the slowest valve that changed
+    position has settled, the pumps run as one job on the pulse engine.
+    Valves left in position by an earlier step need no settle time, but are
+    written again, in case their board was reset since.
+
+    Consecutive steps overlap: the valve phase of a step runs while the
+    pumps of the previous step (see ``after`` in :meth:`apply`) are still
+    running, unless it switches a valve that an unfinished step relies on.
+
+    Errors are recorded in the handle's results rather than only printed.
+
+    Parameters
+    ----------
+    i2c : machine.I2C
+        I2C driver handle.
+    engine : pulse.PulseEngine or pulse.TimerPulseEngine
+        Runs the pulse trains of the pumps.
+    switch : callable, optional
+        Called as ``switch(pin, value)`` to set a switch output, e.g., using
+        ``machine.Pin``.  Required for steps with switches.
+    journal : journal.Journal, optional
+        If given, the jobs of started steps are journaled.
+    clock : module, optional
+        Source of ``ticks_ms``/``ticks_diff``.
+    '''
+    def __init__(self, i2c, engine, switch=None, journal=None, clock=time):
+        self.i2c = i2c
+        self.engine = engine
+        self.switch = switch
+        self.journal = journal
+        self.clock = clock
+        # `addr << 8 | pin` -> latest position claimed for each valve, as
+        # `[path, handles, blockers, written]`: the steps relying on it, the
+        # steps relying on the previous position, which must finish before
+        # it is set, and the time it was written (`None` until then, or if
+        # the write failed).  Claims are made in the order steps are
+        # applied.
+        self._valves = {}
+
+    def apply(self, step, channels, after=None, handle=None):
+        '''
+        Start a step.
+
+        Parameters
+        ----------
+        step : step_index.Step
+        channels : list[tuple]
+            ``(addr, pin, pulses, on_ms, off_ms)`` of the step's pumps (see
+            ``PulseEngine.submit``).
+        after : StepHandle, optional
+            Previous step.  The pumps of this step start once it is done, and
+            this step is not done before it.
+        handle : StepHandle, optional
+            Handle to run the step with, e.g., handed out when the step was
+            queued.
+
+        Returns
+        -------
+        StepHandle
+        '''
+        if handle is None:
+            handle = StepHandle(step, self.clock)
+        else:
+            handle.start = self.clock.ticks_ms()
+        # Hold completion until every actuator is registered.
+        handle._pending += 1
+        valves = [handle._add('valve', addr, pin)
+                  for addr, pin, path, settle_ms in step.valves]
+        pumps = [handle._add('pump', addr, pin)
+                 for addr, pin, pulses, on_ms, off_ms in channels]
+        if after is not None and not after.done:
+            handle._pending += 1
+            after.add_callback(lambda after: handle._release())
+        states = [self._claim(handle, addr << 8 | pin, path)
+                  for addr, pin, path, settle_ms in step.valves]
+        self._start_free(handle, states, valves, channels, pumps, after)
+        handle._release()
+        return handle
+
+    def _claim(self, handle, key, path):
+        state = self._valves.get(key)
+        if state is None or state[0] != path:
+            # Switch once the steps relying on the current position finish.
+            blockers = ([] if state is None else
+                        [other for other in state[1] if not other.done])
+            state = [path, [], blockers, None]
+            self._valves[key] = state
+        else:
+            state[1] = [other for other in state[1] if not other.done]
+        state[1].append(handle)
+        return state
+
+    def _blocker(self, states):
+        # Unfinished step relying on a position that a valve leaves.
+        for state in states:
+            for other in state[2]:
+                if not other.done:
+                    return other
+            state[2] = []
+        return None
+
+    def _start_free(self, handle, states, valves, channels, pumps, after):
+        # Start once no unfinished step relies on a position a valve of the
+        # step leaves, checking again as each blocking step finishes.
+        blocker = self._blocker(states)
+        if blocker is None:
+            self._start(handle, states, valves, channels, pumps, after)
+        else:
+            blocker.add_callback(lambda blocker:
+                                 self._start_free(handle, states, valves,
+                                                  channels, pumps, after))
+
+    def _start(self, handle, states, valves, channels, pumps, after):
+        # Settle time of each valve.
+        settle = []
+        now = self.clock.ticks_ms()
+        for (addr, pin, path, settle_ms), state in zip(handle.step.valves,
+                                                       states):
+            if state[3] is not None:
+                # Already in position: only the rest of its settle time.
+                settle_ms = max(0, settle_ms -
+                                self.clock.ticks_diff(now, state[3]))
+            settle.append(settle_ms)
+
+        for pin, value in handle.step.switches:
+            result = handle._add('switch', None, pin)
+            try:
+                self.switch(pin, value)
+                handle._finish(result)
+            except Exception as exception:
+                print('Error setting switch:', exception)
+                handle._finish(result, exception)
+
+        asyncio.get_event_loop().create_task(
+            self._run(handle, states, settle, valves, channels, pumps, after))
+
+    async def _run(self, handle, states, settle, valves, channels, pumps,
+                   after):
+        # Valve phase: one batch per board.
+        settle_ms = 0
+        error = None
+        for addr, entries in handle.step.boards:
+            writer = get_port_writer(self.i2c, addr)
+            for i, pin, path, settle_ms_i in entries:
+                valves[i].start = self.clock.ticks_ms()
+                writer.stage(pin, path)
+            try:
+                await writer.flush()
+            except Exception as exception:
+                print('Error setting valve:', exception)
+                error = exception
+                for i, pin, path, settle_ms_i in entries:
+                    # Position unknown: settle in full next time.
+                    states[i][3] = None
+                    handle._finish(valves[i], exception)
+            else:
+                for i, pin, path, settle_ms_i in entries:
+                    if states[i][3] is None:
+                        states[i][3] = valves[i].start
+                    settle_ms = max(settle_ms, settle[i])
+                    handle._finish(valves[i])
+
+        if error is not None:
+            # Do not pump through a valve in an unknown position.
+            for result in pumps:
+                handle._finish(result, error)
+            return
+        if settle_ms:
+            await asyncio.sleep_ms(settle_ms)
+
+        # Pump phase.
+        if after is None or after.done:
+            self._pump(handle, channels, pumps)
+        else:
+            after.add_callback(lambda after: self._pump(handle, channels,
+                                                        pumps))
+
+    def _pump(self, handle, channels, pumps):
+        if not channels:
+            return
+        start = self.clock.ticks_ms()
+        for result in pumps:
+            result.start = start
+        try:
+            job = self.engine.submit(channels)
+        except Exception as exception:
+            print('Error pumping:', exception)
+            for result in pumps:
+                handle._finish(result, exception)
+            return
+        handle.job = job
+        for result, channel in zip(pumps, job.channels):
+            result.channel = channel
+        if self.journal is not None:
+            self.journal.job(handle.step.index, job)
+        job.add_callback(lambda job: self._pumped(handle, pumps))
+
+    def _pumped(self, handle, pumps):
+        for result in pumps:
+            handle._finish(result, end=result.channel.end)
+
+    def chain(self, steps, on_done=None):
+        '''
+        Run steps back to back.
+
+        Each step is applied with the previous step as ``after`` while the
+        previous step is still pumping (see :meth:`apply`), so its valves
+        switch and settle in the meantime, and its pumps start from the
+        completion callback of the previous step.
+
+        Parameters
+        ----------
+        steps : list[tuple]
+            ``(step, channels)`` of every step (see :meth:`apply`).
+        on_done : callable, optional
+            Called with the list of handles once the last step is done.
+
+        Returns
+        -------
+        list[StepHandle]
+            Handles of the steps started so far; grows as steps start.
+        '''
+        handles = []
+
+        def apply_next():
+            i = len(handles)
+            step, channels = steps[i]
+            after = handles[-1] if handles else None
+            handles.append(None)
+            handles[i] = self.apply(step, channels, after)
+            handles[i].add_callback(done)
+
+        def done(handle):
+            # At most two steps in flight: the one pumping, and the next.
+            if len(handles) < len(steps):
+                apply_next()
+            elif on_done is not None and all(handle.done
+                                             for handle in handles):
+                on_done(handles)
+
+        if not steps and on_done is not None:
+            on_done(handles)
+        while len(handles) < min(2, len(steps)):
+            apply_next()
+        return handles
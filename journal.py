@@ -0,0 +1,311 @@
+'''
+Append-only journal of sequence progress and pulse trains, used to resume
+them after a reset.
+'''
+import struct
+import uasyncio as asyncio
+
+import util
+
+
+# Every record is `RECORD_FORMAT`: type, id, then three arguments.  Types
+# carry `RECORD_MAGIC` in the high bits, so a torn or erased tail is
+# detected on load.
+RECORD_FORMAT = '<BBHII'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+RECORD_MAGIC = 0xa0
+# `id`: sequence; `a`: state; `b`: run time (ms); `c`: events fired.
+SEQUENCE = RECORD_MAGIC | 1
+# `id`: job; `a`: step index.
+STEP = RECORD_MAGIC | 2
+# `id`: job; `a`: `addr << 8 | pin`; `b`: pulses;
+# `c`: `on_ms << 16 | off_ms`.
+CHANNEL = RECORD_MAGIC | 3
+# `id`: job; `a`: channel; `b`: pulses delivered.
+PULSES = RECORD_MAGIC | 4
+# `id`: job.
+JOB_DONE = RECORD_MAGIC | 5
+
+# Sequence states.
+STOPPED = 0
+RUNNING = 1
+PAUSED = 2
+
+
+class Recovered:
+    '''
+    State of an interrupted run, as read by :meth:`Journal.load`.
+
+    Attributes
+    ----------
+    sequences : dict
+        Mapping from sequence id to ``(state, elapsed_ms, fired)`` for every
+        sequence that was running or paused.
+    jobs : dict
+        Mapping from job id to ``(step_index, channels)`` for every
+        unfinished job, where ``channels`` is a list of
+        ``[addr, pin, pulses, on_ms, off_ms, count]``.
+    '''
+    def __init__(self):
+        self.sequences = {}
+        self.jobs = {}
+
+
+class Journal:
+    '''
+    Compact binary journal of step starts, pulses delivered per channel, and
+    sequence progress.
+
+    Step starts and job completions are rare, so they are written as soon
+    as they happen: a step that completed is never resumed.  Pulse counts
+    and sequence run times are sampled every ``flush_ms`` by :meth:`run` and
+    only written if they changed, so the pulse engine is not held up by
+    flash writes and the flash sees one small append per interval.  Records
+    are collected in a preallocated buffer.  Once the file exceeds
+    ``max_size``, it is rewritten with just the current state.
+
+    Pulses delivered after the last flush are not recorded, so at most
+    ``flush_ms`` worth of pulses of an unfinished step is repeated on resume.
+
+    Parameters
+    ----------
+    path : str
+        Journal file.
+    flush_ms : int, optional
+        Interval between writes of pulse counts and sequence progress.
+    max_size : int, optional
+        File size (in bytes) that triggers a rewrite.
+    buffer_records : int, optional
+        Capacity of the write buffer.  When full, the buffer is written
+        before the next interval.
+
+    Attributes
+    ----------
+    writes : int
+        Number of file writes (appends and rewrites).
+    '''
+    def __init__(self, path, flush_ms=30000, max_size=4096,
+                 buffer_records=32):
+        self.path = path
+        self.flush_ms = flush_ms
+        self.max_size = max_size
+        self.writes = 0
+        self._buffer = bytearray(buffer_records * RECORD_SIZE)
+        self._length = 0
+        self._size = util.file_size(path)
+        # File being rewritten, if any.
+        self._output = None
+        # Sequence id -> [runner, state, elapsed_ms, fired].
+        self._sequences = {}
+        # Job id -> [job, step_index, counts].
+        self._jobs = {}
+        self._next_job = 0
+
+    def _record(self, type_, id_, a=0, b=0, c=0):
+        if self._length + RECORD_SIZE > len(self._buffer):
+            # Append, even past `max_size`: a rewrite here would record
+            # again the job being recorded.
+            self._write()
+        struct.pack_into(RECORD_FORMAT, self._buffer, self._length, type_,
+                         id_, a, b, c)
+        self._length += RECORD_SIZE
+
+    def _write(self):
+        # Write buffered records to the file being rewritten, or append them.
+        data = memoryview(self._buffer)[:self._length]
+        if self._output is None:
+            util.append_file(self.path, data)
+            self.writes += 1
+        else:
+            self._output.write(data)
+        self._size += self._length
+        self._length = 0
+
+    def load(self):
+        '''
+        Read the journal of the previous run.
+
+        Returns
+        -------
+        Recovered
+        '''
+        recovered = Recovered()
+        sequences = recovered.sequences
+        jobs = recovered.jobs
+        path = self.path
+        if not util.exists(path) and util.exists(path + '.tmp'):
+            # Reset during a rewrite, after removing the journal.
+            path += '.tmp'
+        if not util.exists(path):
+            return recovered
+        record = bytearray(RECORD_SIZE)
+        with open(path, 'rb') as input_:
+            while input_.readinto(record) == RECORD_SIZE:
+                type_, id_, a, b, c = struct.unpack(RECORD_FORMAT, record)
+                if type_ & 0xf0 != RECORD_MAGIC:
+                    break
+                if type_ == SEQUENCE:
+                    if a == STOPPED:
+                        sequences.pop(id_, None)
+                    else:
+                        sequences[id_] = (a, b, c)
+                elif type_ == STEP:
+                    jobs[id_] = (a, [])
+                elif type_ == CHANNEL and id_ in jobs:
+                    jobs[id_][1].append([a >> 8, a & 0xff, b, c >> 16,
+                                         c & 0xffff, 0])
+                elif type_ == PULSES and id_ in jobs and \
+                        a < len(jobs[id_][1]):
+                    jobs[id_][1][a][5] = b
+                elif type_ == JOB_DONE:
+                    jobs.pop(id_, None)
+        for id_ in list(jobs):
+            if all(channel[5] >= channel[2] for channel in jobs[id_][1]):
+                del jobs[id_]
+        return recovered
+
+    def track(self, id_, runner):
+        '''
+        Journal the state and progress of a sequence.
+
+        Parameters
+        ----------
+        id_ : int
+            Sequence id (0-255), e.g., position in ``config.sequences``.
+        runner : sequence.SequenceRunner
+        '''
+        self._sequences[id_] = [runner, STOPPED, 0, 0]
+
+    def job(self, step_index, job):
+        '''
+        Journal the start of a step and the pulses of its job, and write
+        them, then write the completion of the job once it is done.
+
+        Parameters
+        ----------
+        step_index : int
+            Position of the step in ``step_index.StepIndex``.
+        job : pulse.Job
+        '''
+        id_ = self._next_job
+        self._next_job = (id_ + 1) & 0xff
+        self._jobs[id_] = [job, step_index, [0] * len(job.channels)]
+        self._record_job(id_)
+        self.flush()
+        job.add_callback(lambda job: self._done(id_))
+
+    def _done(self, id_):
+        if self._jobs.pop(id_, None) is not None:
+            self._record(JOB_DONE, id_)
+            try:
+                self.flush()
+            except Exception as exception:
+                print('Error writing journal:', exception)
+
+    def _record_job(self, id_):
+        job, step_index, counts = self._jobs[id_]
+        self._record(STEP, id_, step_index)
+        for channel in job.channels:
+            self._record(CHANNEL, id_, channel.addr << 8 | channel.pin,
+                         channel.pulses,
+                         channel.on_ms << 16 | channel.off_ms)
+        for i, count in enumerate(counts):
+            if count:
+                self._record(PULSES, id_, i, count)
+
+    def _sample(self):
+        # Record pulse counts and sequence progress that changed.
+        for id_, entry in self._sequences.items():
+            runner = entry[0]
+            state = (STOPPED if not runner.running else
+                     PAUSED if runner.paused else RUNNING)
+            elapsed_ms = runner.elapsed_ms()
+            if state != entry[1] or \
+                    (state and (elapsed_ms, runner.fired) != tuple(entry[2:])):
+                entry[1:] = [state, elapsed_ms, runner.fired]
+                self._record(SEQUENCE, id_, state, elapsed_ms, runner.fired)
+        for id_ in list(self._jobs):
+            job, step_index, counts = self._jobs[id_]
+            for i, channel in enumerate(job.channels):
+                if channel.count != counts[i]:
+                    counts[i] = channel.count
+                    self._record(PULSES, id_, i, channel.count)
+
+    def flush(self):
+        '''
+        Write buffered records, first rewriting the journal if it is full.
+        '''
+        length = self._length
+        if not length:
+            return
+        if self._size + length > self.max_size:
+            self._rewrite()
+            return
+        self._write()
+
+    def _rewrite(self):
+        # Current state only; supersedes the buffered records.
+        self._length = 0
+        self._size = 0
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as output:
+            self._output = output
+            try:
+                for id_, (runner, state, elapsed_ms, fired) in \
+                        self._sequences.items():
+                    if state:
+                        self._record(SEQUENCE, id_, state, elapsed_ms, fired)
+                for id_ in self._jobs:
+                    self._record_job(id_)
+                self._write()
+            finally:
+                self._output = None
+        util.replace_file(tmp_path, self.path)
+        self.writes += 1
+
+    def resume(self, recovered, submit):
+        '''
+        Resume the sequences and pulse trains of an interrupted run.
+
+        The journal is then rewritten with just the resumed state.
+
+        Parameters
+        ----------
+        recovered : Recovered
+            See :meth:`load`.
+        submit : callable
+            Called as ``submit(step_index, channels)`` to restart the
+            remaining pulses of a job, where ``channels`` is a list of
+            ``(addr, pin, pulses, on_ms, off_ms)``.  Expected to journal the
+            new job with :meth:`job`.
+        '''
+        for step_index, channels in recovered.jobs.values():
+            remaining = [(addr, pin, pulses - count, on_ms, off_ms)
+                         for addr, pin, pulses, on_ms, off_ms, count
+                         in channels if count < pulses]
+            try:
+                submit(step_index, remaining)
+            except Exception as exception:
+                print('Error resuming step %d:' % step_index, exception)
+        for id_, (state, elapsed_ms, fired) in \
+                recovered.sequences.items():
+            if id_ not in self._sequences:
+                continue
+            runner = self._sequences[id_][0]
+            runner.start(elapsed_ms, fired)
+            if state == PAUSED:
+                runner.pause()
+        self._sample()
+        self._rewrite()
+
+    async def run(self):
+        '''
+        Flush the journal every ``flush_ms``.
+        '''
+        while True:
+            await asyncio.sleep_ms(self.flush_ms)
+            try:
+                self._sample()
+                self.flush()
+            except Exception as exception:
+                print('Error writing journal:', exception)
@@ -0,0 +1,528 @@
+import array
+import gc
+import micropython
+import time
+import uasyncio as asyncio
+import utimeq
+
+from drivers import get_port_writer
+
+
+class Channel:
+    '''
+    Pulse train on one output.
+
+    Attributes
+    ----------
+    count : int
+        Number of pulses completed.
+    done : bool
+        ``True`` once the pulse train has completed or was cancelled.
+    errors : int
+        Number of edges whose write failed.
+    end : int
+        Time the pulse train completed or was cancelled, in ``ticks_ms``, or
+        ``None``.
+    job : Job
+    '''
+    def __init__(self, writer, addr, pin, pulses, on_ms, off_ms):
+        self.writer = writer
+        self.addr = addr
+        self.pin = pin
+        self.pulses = pulses
+        self.on_ms = on_ms
+        self.off_ms = off_ms
+        self.count = 0
+        self.done = not pulses
+        self.errors = 0
+        self.cancelled = False
+        self.end = None
+        self.job = None
+        # Deadline (in `ticks_ms`) and state of the next edge.
+        self.deadline = 0
+        self.state = 1
+
+
+class Job:
+    '''
+    Pulse trains submitted together with :meth:`PulseEngine.submit`.
+
+    Attributes
+    ----------
+    channels : list[Channel]
+    start : int
+        Time of the first edge, in ``ticks_ms``.
+    '''
+    def __init__(self, channels, start):
+        self.channels = channels
+        self.start = start
+        self.callbacks = []
+        for channel in channels:
+            channel.job = self
+
+    @property
+    def done(self):
+        return all(channel.done for channel in self.channels)
+
+    def add_callback(self, callback):
+        '''
+        Call ``callback(job)`` from the engine once every channel is done, or
+        right away if the job is already done.
+        '''
+        if self.done:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def _complete(self):
+        callbacks = self.callbacks
+        self.callbacks = []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as exception:
+                print('Error in job callback:', exception)
+
+    def counts(self):
+        '''
+        Returns
+        -------
+        list[int]
+            Number of pulses completed on each channel.
+        '''
+        return [channel.count for channel in self.channels]
+
+    def cancel(self):
+        '''
+        Stop all channels at their next edge, leaving the outputs off.
+        '''
+        for channel in self.channels:
+            channel.cancelled = True
+
+    async def wait(self, poll_ms=20):
+        '''
+        Wait until every channel is done.
+        '''
+        while not self.done:
+            await asyncio.sleep_ms(poll_ms)
+
+
+class PulseEngine:
+    '''
+    Drive the pulse trains of many outputs from a single task.
+
+    The next edge of every active channel is kept in one queue ordered by
+    deadline.  When edges fall due, they are written together, merged into
+    one port write per board, so the number of tasks does not grow with the
+    number of pumps.
+
+    Edges are scheduled from the start time of the job, so write latency
+    does not accumulate.  An edge that is late is still written, after the
+    previous edge of the same channel, so pulses are shortened rather than
+    dropped.
+
+    Parameters
+    ----------
+    i2c : machine.I2C
+        I2C driver handle.
+    max_channels : int, optional
+        Maximum number of concurrently active channels.
+    poll_ms : int, optional
+        Longest sleep of the engine task, i.e., the maximum delay before a
+        new job starts while other jobs are running.
+    clock : module, optional
+        Source of ``ticks_ms``/``ticks_add``/``ticks_diff``.  Must match the
+        clock of the event loop.
+
+    Attributes
+    ----------
+    edges : int
+        Number of edges written.
+    max_lag_ms : int
+        Largest delay of an edge past its deadline.
+    '''
+    def __init__(self, i2c, max_channels=16, poll_ms=10, clock=time):
+        self.i2c = i2c
+        self.clock = clock
+        self.max_channels = max_channels
+        self.poll_ms = poll_ms
+        self.edges = 0
+        self.max_lag_ms = 0
+        self._queue = utimeq.utimeq(max_channels)
+        self._active = 0
+        self._running = False
+        # Preallocated buffers for the edges of one pass.
+        self._entry = [0, 0, 0]
+        self._due = [None] * max_channels
+        self._writers = []
+
+    def submit(self, channels):
+        '''
+        Start pulse trains on several outputs at once.
+
+        Parameters
+        ----------
+        channels : list[tuple]
+            ``(addr, pin, pulses, on_ms, off_ms)`` for every output.
+
+        Returns
+        -------
+        Job
+
+        Raises
+        ------
+        ValueError
+            If the engine would exceed ``max_channels`` active channels.
+        '''
+        channels = [Channel(get_port_writer(self.i2c, addr), addr, pin,
+                            pulses, on_ms, off_ms)
+                    for addr, pin, pulses, on_ms, off_ms in channels]
+        active = [channel for channel in channels if not channel.done]
+        if self._active + len(active) > self.max_channels:
+            raise ValueError('Too many pulse channels (max %d).' %
+                             self.max_channels)
+        now = self.clock.ticks_ms()
+        for channel in active:
+            channel.deadline = now
+            if channel.writer not in self._writers:
+                self._writers.append(channel.writer)
+            self._queue.push(now, channel, 0)
+        self._active += len(active)
+        if active and not self._running:
+            self._running = True
+            asyncio.get_event_loop().create_task(self._run())
+        return Job(channels, now)
+
+    async def _run(self):
+        queue = self._queue
+        entry = self._entry
+        due = self._due
+        clock = self.clock
+        try:
+            while self._active:
+                now = clock.ticks_ms()
+                delay = clock.ticks_diff(queue.peektime(), now)
+                if delay > 0:
+                    await asyncio.sleep_ms(min(delay, self.poll_ms))
+                    continue
+
+                # Every active channel has exactly one entry in the queue, so
+                # each channel is written at most once per pass.
+                n = 0
+                while queue and clock.ticks_diff(queue.peektime(), now) <= 0:
+                    queue.pop(entry)
+                    channel = entry[1]
+                    due[n] = channel
+                    n += 1
+                    self.max_lag_ms = max(self.max_lag_ms,
+                                          clock.ticks_diff(now, entry[0]))
+                    if channel.cancelled:
+                        channel.state = 0
+                    channel.writer.stage(channel.pin, channel.state)
+
+                for writer in self._writers:
+                    if not writer.staged:
+                        continue
+                    try:
+                        await writer.flush()
+                    except Exception as exception:
+                        print('Error writing pulse edge:', exception)
+                        for i in range(n):
+                            if due[i].writer is writer:
+                                due[i].errors += 1
+
+                for i in range(n):
+                    channel = due[i]
+                    due[i] = None
+                    self.edges += 1
+                    self._advance(channel)
+        finally:
+            self._running = False
+
+    def _advance(self, channel):
+        if channel.state:
+            channel.state = 0
+            channel.deadline = self.clock.ticks_add(channel.deadline,
+                                                    channel.on_ms)
+        else:
+            if not channel.cancelled:
+                channel.count += 1
+            channel.state = 1
+            channel.deadline = self.clock.ticks_add(channel.deadline,
+                                                    channel.off_ms)
+            if channel.cancelled or channel.count >= channel.pulses:
+                channel.done = True
+                channel.end = self.clock.ticks_ms()
+                self._active -= 1
+                if channel.job.done:
+                    channel.job._complete()
+                return
+        self._queue.push(channel.deadline, channel, 0)
+
+
+class _Schedule:
+    '''
+    Edges of a :class:`TimerPulseEngine` job, generated one time at a time.
+
+    Each channel is periodic, so only the time and state of its next edge
+    are kept.  :attr:`time` is the earliest of these, in milliseconds after
+    the start of the job, or ``None`` once every edge is written.
+    '''
+    def __init__(self, job, channels):
+        self.job = job
+        self.channels = channels
+        count = len(channels)
+        # Next edge of each channel: time, and `1` if rising.
+        self.offsets = array.array('i', [0] * count)
+        self.rising = bytearray([1] * count)
+        # Edges left on each channel.
+        self.remaining = array.array('i', [2 * channel.pulses
+                                           for channel in channels])
+        self.time = 0 if count else None
+
+    def fire(self, engine):
+        '''
+        Write the edges due at :attr:`time`, merged per board and port, with
+        ``engine._write()``, then advance to the next time.  Allocates
+        nothing, so it may run from ``micropython.schedule``.
+        '''
+        channels = self.channels
+        offsets = self.offsets
+        rising = self.rising
+        remaining = self.remaining
+        count = len(channels)
+        time_ = self.time
+        for i in range(count):
+            if not remaining[i] or offsets[i] != time_:
+                continue
+            writer = channels[i].writer
+            port = channels[i].pin // 8
+            mask = 0
+            value = 0
+            # Merge with the other edges due on the same port, and advance.
+            for j in range(i, count):
+                channel = channels[j]
+                if not remaining[j] or offsets[j] != time_ or \
+                        channel.writer is not writer or \
+                        channel.pin // 8 != port:
+                    continue
+                bit = 1 << (channel.pin % 8)
+                mask |= bit
+                if rising[j]:
+                    value |= bit
+                    offsets[j] = time_ + channel.on_ms
+                else:
+                    offsets[j] = time_ + channel.off_ms
+                rising[j] ^= 1
+                remaining[j] -= 1
+            engine._write(self, writer, port, mask, value)
+        next_ = None
+        for i in range(count):
+            if remaining[i] and (next_ is None or offsets[i] < next_):
+                next_ = offsets[i]
+        self.time = next_
+
+
+class TimerPulseEngine:
+    '''
+    Fire pulse edges from a hardware timer instead of an event loop task.
+
+    The edges of a job are generated as they fall due, merged per board, port
+    and time.  A periodic timer checks the schedule every ``tick_ms`` and, once
+    an edge is due, uses ``micropython.schedule`` to write it.  Edges are thus
+    written on time even while the event loop is held up, e.g., by a display
+    refresh or a task calling ``time.sleep_ms``.
+
+    An edge that falls due while a task holds the bus lock (i.e., while it
+    waits for a response) is retried on the next tick.
+
+    Provides the same :meth:`submit` interface as :class:`PulseEngine`.
+
+    Parameters
+    ----------
+    i2c : machine.I2C
+        I2C driver handle.
+    timer : machine.Timer
+        Timer used to check for due edges, e.g., ``machine.Timer(0)``.  Any
+        object with the ``init()``/``deinit()`` methods of ``machine.Timer``
+        will do, e.g., ``sim.clock.Timer``.
+    max_channels : int, optional
+        Maximum number of concurrently active channels.
+    tick_ms : int, optional
+        Timer period.
+    clock : module, optional
+        Source of ``ticks_ms``/``ticks_add``/``ticks_diff``.
+
+    Attributes
+    ----------
+    edges : int
+        Number of edges written.
+    deferred : int
+        Number of times an edge was postponed because the bus was busy.
+    max_lag_ms : int
+        Largest delay of an edge past its deadline.
+    '''
+    def __init__(self, i2c, timer, max_channels=16, tick_ms=1, clock=time):
+        self.i2c = i2c
+        self.timer = timer
+        self.max_channels = max_channels
+        self.tick_ms = tick_ms
+        self.clock = clock
+        self.edges = 0
+        self.deferred = 0
+        self.max_lag_ms = 0
+        self._lock = getattr(i2c, 'lock', None)
+        self._schedules = []
+        self._active = 0
+        self._running = False
+        self._pending = False
+        # Jobs completed during the current pass, notified at its end.
+        self._completed = []
+        # Deadline of the earliest edge, in `ticks_ms`.
+        self._next = 0
+        # Creating a bound method allocates, which is not allowed in an
+        # interrupt handler.
+        self._tick_ref = self._tick
+        self._fire_ref = self._fire
+
+    def submit(self, channels):
+        '''
+        Start pulse trains on several outputs at once.
+
+        Parameters
+        ----------
+        channels : list[tuple]
+            ``(addr, pin, pulses, on_ms, off_ms)`` for every output.
+
+        Returns
+        -------
+        Job
+
+        Raises
+        ------
+        ValueError
+            If the engine would exceed ``max_channels`` active channels, or
+            if a pulse or pause duration is not positive.
+        '''
+        channels = [Channel(get_port_writer(self.i2c, addr), addr, pin,
+                            pulses, on_ms, off_ms)
+                    for addr, pin, pulses, on_ms, off_ms in channels]
+        active = [channel for channel in channels if not channel.done]
+        if self._active + len(active) > self.max_channels:
+            raise ValueError('Too many pulse channels (max %d).' %
+                             self.max_channels)
+        for channel in active:
+            if channel.on_ms <= 0 or channel.off_ms <= 0:
+                raise ValueError('Pulse durations must be positive.')
+        job = Job(channels, 0)
+        schedule = _Schedule(job, active)
+        gc.collect()
+
+        job.start = self.clock.ticks_ms()
+        if not active:
+            return job
+        self._active += len(active)
+        if not self._schedules or \
+                self.clock.ticks_diff(job.start, self._next) < 0:
+            self._next = job.start
+        self._schedules.append(schedule)
+        if not self._running:
+            self._running = True
+            self.timer.init(mode=self.timer.PERIODIC, period=self.tick_ms,
+                            callback=self._tick_ref)
+        return job
+
+    def _tick(self, timer):
+        # May run in interrupt context: no allocation.
+        if not self._pending and \
+                self.clock.ticks_diff(self.clock.ticks_ms(), self._next) >= 0:
+            self._pending = True
+            try:
+                micropython.schedule(self._fire_ref, 0)
+            except RuntimeError:
+                # Schedule queue full; retry on the next tick.
+                self._pending = False
+
+    def _fire(self, arg):
+        self._pending = False
+        clock = self.clock
+        now = clock.ticks_ms()
+        busy = self._lock is not None and self._lock.locked()
+        next_ = None
+        i = len(self._schedules)
+        while i:
+            i -= 1
+            schedule = self._schedules[i]
+            job = schedule.job
+            if any(channel.cancelled for channel in schedule.channels):
+                if busy:
+                    self.deferred += 1
+                else:
+                    self._stop(schedule)
+                    continue
+            while schedule.time is not None:
+                deadline = clock.ticks_add(job.start, schedule.time)
+                lag = clock.ticks_diff(now, deadline)
+                if lag < 0:
+                    break
+                elif busy:
+                    self.deferred += 1
+                    deadline = clock.ticks_add(now, self.tick_ms)
+                    break
+                schedule.fire(self)
+                self.max_lag_ms = max(self.max_lag_ms, lag)
+            if schedule.time is None:
+                # Channels whose last edge failed are still running.
+                self._stop(schedule)
+            elif next_ is None or clock.ticks_diff(deadline, next_) < 0:
+                next_ = deadline
+        if next_ is None:
+            self.timer.deinit()
+            self._running = False
+        else:
+            self._next = next_
+        # Callbacks may submit new jobs.
+        while self._completed:
+            self._completed.pop(0)._complete()
+
+    def _write(self, schedule, writer, port, mask, value):
+        try:
+            writer.driver.digital_write_port(port, mask, value)
+            error = False
+        except Exception as exception:
+            print('Error writing pulse edge:', exception)
+            error = True
+        self.edges += 1
+        for channel in schedule.channels:
+            bit = 1 << (channel.pin % 8)
+            if channel.writer is not writer or channel.pin // 8 != port or \
+                    not mask & bit:
+                continue
+            if error:
+                channel.errors += 1
+            if not value & bit:
+                # Falling edge, counted even if its write failed, as by
+                # `PulseEngine`.
+                channel.count += 1
+                if channel.count >= channel.pulses and not error:
+                    self._finish(channel)
+
+    def _finish(self, channel):
+        channel.done = True
+        channel.end = self.clock.ticks_ms()
+        self._active -= 1
+        if channel.job.done:
+            self._completed.append(channel.job)
+
+    def _stop(self, schedule):
+        # Switch off every output of the job that is still running, i.e.,
+        # cancelled or whose last edge failed.
+        for channel in schedule.channels:
+            if not channel.done:
+                try:
+                    channel.writer.driver.digital_write_port(
+                        channel.pin // 8, 1 << (channel.pin % 8), 0)
+                except Exception as exception:
+                    print('Error writing pulse edge:', exception)
+                self._finish(channel)
+        self._schedules.remove(schedule)
\ No newline at end of file
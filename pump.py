@@ -1,16 +1,13 @@
-import _thread
-import functools as ft
 import gc
 import time
 import uasyncio as asyncio
 gc.collect()
 
-from base_node import BaseDriver, replace
-import grove_i2c_motor as gm
-import lvgl as lv
+from drivers import get_port_writer
 
 
-async def pump(i2c, i2c_address, pin, pulses, on_ms=50, off_ms=150):
+async def pump(i2c, i2c_address, pin, pulses, on_ms=50, off_ms=150,
+               engine=None):
     '''
     Parameters
     ----------
@@ -26,14 +23,34 @@ async def pump(i2c, i2c_address, pin, pulses, on_ms=50, off_ms=150):
         Duration for which output should be turned **on**, in milliseconds.
     off_ms : int, optional
         Duration for which output should be turned **off**, in milliseconds.
+    engine : pulse.PulseEngine or pulse.TimerPulseEngine, optional
+        If given, run the pulse train on ``engine`` rather than from this
+        task, e.g., to fire the edges from a hardware timer.
     '''
-    driver = gm.BaseDriver(i2c, i2c_address)
+    if engine is not None:
+        try:
+            job = engine.submit([(i2c_address, pin, pulses, on_ms, off_ms)])
+            await job.wait()
+        except Exception as exception:
+            print('Error pumping:', exception)
+        return
+
+    # Edges of concurrent pumps on the same board are merged into one write.
+    writer = get_port_writer(i2c, i2c_address)
     await asyncio.sleep_ms(0)
+    # Edges are scheduled from the start time rather than from the previous
+    # write, so bus latency does not accumulate and pumps started together
+    # keep sharing edge deadlines.
+    deadline = time.ticks_ms()
     try:
         for i in range(pulses):
-            driver.digital_write(pin, 1)
-            await asyncio.sleep_ms(on_ms)
-            driver.digital_write(pin, 0)
-            await asyncio.sleep_ms(off_ms)
+            await writer.write(pin, 1)
+            deadline = time.ticks_add(deadline, on_ms)
+            await asyncio.sleep_ms(max(0, time.ticks_diff(deadline,
+                                                          time.ticks_ms())))
+            await writer.write(pin, 0)
+            deadline = time.ticks_add(deadline, off_ms)
+            await asyncio.sleep_ms(max(0, time.ticks_diff(deadline,
+                                                          time.ticks_ms())))
     except Exception as exception:
         print('Error pumping:', exception)
\ No newline at end of file
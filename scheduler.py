@@ -0,0 +1,182 @@
+'''
+Share pumps and valves between concurrently requested steps.
+'''
+from executor import StepHandle
+
+
+# What to do with a request that conflicts with a running or queued step.
+QUEUE = 'queue'  # Run once the conflicting steps are done.
+MERGE = 'merge'  # Same step already pending: share its handle; else queue.
+REJECT = 'reject'  # Raise `ConflictError`.
+
+
+class ConflictError(RuntimeError):
+    '''
+    Step rejected because it needs outputs claimed by another step.
+    '''
+    pass
+
+
+class _Claim:
+    # Outputs claimed by one request.
+    def __init__(self, handle, step, channels):
+        self.handle = handle
+        self.step = step
+        self.channels = channels
+        # Pumps are exclusive; valves may be shared in the same position.
+        self.pumps = set(addr << 8 | pin
+                         for addr, pin, pulses, on_ms, off_ms in channels)
+        self.valves = dict((addr << 8 | pin, path)
+                           for addr, pin, path, settle_ms in step.valves)
+
+    def conflicts(self, other):
+        for key in self.pumps:
+            if key in other.pumps:
+                return True
+        for key, path in self.valves.items():
+            if other.valves.get(key, path) != path:
+                return True
+        return False
+
+
+class ResourceScheduler:
+    '''
+    Run requested steps through a ``executor.StepExecutor``, never driving
+    a pump from two steps at once.
+
+    A step claims the pumps of its pulse trains and the positions of its
+    valves (see ``step_index.Step``).  Steps whose claims do not conflict run
+    in parallel.  A conflicting request is queued, merged or rejected,
+    depending on the policy.  Queued steps start in order, as soon as the
+    steps they conflict with are done; a queued step also holds back later
+    requests that conflict with it, so it cannot be starved.
+
+    Requests are also queued while the pulse engine has no free channels.
+
+    Parameters
+    ----------
+    executor : executor.StepExecutor
+    policy : str, optional
+        Default policy for conflicting requests: :data:`QUEUE`,
+        :data:`MERGE` or :data:`REJECT`.
+    max_channels : int, optional
+        Maximum number of pulse trains running at once.  Defaults to
+        ``executor.engine.max_channels``.
+
+    Attributes
+    ----------
+    started, queued, merged, rejected : int
+        Number of requests that started right away, were queued, were merged
+        into a pending request of the same step, or were rejected.
+    '''
+    def __init__(self, executor, policy=MERGE, max_channels=None):
+        self.executor = executor
+        self.policy = policy
+        if max_channels is None:
+            max_channels = getattr(executor.engine, 'max_channels', None)
+        self.max_channels = max_channels
+        self.started = 0
+        self.queued = 0
+        self.merged = 0
+        self.rejected = 0
+        self._running = []
+        self._queue = []
+        self._dispatching = False
+
+    @property
+    def pending(self):
+        '''Handles of the running and queued steps.'''
+        return [claim.handle for claim in self._running + self._queue]
+
+    def request(self, step, channels, policy=None):
+        '''
+        Run a step once its outputs are free.
+
+        Parameters
+        ----------
+        step : step_index.Step
+        channels : list[tuple]
+            ``(addr, pin, pulses, on_ms, off_ms)`` of the step's pumps.
+        policy : str, optional
+            Overrides the default policy for this request.
+
+        Returns
+        -------
+        executor.StepHandle
+            Handle of the step; not started yet if the request was queued.
+
+        Raises
+        ------
+        ConflictError
+            If the policy is :data:`REJECT` and the step conflicts with a
+            running or queued step.
+        '''
+        policy = self.policy if policy is None else policy
+        if policy == MERGE:
+            for claim in self._running + self._queue:
+                if claim.step is step and not claim.handle.done:
+                    self.merged += 1
+                    return claim.handle
+        claim = _Claim(None, step, channels)
+        blocker = self._blocker(claim, self._running + self._queue)
+        if blocker is None and self._fits(claim):
+            self.started += 1
+            return self._start(claim)
+        if policy == REJECT:
+            self.rejected += 1
+            if blocker is None:
+                raise ConflictError('Step `%s`: no free pulse channels.' %
+                                    step.label)
+            raise ConflictError('Step `%s` conflicts with step `%s`.' %
+                                (step.label, blocker.step.label))
+        claim.handle = StepHandle(step, self.executor.clock)
+        self._queue.append(claim)
+        self.queued += 1
+        return claim.handle
+
+    def _blocker(self, claim, claims):
+        for other in claims:
+            if claim.conflicts(other):
+                return other
+        return None
+
+    def _fits(self, claim):
+        if self.max_channels is None:
+            return True
+        active = sum(len(other.channels) for other in self._running)
+        return active + len(claim.channels) <= self.max_channels
+
+    def _start(self, claim):
+        self._running.append(claim)
+        claim.handle = self.executor.apply(claim.step, claim.channels,
+                                           handle=claim.handle)
+        claim.handle.add_callback(self._done)
+        return claim.handle
+
+    def _done(self, handle):
+        for i, claim in enumerate(self._running):
+            if claim.handle is handle:
+                del self._running[i]
+                break
+        self._dispatch()
+
+    def _dispatch(self):
+        # Start queued steps whose outputs are free, in order.  Steps may
+        # complete (and call back here) as soon as they start.
+        if self._dispatching:
+            return
+        self._dispatching = True
+        try:
+            i = 0
+            while i < len(self._queue):
+                claim = self._queue[i]
+                if self._blocker(claim, self._running + self._queue[:i]) \
+                        is None and self._fits(claim):
+                    del self._queue[i]
+                    self._start(claim)
+                    # Restart: completions may have freed earlier entries.
+                    i = 0
+                else:
+                    i += 1
+        finally:
+            self._dispatching = False
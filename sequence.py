@@ -0,0 +1,207 @@
+'''
+Run timed sequences of steps (see ``config.sequences``).
+'''
+import time
+import uasyncio as asyncio
+
+from run_clock import RunClock
+
+
+# Longest single sleep of a runner.  Sleeping in bounded chunks keeps every
+# `ticks_diff()` well within half the ticks period, and the run clock is read
+# (see `run_clock.TICKS_MAX_READ_MS`) at least this often.
+MAX_SLEEP_MS = 60 * 60 * 1000
+
+
+class Sequence:
+    '''
+    Timed sequence of steps, compiled from ``config.sequences``.
+
+    Parameters
+    ----------
+    config : dict
+        Sequence as specified in ``config.sequences``.
+    step_index : step_index.StepIndex
+        Compiled steps, used to resolve step labels.
+
+    Attributes
+    ----------
+    name : str
+    duration_ms : int
+        Total run time.
+    events : list[tuple]
+        ``(offset_ms, repeat_ms, step)`` for every event; ``repeat_ms`` is
+        ``0`` for events that run once.
+
+    Raises
+    ------
+    ValueError
+        If an event references an unknown step.
+    '''
+    def __init__(self, config, step_index):
+        self.name = config['name']
+        self.duration_ms = int(1000 * config['duration_s'])
+        self.events = []
+        for event in config['events']:
+            try:
+                step = step_index.find(event['step'])
+            except KeyError:
+                raise ValueError('Sequence `%s`: unknown step `%s`.' %
+                                 (self.name, event['step']))
+            self.events.append((int(1000 * event.get('offset_s', 0)),
+                                int(1000 * event.get('repeat_s', 0)), step))
+
+
+class SequenceRunner:
+    '''
+    Run a :class:`Sequence` on the event loop.
+
+    Event deadlines are offsets on a :class:`run_clock.RunClock`, so they are
+    unaffected by changes of the RTC and by ticks wraparound, and the runner
+    sleeps until the exact deadline of the next event; events are neither
+    missed nor repeated if the loop is late.  Occurrences that fall due
+    together run in the order of ``Sequence.events``.
+
+    A paused sequence keeps its position: after :meth:`resume`, pending
+    events run at their offsets shifted by the length of the pause.
+
+    Parameters
+    ----------
+    sequence : Sequence
+    apply : callable
+        Called with the ``step_index.Step`` of every event.
+    on_done : callable, optional
+        Called with the runner when the sequence completes (not when
+        stopped).
+    clock : module, optional
+        Source of ``ticks_ms``/``ticks_diff`` for the run clock.  Must match
+        the clock of the event loop.
+
+    Attributes
+    ----------
+    fired : int
+        Number of events run since the last start.
+    run_clock : run_clock.RunClock
+        Run time of the sequence, excluding pauses.
+    '''
+    def __init__(self, sequence, apply, on_done=None, clock=time):
+        self.sequence = sequence
+        self.apply = apply
+        self.on_done = on_done
+        self.clock = clock
+        self.fired = 0
+        self.run_clock = RunClock(clock)
+        self._offsets = []
+        self._task = None
+
+    @property
+    def running(self):
+        return self.run_clock.running
+
+    @property
+    def paused(self):
+        return self.run_clock.paused
+
+    def elapsed_ms(self):
+        '''
+        Returns
+        -------
+        int
+            Run time since the sequence was started, excluding pauses, or
+            ``0`` if not running.
+        '''
+        if not self.run_clock.running:
+            return 0
+        return self.run_clock.elapsed_ms()
+
+    def start(self, elapsed_ms=0, fired=0):
+        '''
+        Parameters
+        ----------
+        elapsed_ms : int, optional
+            Run time to continue from, e.g., when resuming after a reset.
+        fired : int, optional
+            Number of events that already ran; they are skipped.
+        '''
+        if self.run_clock.running:
+            return
+        events = self.sequence.events
+        self._offsets = [offset for offset, repeat_ms, step in events]
+        for _ in range(fired):
+            i = self._next_event(self._offsets)
+            if i is None:
+                break
+            repeat_ms = events[i][1]
+            self._offsets[i] = (self._offsets[i] + repeat_ms if repeat_ms
+                                else None)
+        self.fired = fired
+        self.run_clock.start(elapsed_ms)
+        self._spawn()
+
+    def stop(self):
+        if self.run_clock.running:
+            self.run_clock.stop()
+            self._cancel()
+
+    def pause(self):
+        if self.run_clock.running and not self.run_clock.paused:
+            self.run_clock.pause()
+            self._cancel()
+
+    def resume(self):
+        if self.run_clock.paused:
+            self.run_clock.resume()
+            self._spawn()
+
+    def _spawn(self):
+        self._task = self._run()
+        asyncio.get_event_loop().create_task(self._task)
+
+    def _cancel(self):
+        task = self._task
+        if task is not None:
+            self._task = None
+            asyncio.cancel(task)
+
+    def _next_event(self, offsets):
+        # Earliest pending occurrence; ties go to the first event.
+        next_ = None
+        for i, offset in enumerate(offsets):
+            if offset is not None and offset < self.sequence.duration_ms and \
+                    (next_ is None or offset < offsets[next_]):
+                next_ = i
+        return next_
+
+    async def _sleep_until(self, offset):
+        run_clock = self.run_clock
+        while True:
+            delay = offset - run_clock.elapsed_ms()
+            if delay <= 0:
+                return
+            await asyncio.sleep_ms(min(delay, MAX_SLEEP_MS))
+
+    async def _run(self):
+        events = self.sequence.events
+        offsets = self._offsets
+        try:
+            while True:
+                i = self._next_event(offsets)
+                if i is None:
+                    break
+                offset, repeat_ms, step = events[i]
+                await self._sleep_until(offsets[i])
+                offsets[i] = offsets[i] + repeat_ms if repeat_ms else None
+                self.fired += 1
+                try:
+                    self.apply(step)
+                except Exception as exception:
+                    print('Error in sequence `%s`:' % self.sequence.name,
+                          exception)
+            # Run until the end of the sequence.
+            await self._sleep_until(self.sequence.duration_ms)
+        except asyncio.CancelledError:
+            return
+        self._task = None
+        self.run_clock.stop()
+        if self.on_done is not None:
+            self.on_done(self)
\ No newline at end of file
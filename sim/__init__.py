@@ -0,0 +1,4 @@
+'''
+Host-side stand-ins for the M5Stack hardware, used to exercise the drivers
+and benchmark them on a workstation.
+'''
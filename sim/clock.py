@@ -0,0 +1,158 @@
+'''
+Simulated clock and timers.
+
+:class:`Clock` provides the MicroPython ``utime`` ticks API.  In the default
+virtual mode time only advances when something sleeps, so runs are fast and
+deterministic; timers armed with :class:`Timer` fire at their exact deadline
+even when the sleeping code is blocking, like a ``machine.Timer`` interrupt
+would on the device.
+'''
+try:
+    import utime as _time
+except ImportError:
+    import time as _time
+
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - \
+        TICKS_HALFPERIOD
+
+
+class Clock:
+    '''
+    Parameters
+    ----------
+    start_ms : int, optional
+        Initial time in milliseconds.  Start near ``TICKS_PERIOD`` to exercise
+        tick wraparound.
+    real_time : bool, optional
+        If ``True``, follow the wall clock and really sleep.
+    epoch : int, optional
+        Value of :meth:`time` at ``start_ms``, in seconds.
+    min_sleep_us : int, optional
+        Virtual time charged for shorter sleeps, including ``sleep_ms(0)``.
+        Models the cost of an event loop pass, so tasks polling with
+        ``sleep_ms(0)`` cannot stall virtual time.
+    '''
+    def __init__(self, start_ms=0, real_time=False, epoch=0,
+                 min_sleep_us=10):
+        self.real_time = real_time
+        self.min_sleep_us = min_sleep_us
+        self.epoch = epoch
+        self._start_us = start_ms * 1000
+        self._us = self._start_us
+        self._offset_us = self._start_us - self._wall_us()
+        # Armed timers as `[deadline_us, sequence, timer]`, earliest first.
+        self._timers = []
+        self._sequence = 0
+
+    def _wall_us(self):
+        if hasattr(_time, 'ticks_us') and not hasattr(_time, 'perf_counter'):
+            return _time.ticks_us()
+        return int(_time.perf_counter() * 1e6)
+
+    def now_us(self):
+        '''Unwrapped time in microseconds.'''
+        if self.real_time:
+            self._us = self._wall_us() + self._offset_us
+        return self._us
+
+    def ticks_us(self):
+        return self.now_us() & TICKS_MAX
+
+    def ticks_ms(self):
+        return (self.now_us() // 1000) & TICKS_MAX
+
+    def ticks_cpu(self):
+        return self.ticks_us()
+
+    ticks_add = staticmethod(ticks_add)
+    ticks_diff = staticmethod(ticks_diff)
+
+    def time(self):
+        return self.epoch + (self.now_us() - self._start_us) // 1000000
+
+    def sleep_us(self, us):
+        target = self.now_us() + max(self.min_sleep_us, int(us))
+        while self._timers and self._timers[0][0] <= target:
+            deadline, _, timer = self._timers.pop(0)
+            self._wait_until(deadline)
+            timer._fire(self, deadline)
+        self._wait_until(target)
+
+    def sleep_ms(self, ms):
+        self.sleep_us(ms * 1000)
+
+    def sleep(self, seconds):
+        self.sleep_us(seconds * 1e6)
+
+    def advance(self, ms):
+        '''Move time forward, firing any timers that fall due.'''
+        self.sleep_ms(ms)
+
+    def _wait_until(self, deadline_us):
+        if self.real_time:
+            delay_us = deadline_us - self.now_us()
+            if delay_us > 0:
+                _time.sleep(delay_us * 1e-6)
+        elif deadline_us > self._us:
+            self._us = deadline_us
+
+    def _arm(self, timer, deadline_us):
+        self._disarm(timer)
+        self._sequence += 1
+        entry = [deadline_us, self._sequence, timer]
+        i = 0
+        while i < len(self._timers) and self._timers[i][:2] < entry[:2]:
+            i += 1
+        self._timers.insert(i, entry)
+
+    def _disarm(self, timer):
+        self._timers = [entry for entry in self._timers
+                        if entry[2] is not timer]
+
+
+class Timer:
+    '''
+    ``machine.Timer`` stand-in driven by a :class:`Clock`.
+
+    Callbacks run inside :meth:`Clock.sleep_us`, i.e., they interrupt
+    whatever code is sleeping at the time.
+    '''
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, clock, id=-1):
+        self.clock = clock
+        self.id = id
+        self._callback = None
+        self._period_us = 0
+        self._mode = self.ONE_SHOT
+
+    def init(self, mode=PERIODIC, period=-1, callback=None, freq=None):
+        if freq is not None:
+            self._period_us = int(1e6 / freq)
+        else:
+            self._period_us = int(period * 1000)
+        self._mode = mode
+        self._callback = callback
+        self.clock._arm(self, self.clock.now_us() + self._period_us)
+
+    def deinit(self):
+        self.clock._disarm(self)
+        self._callback = None
+
+    def _fire(self, clock, deadline_us):
+        if self._mode == self.PERIODIC:
+            clock._arm(self, deadline_us + self._period_us)
+        if self._callback is not None:
+            self._callback(self)
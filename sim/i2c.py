@@ -0,0 +1,437 @@
+'''
+Simulated I2C bus and device models.
+
+:class:`I2C` implements the subset of the ``machine.I2C`` interface used by
+the drivers in ``_lib`` and counts every bus transaction, so driver changes
+can be compared without hardware attached.  :class:`EdgeI2C` also takes the
+time of a real transfer and records every transaction and output edge.
+
+Device models, attached with :meth:`I2C.attach`:
+
+- :class:`BaseNodeDevice`: Grove motor boards running ``base_node``;
+- :class:`FacesEncoderDevice`: M5Stack Faces encoder (``m5_lvgl``);
+- :class:`HoneywellSSCDevice`: Honeywell SSC pressure sensor
+  (``honeywell_ssc``);
+- :class:`SLF3SDevice`: Sensirion SLF3S liquid flow sensor (``sensiron``).
+'''
+import struct
+import time
+
+import base_node as bn
+
+
+ENODEV = 19
+
+
+class I2C:
+    def __init__(self):
+        self.devices = {}
+        #: Number of bus transactions (one per ``writeto``/``readfrom*``).
+        self.transactions = 0
+
+    def attach(self, addr, device):
+        self.devices[addr] = device
+        return device
+
+    def _device(self, addr):
+        try:
+            return self.devices[addr]
+        except KeyError:
+            raise OSError(ENODEV)
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def writeto(self, addr, buf, stop=True):
+        device = self._device(addr)
+        self.transactions += 1
+        device.write(bytes(buf))
+        return len(buf)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        device = self._device(addr)
+        self.transactions += 1
+        return bytes(device.read(nbytes))
+
+    def readfrom_into(self, addr, buf, stop=True):
+        device = self._device(addr)
+        self.transactions += 1
+        data = device.read(len(buf))
+        for i, byte in enumerate(data):
+            buf[i] = byte
+
+
+class EdgeI2C(I2C):
+    '''
+    Bus that records the time of every output edge of ``BaseNodeDevice``
+    models attached to it.
+
+    Transfers block for as long as they would take on the real bus.
+
+    Parameters
+    ----------
+    byte_us : int, optional
+        Time to clock one byte (8 bits plus ACK).  The default corresponds
+        to a 100 kHz bus.
+    clock : module, optional
+        Source of ``ticks_us``/``sleep_us``, e.g., a ``sim.clock.Clock``.
+    '''
+    def __init__(self, byte_us=90, clock=time):
+        super().__init__()
+        self.byte_us = byte_us
+        self.clock = clock
+        #: Mapping from address to ``{pin: [(ticks_us, value), ...]}``.
+        self.edges = {}
+        #: Every transaction, as ``(start_us, end_us, addr, nbytes, read)``.
+        self.timeline = []
+
+    def _transfer(self, addr, nbytes, read):
+        # Address byte plus data.
+        start = self.clock.ticks_us()
+        self.clock.sleep_us(self.byte_us * (1 + nbytes))
+        self.timeline.append((start, self.clock.ticks_us(), addr, nbytes,
+                              read))
+
+    def writeto(self, addr, buf, stop=True):
+        device = self._device(addr)
+        before = bytes(getattr(device, 'pin_state', b''))
+        self._transfer(addr, len(buf), False)
+        result = super().writeto(addr, buf, stop)
+        now = self.clock.ticks_us()
+        after = getattr(device, 'pin_state', b'')
+        for port, (old, new) in enumerate(zip(before, after)):
+            for i in range(8):
+                if (old ^ new) & (1 << i):
+                    self.edges.setdefault(addr, {}) \
+                        .setdefault(8 * port + i, []) \
+                        .append((now, new >> i & 1))
+        return result
+
+    def readfrom(self, addr, nbytes, stop=True):
+        self._device(addr)
+        self._transfer(addr, nbytes, True)
+        return super().readfrom(addr, nbytes, stop)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        self._device(addr)
+        self._transfer(addr, len(buf), True)
+        return super().readfrom_into(addr, buf, stop)
+
+    def busy_us(self, start_us=None, end_us=None):
+        '''
+        Time the bus was busy, optionally only counting transactions that
+        started between ``start_us`` and ``end_us`` (``ticks_us()`` values).
+        '''
+        busy = 0
+        for start, end, addr, nbytes, read in self.timeline:
+            if start_us is not None and \
+                    self.clock.ticks_diff(start, start_us) < 0:
+                continue
+            if end_us is not None and self.clock.ticks_diff(start, end_us) > 0:
+                continue
+            busy += self.clock.ticks_diff(end, start)
+        return busy
+
+
+class BaseNodeDevice:
+    '''
+    Model of a board running the ``base_node`` firmware.
+
+    Parameters
+    ----------
+    addr : int
+        I2C address stored in the persistent configuration.
+    block_io : bool, optional
+        If ``False``, emulate older firmware without the block persistent
+        memory commands.
+    port_io : bool, optional
+        If ``False``, emulate older firmware without the port digital I/O
+        commands.
+    memory_size : int, optional
+        Size of persistent memory (in bytes).
+    not_ready_reads : int, optional
+        Number of reads after each command that return the idle bus level
+        before the response is ready.
+    '''
+    def __init__(self, addr, block_io=True, port_io=True, memory_size=256,
+                 not_ready_reads=0):
+        self.block_io = block_io
+        self.port_io = port_io
+        self.not_ready_reads = not_ready_reads
+        self._busy = 0
+        self.memory = bytearray(memory_size)
+        config = struct.pack(bn.BaseDriver.CONFIG_STRUCT_STR, 0, 1, 0, addr,
+                             0, bytes(16), bytes(9), bytes(9))
+        self.memory[:len(config)] = config
+        self.pin_state = bytearray(9)
+        self.pin_mode = bytearray(9)
+        self.load_config()
+        #: Command codes received, in order.
+        self.commands = []
+        self._response = b''
+
+    def load_config(self):
+        config = bn.BaseDriver.Config(*struct.unpack_from(
+            bn.BaseDriver.CONFIG_STRUCT_STR, self.memory))
+        self.pin_mode[:] = config.pin_mode_bytes
+        self.pin_state[:] = config.pin_state_bytes
+
+    def write(self, data):
+        cmd, args = data[0], data[1:]
+        self.commands.append(cmd)
+        handler = self.HANDLERS.get(cmd)
+        if handler is None or (cmd in self.BLOCK_COMMANDS and
+                                not self.block_io) or \
+                (cmd in self.PORT_COMMANDS and not self.port_io):
+            self._respond(bn.RETURN_UNKNOWN_COMMAND)
+            return
+        try:
+            result = handler(self, args)
+        except (IndexError, ValueError, struct.error):
+            self._respond(bn.RETURN_BAD_PACKET_SIZE)
+        else:
+            self._respond(bn.RETURN_OK, b'' if result is None else result)
+
+    def read(self, n):
+        if self._busy:
+            self._busy -= 1
+            return b'\xff' * n
+        data, self._response = self._response[:n], self._response[n:]
+        # Reading past the prepared response returns the idle bus level.
+        return data + b'\xff' * (n - len(data))
+
+    def _respond(self, return_code, payload=b''):
+        self._busy = self.not_ready_reads
+        if return_code == bn.RETURN_OK:
+            self._response = (bytes((len(payload) + 1, return_code)) +
+                              payload + b'\x00')
+        else:
+            self._response = bytes((0, return_code))
+
+    def _persistent_read(self, args):
+        address = struct.unpack('<h', args)[0]
+        return self.memory[address:address + 1]
+
+    def _persistent_write(self, args):
+        address, value = struct.unpack('<hB', args)
+        self.memory[address] = value
+
+    def _persistent_read_block(self, args):
+        address, length = struct.unpack('<hB', args)
+        return bytes(self.memory[address:address + length])
+
+    def _persistent_write_block(self, args):
+        address, length = struct.unpack('<hB', args[:3])
+        data = args[3:]
+        if len(data) != length:
+            raise IndexError
+        self.memory[address:address + length] = data
+
+    def _pin_mode(self, args):
+        pin, mode = args
+        self._set_bit(self.pin_mode, pin, mode)
+
+    def _digital_read(self, args):
+        pin = args[0]
+        return bytes((self.pin_state[pin // 8] >> (pin % 8) & 1, ))
+
+    def _digital_write(self, args):
+        pin, value = args
+        self._set_bit(self.pin_state, pin, value)
+
+    def _digital_read_port(self, args):
+        port, = args
+        return bytes((self.pin_state[port], ))
+
+    def _digital_write_port(self, args):
+        port, mask, value = args
+        self.pin_state[port] = (self.pin_state[port] & ~mask) | (value & mask)
+
+    def _set_bit(self, port_bytes, pin, value):
+        if value:
+            port_bytes[pin // 8] |= 1 << (pin % 8)
+        else:
+            port_bytes[pin // 8] &= ~(1 << (pin % 8))
+
+    BLOCK_COMMANDS = (bn.CMD_PERSISTENT_READ_BLOCK,
+                      bn.CMD_PERSISTENT_WRITE_BLOCK)
+    PORT_COMMANDS = (bn.CMD_DIGITAL_WRITE_PORT, bn.CMD_DIGITAL_READ_PORT)
+    HANDLERS = {bn.CMD_GET_PROTOCOL_NAME: lambda self, args: b'base_node',
+                bn.CMD_GET_PROTOCOL_VERSION: lambda self, args: b'0.1.0',
+                bn.CMD_GET_DEVICE_NAME: lambda self, args: b'sim',
+                bn.CMD_PERSISTENT_READ: _persistent_read,
+                bn.CMD_PERSISTENT_WRITE: _persistent_write,
+                bn.CMD_PERSISTENT_READ_BLOCK: _persistent_read_block,
+                bn.CMD_PERSISTENT_WRITE_BLOCK: _persistent_write_block,
+                bn.CMD_LOAD_CONFIG: lambda self, args: self.load_config(),
+                bn.CMD_SET_PIN_MODE: _pin_mode,
+                bn.CMD_DIGITAL_READ: _digital_read,
+                bn.CMD_DIGITAL_WRITE: _digital_write,
+                bn.CMD_DIGITAL_WRITE_PORT: _digital_write_port,
+                bn.CMD_DIGITAL_READ_PORT: _digital_read_port}
+
+
+class FacesEncoderDevice:
+    '''
+    Model of the M5Stack Faces encoder (see
+    ``m5_lvgl.FacesEncoderInputEncoder``).
+
+    Reads return a 3 byte report: the signed number of detents turned since
+    the previous report, ``0`` while the button is pressed (else ``1``) and a
+    reserved byte.  Writes of ``(index, red, green, blue)`` set an LED.
+
+    Attributes
+    ----------
+    leds : list[tuple]
+        ``(red, green, blue)`` of each LED.
+    pressed : bool
+    reports : int
+        Number of reports read.
+    '''
+    def __init__(self, leds=12):
+        self.leds = [(0, 0, 0)] * leds
+        self.pressed = False
+        self.reports = 0
+        self._diff = 0
+
+    def turn(self, detents):
+        '''Turn by ``detents`` (negative: counter-clockwise).'''
+        self._diff += detents
+
+    def write(self, data):
+        index, red, green, blue = data
+        self.leds[index] = (red, green, blue)
+
+    def read(self, n):
+        self.reports += 1
+        # The report holds a signed byte; the rest is left for later reports.
+        diff = max(-128, min(127, self._diff))
+        self._diff -= diff
+        report = struct.pack('bBB', diff, 0 if self.pressed else 1, 0)
+        return report[:n] + b'\xff' * (n - len(report))
+
+
+class HoneywellSSCDevice:
+    '''
+    Model of a Honeywell SSC board mount pressure sensor (see
+    ``honeywell_ssc``).
+
+    Reads return a 2 byte frame: 2 status bits and a 14 bit pressure count,
+    10% to 90% of full scale from ``pressure_min`` to ``pressure_max``.
+
+    Attributes
+    ----------
+    pressure : float
+        Pressure reported, clamped to the sensor range.
+    status : int
+        Status bits: ``0`` (normal), ``1`` (command mode), ``2`` (stale data)
+        or ``3`` (diagnostic condition).
+    '''
+    def __init__(self, pressure=0., pressure_min=0, pressure_max=60):
+        self.pressure = pressure
+        self.pressure_min = pressure_min
+        self.pressure_max = pressure_max
+        self.status = 0
+
+    def count(self):
+        '''14 bit count of the current pressure.'''
+        span = self.pressure_max - self.pressure_min
+        fraction = max(0, min(1, (self.pressure - self.pressure_min) / span))
+        return int(round((.1 + .8 * fraction) * (1 << 14)))
+
+    def write(self, data):
+        pass
+
+    def read(self, n):
+        frame = struct.pack('>H', self.status << 14 | self.count())
+        return frame[:n] + b'\xff' * (n - len(frame))
+
+
+def crc8(data):
+    '''
+    Sensirion CRC-8 (polynomial 0x31, initial value 0xff), bit by bit.
+    '''
+    crc = 0xff
+    for byte in data:
+        crc ^= byte
+        for i in range(8):
+            crc = (crc << 1 ^ 0x31 if crc & 0x80 else crc << 1) & 0xff
+    return crc
+
+
+class SLF3SDevice:
+    '''
+    Model of a Sensirion SLF3S-1300F liquid flow sensor (see
+    ``sensiron.SLF3S_1300F``).
+
+    Data is sent as big-endian 16 bit words, each followed by its CRC-8.
+    Once a continuous measurement is started, reads return the flow
+    (``flow * 500``, in mL/min), the temperature (``temperature * 200``, in
+    degrees C) and the signaling flags.  Reads with no measurement running
+    or no product information requested are not acknowledged.
+
+    Attributes
+    ----------
+    flow : float
+        Flow in mL/min.
+    temperature : float
+        Temperature in degrees C.
+    flags : int
+        Signaling flags: air-in-line (bit 0), high flow (bit 1) and
+        exponential smoothing active (bit 5).
+    medium : str or None
+        ``'water'`` or ``'isopropyl alcohol'`` while measuring, else ``None``.
+    corrupt : bool
+        If ``True``, send a wrong CRC with every word, e.g., to test error
+        handling.
+    '''
+    PRODUCT_NUMBER = 0x07030302
+    START_WATER = 0x3608
+    START_IPA = 0x3615
+    STOP = 0x3ff9
+    READ_PRODUCT_1 = 0x367c
+    READ_PRODUCT_2 = 0xe102
+
+    def __init__(self, flow=0., temperature=25., serial_number=1234567890):
+        self.flow = flow
+        self.temperature = temperature
+        self.flags = 0
+        self.serial_number = serial_number
+        self.medium = None
+        self.corrupt = False
+        #: Commands received, in order.
+        self.commands = []
+        self._command = None
+
+    def write(self, data):
+        command = struct.unpack('>H', data[:2])[0]
+        self.commands.append(command)
+        if command == self.START_WATER:
+            self.medium = 'water'
+        elif command == self.START_IPA:
+            self.medium = 'isopropyl alcohol'
+        elif command == self.STOP:
+            self.medium = None
+        elif command not in (self.READ_PRODUCT_1, self.READ_PRODUCT_2):
+            raise OSError(ENODEV)
+        self._command = command
+
+    def _words(self):
+        if self._command == self.READ_PRODUCT_2:
+            self._command = None
+            serial = self.serial_number
+            return (self.PRODUCT_NUMBER >> 16, self.PRODUCT_NUMBER & 0xffff,
+                    serial >> 48 & 0xffff, serial >> 32 & 0xffff,
+                    serial >> 16 & 0xffff, serial & 0xffff)
+        if self.medium is None:
+            raise OSError(ENODEV)
+        flow = max(-32768, min(32767, int(round(self.flow * 500))))
+        temperature = int(round(self.temperature * 200))
+        return flow & 0xffff, temperature & 0xffff, self.flags
+
+    def read(self, n):
+        data = bytearray()
+        for word in self._words():
+            pair = struct.pack('>H', word)
+            data += pair + bytes((crc8(pair) ^ self.corrupt, ))
+        return bytes(data[:n]) + b'\xff' * (n - len(data))
@@ -0,0 +1,418 @@
+'''
+Host runtime for the ``fast_io`` fork of ``uasyncio`` in ``_lib/uasyncio``.
+
+:func:`install` registers pure-Python stand-ins for the MicroPython-only
+modules the fork imports (``utime``, ``utimeq``, ``ucollections``,
+``uselect``, ``uerrno``, ``usocket`` and ``micropython``) so that the fork
+runs unmodified on a workstation, driven by a :class:`sim.clock.Clock`.
+
+Under CPython, ``async def`` functions return coroutine objects rather than
+generators, so tasks are wrapped in :class:`Task`, which adds the
+``pend_throw()`` method the fork relies on.  Under the Unix port of
+MicroPython only the clock is replaced.
+
+``benchmarks/harness.py`` installs it for every benchmark run under CPython.
+
+Example::
+
+    from sim import uasyncio_host
+    clock = uasyncio_host.install()
+    import uasyncio as asyncio
+'''
+import errno
+import sys
+import types
+
+from sim.clock import Clock, ticks_diff
+
+
+CPYTHON = sys.implementation.name != 'micropython'
+MP_STREAM_POLL = 3
+MP_STREAM_POLL_RD = 0x0001
+MP_STREAM_POLL_WR = 0x0004
+
+_clock = None
+
+
+# `micropython.schedule` #####################################################
+_scheduled = []
+_scheduling = [False]
+
+
+def _schedule(function, arg):
+    '''
+    Run ``function(arg)`` now, unless a scheduled function is already
+    running; like on the device, scheduled functions do not nest.
+    '''
+    if len(_scheduled) >= 8:
+        raise RuntimeError('schedule queue full')
+    _scheduled.append((function, arg))
+    if _scheduling[0]:
+        return
+    _scheduling[0] = True
+    try:
+        while _scheduled:
+            function, arg = _scheduled.pop(0)
+            function(arg)
+    finally:
+        _scheduling[0] = False
+
+
+# `utimeq` ###################################################################
+class utimeq:
+    '''Bounded priority queue ordered by (wrapping) ticks, like `utimeq`.'''
+    def __init__(self, maxlen):
+        self._maxlen = maxlen
+        self._heap = []
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __bool__(self):
+        return bool(self._heap)
+
+    def _less(self, a, b):
+        diff = ticks_diff(a[0], b[0])
+        return diff < 0 or (diff == 0 and a[1] < b[1])
+
+    def push(self, time, callback, args):
+        heap = self._heap
+        if len(heap) >= self._maxlen:
+            raise IndexError('queue overflow')
+        self._sequence += 1
+        heap.append((time, self._sequence, callback, args))
+        i = len(heap) - 1
+        while i:
+            parent = (i - 1) >> 1
+            if not self._less(heap[i], heap[parent]):
+                break
+            heap[i], heap[parent] = heap[parent], heap[i]
+            i = parent
+
+    def pop(self, result):
+        heap = self._heap
+        if not heap:
+            raise IndexError('empty heap')
+        entry = heap[0]
+        last = heap.pop()
+        if heap:
+            heap[0] = last
+            i = 0
+            n = len(heap)
+            while True:
+                child = 2 * i + 1
+                if child >= n:
+                    break
+                if child + 1 < n and self._less(heap[child + 1], heap[child]):
+                    child += 1
+                if not self._less(heap[child], heap[i]):
+                    break
+                heap[i], heap[child] = heap[child], heap[i]
+                i = child
+        result[0] = entry[0]
+        result[1] = entry[2]
+        result[2] = entry[3]
+
+    def peektime(self):
+        if not self._heap:
+            raise IndexError('empty heap')
+        return self._heap[0][0]
+
+
+# `ucollections` ##############################################################
+class deque:
+    '''Bounded deque; flag bit 0 raises `IndexError` on overflow.'''
+    def __init__(self, iterable, maxlen, flags=0):
+        import collections
+        self._items = collections.deque(iterable)
+        self._maxlen = maxlen
+        self._flags = flags
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    def append(self, item):
+        if len(self._items) >= self._maxlen:
+            if self._flags & 1:
+                raise IndexError('full')
+            self._items.popleft()
+        self._items.append(item)
+
+    def popleft(self):
+        if not self._items:
+            raise IndexError('empty')
+        return self._items.popleft()
+
+
+# `uselect` ###################################################################
+class Poll:
+    '''
+    ``select.poll`` stand-in for objects implementing the MicroPython stream
+    ``ioctl`` protocol (e.g. ``uasyncio.ms_timer.MillisecTimer``).
+    '''
+    def __init__(self):
+        self._objects = {}
+
+    def register(self, obj, eventmask=MP_STREAM_POLL_RD | MP_STREAM_POLL_WR):
+        self._objects[id(obj)] = [obj, eventmask]
+
+    def modify(self, obj, eventmask):
+        self._objects[id(obj)][1] = eventmask
+
+    def unregister(self, obj):
+        self._objects.pop(id(obj), None)
+
+    def _ready(self):
+        ready = []
+        for obj, eventmask in list(self._objects.values()):
+            events = obj.ioctl(MP_STREAM_POLL, eventmask)
+            if events:
+                ready.append((obj, events))
+        return ready
+
+    def ipoll(self, timeout=-1, flags=0):
+        ready = self._ready()
+        if ready:
+            return ready
+        elif timeout == 0:
+            # An event loop pass still takes time.
+            _clock.sleep_us(0)
+            return ready
+        if timeout < 0:
+            if not self._objects:
+                raise RuntimeError('Event loop idle: nothing left to run.')
+            timeout = 1
+        if not self._objects:
+            _clock.sleep_ms(timeout)
+            return []
+        # Re-check the registered objects every millisecond.
+        for _ in range(timeout):
+            _clock.sleep_ms(1)
+            ready = self._ready()
+            if ready:
+                break
+        return ready
+
+    poll = ipoll
+
+
+# CPython tasks ###############################################################
+class Task:
+    '''
+    Wraps a CPython coroutine with the generator interface the fork uses,
+    including MicroPython's ``pend_throw()``.
+    '''
+    _by_coro = {}
+
+    def __init__(self, coro):
+        self.coro = coro
+        self._pending = None
+        Task._by_coro[id(coro)] = self
+
+    @classmethod
+    def wrap(cls, obj):
+        if isinstance(obj, (types.CoroutineType, types.GeneratorType)):
+            task = cls._by_coro.get(id(obj))
+            if task is None or task.coro is not obj:
+                task = cls(obj)
+            return task
+        return obj
+
+    def pend_throw(self, value):
+        previous = self._pending
+        self._pending = value
+        return previous
+
+    def send(self, value):
+        pending = self._pending
+        try:
+            if pending is None:
+                return self.coro.send(value)
+            self._pending = None
+            if not (isinstance(pending, BaseException) or
+                    (isinstance(pending, type) and
+                     issubclass(pending, BaseException))):
+                pending = TypeError('exceptions must derive from '
+                                    'BaseException')
+            return self.coro.throw(pending)
+        except BaseException:
+            Task._by_coro.pop(id(self.coro), None)
+            raise
+
+    def __next__(self):
+        return self.send(None)
+
+    def __iter__(self):
+        return self
+
+    def throw(self, *args):
+        return self.coro.throw(*args)
+
+    def close(self):
+        Task._by_coro.pop(id(self.coro), None)
+        self.coro.close()
+
+    def __repr__(self):
+        # As the wrapped coroutine, e.g., for `uasyncio.core` statistics.
+        return repr(self.coro)
+
+
+class _AwaitIter:
+    '''Make a coroutine usable with `yield from` in a plain generator.'''
+    def __init__(self, coro):
+        self.coro = coro
+
+    def __iter__(self):
+        if isinstance(self.coro, types.CoroutineType):
+            return self.coro.__await__()
+        return iter(self.coro)
+
+
+def _patch_core(core):
+    core.type_gen = Task
+    core.SleepMs.__await__ = core.SleepMs.__iter__
+    core.sleep = types.coroutine(core.sleep)
+    cancel = core.cancel
+    wait_for_ms = core.wait_for_ms
+
+    def cancel_(coro):
+        return cancel(Task.wrap(coro))
+
+    @types.coroutine
+    def wait_for_ms_(coro, timeout):
+        return (yield from wait_for_ms(_AwaitIter(coro), timeout))
+
+    @types.coroutine
+    def wait_for_(coro, timeout):
+        return (yield from wait_for_ms_(coro, int(timeout * 1000)))
+
+    core.cancel = cancel_
+    core.wait_for_ms = wait_for_ms_
+    core.wait_for = wait_for_
+
+    def wrap_method(name, timed):
+        method = getattr(core.EventLoop, name)
+
+        if timed:
+            def wrapped(self, time, callback, *args):
+                return method(self, time, Task.wrap(callback), *args)
+        else:
+            def wrapped(self, callback, *args):
+                return method(self, Task.wrap(callback), *args)
+        setattr(core.EventLoop, name, wrapped)
+
+    run_until_complete = core.EventLoop.run_until_complete
+
+    def run_until_complete_(self, coro):
+        return run_until_complete(self, _AwaitIter(coro))
+    core.EventLoop.run_until_complete = run_until_complete_
+
+    for name in ('call_soon', '_call_now'):
+        wrap_method(name, False)
+    for name in ('call_at_', 'call_at_lp_'):
+        wrap_method(name, True)
+
+
+def _patch_uasyncio(uasyncio):
+    import uasyncio.core as core
+    for name in ('sleep', 'cancel', 'wait_for_ms', 'wait_for'):
+        setattr(uasyncio, name, getattr(core, name))
+    for cls in (uasyncio.StreamReader, uasyncio.StreamWriter):
+        for name, value in list(vars(cls).items()):
+            if isinstance(value, types.FunctionType) and \
+                    value.__code__.co_flags & 0x20:  # CO_GENERATOR
+                setattr(cls, name, types.coroutine(value))
+    for name in ('open_connection', 'start_server'):
+        setattr(uasyncio, name, types.coroutine(getattr(uasyncio, name)))
+
+
+class _Finder:
+    '''Patch the fork as it is imported.'''
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in ('uasyncio', 'uasyncio.core'):
+            return None
+        import importlib.machinery
+        sys.meta_path.remove(self)
+        try:
+            spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+        finally:
+            sys.meta_path.insert(0, self)
+        if spec is None:
+            return None
+        loader = spec.loader
+        exec_module = loader.exec_module
+
+        def exec_module_(module):
+            exec_module(module)
+            if fullname == 'uasyncio.core':
+                _patch_core(module)
+            else:
+                _patch_uasyncio(module)
+        loader.exec_module = exec_module_
+        return spec
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def install(clock=None):
+    '''
+    Register the stand-in modules and patch the ``time`` module to follow
+    ``clock``.
+
+    Must be called before ``uasyncio`` is imported.
+
+    Parameters
+    ----------
+    clock : sim.clock.Clock, optional
+        Clock to drive the event loop.  By default, a new virtual clock.
+
+    Returns
+    -------
+    sim.clock.Clock
+    '''
+    global _clock
+    if clock is None:
+        clock = Clock()
+    _clock = clock
+    if 'uasyncio.core' in sys.modules:
+        raise RuntimeError('`install()` must be called before importing '
+                           '`uasyncio`.')
+
+    import time
+    names = ('ticks_ms', 'ticks_us', 'ticks_cpu', 'ticks_add', 'ticks_diff',
+             'sleep_ms', 'sleep_us', 'sleep', 'time')
+    for name in names:
+        setattr(time, name, getattr(clock, name))
+    _module('utime', **dict((name, getattr(clock, name)) for name in names))
+
+    if CPYTHON:
+        import collections
+        import socket
+        _module('utimeq', utimeq=utimeq)
+        _module('ucollections', deque=deque,
+                namedtuple=collections.namedtuple,
+                OrderedDict=collections.OrderedDict)
+        _module('uselect', poll=Poll, POLLIN=MP_STREAM_POLL_RD,
+                POLLOUT=MP_STREAM_POLL_WR, POLLERR=0x0008, POLLHUP=0x0010)
+        _module('uerrno', errorcode=errno.errorcode,
+                **dict((name, getattr(errno, name))
+                       for name in dir(errno) if name.startswith('E')))
+        sys.modules['usocket'] = socket
+        _module('micropython', const=lambda value: value,
+                schedule=_schedule,
+                native=lambda function: function,
+                viper=lambda function: function,
+                alloc_emergency_exception_buf=lambda size: None)
+        import builtins
+        builtins.const = lambda value: value
+        sys.meta_path.insert(0, _Finder())
+    return clock
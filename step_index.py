@@ -0,0 +1,166 @@
+'''
+Compile ``config.steps`` into a pre-resolved step index.
+'''
+import dosing
+import grove_i2c_motor as gm
+
+
+OUTPUT_PINS = (gm.IN1, gm.IN2, gm.IN3, gm.IN4)
+
+
+class Step:
+    '''
+    Step with its pumps, valves and switches resolved to board outputs.
+
+    Attributes
+    ----------
+    index : int
+        Position in the flattened step list (and on the "Steps" tab).
+    label : str
+    group : str
+        Name of the enclosing step group in ``config.steps``.
+    config : dict
+        Step as specified in ``config.steps``.
+    pump_names : tuple[str]
+    pumps : tuple[tuple]
+        ``(addr, pin)`` of every pump.
+    valves : tuple[tuple]
+        ``(addr, pin, path, settle_ms)`` for every valve, where
+        ``settle_ms`` is the time the valve takes to switch.
+    switches : tuple[tuple]
+        ``(pin, value)`` for every switch.
+    boards : tuple[tuple]
+        ``(addr, valves)`` for every board with valves of the step, where
+        ``valves`` holds ``(i, pin, path, settle_ms)`` for each of them and
+        ``i`` is its position in :attr:`valves`.
+    pulses : int
+        Pulse count specified by the step, or ``None``.
+    doses : list[tuple]
+        ``(pulses, period_ms)`` per pump for steps with a ``volume`` (see
+        :func:`dosing.step_doses`), otherwise ``None``.
+    '''
+    def __init__(self, index, group, config, address_map, calibrations,
+                 valve_settle_ms=0):
+        self.index = index
+        self.label = config['label']
+        self.group = group
+        self.config = config
+        pumps = config.get('pump', [])
+        self.pump_names = tuple(pumps if isinstance(pumps, list)
+                                else [pumps])
+        self.pumps = tuple(_output(address_map, name, self.label)
+                           for name in self.pump_names)
+        self.valves = tuple(_output(address_map, valve['valve'], self.label) +
+                            (valve['path'],
+                             address_map[valve['valve']].get(
+                                 'settle_ms', valve_settle_ms))
+                            for valve in config.get('valves', ()))
+        self.switches = tuple((switch['pin'], switch['value'])
+                              for switch in config.get('switches', ()))
+        boards = {}
+        for i, (addr, pin, path, settle_ms) in enumerate(self.valves):
+            boards.setdefault(addr, []).append((i, pin, path, settle_ms))
+        self.boards = tuple((addr, tuple(valves))
+                            for addr, valves in sorted(boards.items()))
+        self.pulses = config.get('pulses')
+        self.doses = (None if calibrations is None
+                      else dosing.step_doses(config, calibrations))
+
+
+def _output(address_map, name, label):
+    try:
+        output = address_map[name]
+    except KeyError:
+        raise ValueError('Step `%s`: unknown pump/valve `%s`.' %
+                         (label, name))
+    return output['addr'], OUTPUT_PINS[output['index']]
+
+
+class StepIndex:
+    '''
+    All steps of ``config.steps``, compiled in a single pass.
+
+    Parameters
+    ----------
+    steps : list[dict]
+        Step groups, as in ``config.steps``.
+    address_map : dict
+        Mapping from pump/valve name to board output (see
+        ``config.address_map``).
+    calibrations : dict, optional
+        Mapping from pump name to ``dosing.Calibration``, used to precompute
+        the doses of steps with a ``volume``.  If ``None``, doses are not
+        computed.
+    valve_settle_ms : int, optional
+        Settle time of valves without a ``settle_ms`` in ``address_map``.
+
+    Attributes
+    ----------
+    steps : list[Step]
+        Steps in order.
+    names : tuple[str]
+        Step labels, in order.
+    pumps, valves : list[str]
+        Sorted names of the pumps and valves used by any step.
+    switches : list[int]
+        Sorted pins of the switches used by any step.
+
+    Raises
+    ------
+    ValueError
+        If a step references a pump or valve missing from ``address_map``,
+        or if two steps share a label.
+    '''
+    def __init__(self, steps, address_map, calibrations=None,
+                 valve_settle_ms=0):
+        self.steps = []
+        self._index = {}
+        pumps = set()
+        valves = set()
+        switches = set()
+        for group in steps:
+            for config in group['steps']:
+                step = Step(len(self.steps), group['name'], config,
+                            address_map, calibrations, valve_settle_ms)
+                if step.label in self._index:
+                    raise ValueError('Duplicate step label `%s`.' %
+                                     step.label)
+                self._index[step.label] = step.index
+                self.steps.append(step)
+                pumps.update(step.pump_names)
+                valves.update(valve['valve']
+                              for valve in config.get('valves', ()))
+                switches.update(pin for pin, value in step.switches)
+        self.names = tuple(step.label for step in self.steps)
+        self.pumps = sorted(pumps)
+        self.valves = sorted(valves)
+        self.switches = sorted(switches)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __getitem__(self, i):
+        return self.steps[i]
+
+    def index(self, label):
+        '''
+        Returns
+        -------
+        int
+            Position of the step labelled ``label``.
+
+        Raises
+        ------
+        KeyError
+            If there is no such step.
+        '''
+        return self._index[label]
+
+    def find(self, label):
+        '''
+        Returns
+        -------
+        Step
+            Step labelled ``label``.
+        '''
+        return self.steps[self._index[label]]
\ No newline at end of file
@@ -2,8 +2,7 @@ import gc
 import uasyncio as asyncio
 gc.collect()
 
-from base_node import BaseDriver
-import lvgl as lv
+from drivers import get_port_writer
 
 
 async def set_valve(i2c, i2c_address, pin, state):
@@ -19,11 +18,9 @@ async def set_valve(i2c, i2c_address, pin, state):
     state : bool
         If ``False`` set to ``A`` branch. Otherwise, set to ``B`` branch.
     '''
-    driver = BaseDriver(i2c, i2c_address)
+    writer = get_port_writer(i2c, i2c_address)
     await asyncio.sleep_ms(0)
     try:
-        driver.digital_write(pin, state)
+        await writer.write(pin, state)
     except Exception as exception:
-        print('Error setting valve:', exception)
-    del driver
-    gc.collect()
\ No newline at end of file
+        print('Error setting valve:', exception)
\ No newline at end of file